@@ -0,0 +1,73 @@
+// Applies the Overview deltas pushed on /push/overview to the tables and
+// indicators on the page. Only used when the dashboard runs with DASHBOARD_PUSH=1.
+(function () {
+    var source = null;
+    var state = null;
+
+    function rows(table) {
+        return table.order.map(function (key) { return table.rows[key]; });
+    }
+
+    function indicator(title, now, prev, column) {
+        var trace = {
+            type: "indicator", mode: prev > 0 ? "number+delta" : "number",
+            title: {text: title}, value: now, domain: {row: 0, column: column}
+        };
+        if (prev > 0) {
+            trace.delta = {reference: prev, relative: true};
+        }
+        return trace;
+    }
+
+    function render() {
+        var setProps = window.dash_clientside.set_props;
+        setProps("pairs-table", {data: rows(state.tables.pairs)});
+        setProps("overview-assets-table", {data: rows(state.tables.assets)});
+
+        var now = state.totals.now, prev = state.totals.prev;
+        setProps("aggregate-trades-graph", {figure: {
+            data: [
+                indicator("Transactions", now.count, prev.count, 0),
+                indicator("Amount Traded", now.amountTraded, prev.amountTraded, 1)
+            ],
+            layout: {height: 300, grid: {rows: 1, columns: 2, pattern: "independent"}}
+        }});
+        setProps("latest-timestamp", {children: "Data as of: " + new Date(state.updatedAt).toISOString()});
+    }
+
+    function apply(message) {
+        if (message.type === "snapshot") {
+            state = message;
+        } else if (state !== null) {
+            Object.keys(message.tables).forEach(function (name) {
+                var table = state.tables[name], delta = message.tables[name];
+                Object.assign(table.rows, delta.upsert || {});
+                (delta.remove || []).forEach(function (key) { delete table.rows[key]; });
+                if (delta.order) {
+                    table.order = delta.order;
+                }
+            });
+            if (message.totals) {
+                state.totals = message.totals;
+            }
+            state.updatedAt = message.updatedAt;
+        }
+        if (state !== null) {
+            render();
+        }
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        push: {
+            subscribe: function (interval) {
+                if (source !== null) {
+                    source.close();
+                }
+                state = null;
+                source = new EventSource("/push/overview?interval=" + interval);
+                source.onmessage = function (event) { apply(JSON.parse(event.data)); };
+                return "Streaming last " + interval + " minute(s)";
+            }
+        }
+    });
+})();
@@ -0,0 +1,128 @@
+import struct
+
+_double = struct.Struct("<d")
+_float = struct.Struct("<f")
+
+
+def _write_long(n, out):
+    n = (n << 1) ^ (n >> 63)
+    while n & ~0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_long(data, offset):
+    shift = n = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        n |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return (n >> 1) ^ -(n & 1), offset
+        shift += 7
+
+
+def encode_long(n):
+    out = bytearray()
+    _write_long(n, out)
+    return bytes(out)
+
+
+def _write_bytes(value, out):
+    _write_long(len(value), out)
+    out += value
+
+
+def _writer(avro_type):
+    if isinstance(avro_type, list):
+        branches = [(_type_name(branch), _writer(branch)) for branch in avro_type]
+        null_index = next((i for i, (name, _) in enumerate(branches) if name == "null"), None)
+        value_index, value_writer = next((i, w) for i, (name, w) in enumerate(branches) if name != "null")
+
+        def write_union(value, out):
+            if value is None:
+                _write_long(null_index, out)
+            else:
+                _write_long(value_index, out)
+                value_writer(value, out)
+        return write_union
+
+    name = _type_name(avro_type)
+    if name == "null":
+        return lambda value, out: None
+    if name == "boolean":
+        return lambda value, out: out.append(1 if value else 0)
+    if name in ("int", "long"):
+        return lambda value, out: _write_long(int(value), out)
+    if name == "double":
+        return lambda value, out: out.extend(_double.pack(float(value)))
+    if name == "float":
+        return lambda value, out: out.extend(_float.pack(float(value)))
+    if name == "string":
+        return lambda value, out: _write_bytes(value.encode('utf-8'), out)
+    if name == "bytes":
+        return _write_bytes
+    raise ValueError(f"Unsupported Avro type: {avro_type}")
+
+
+def _reader(avro_type):
+    if isinstance(avro_type, list):
+        readers = [_reader(branch) for branch in avro_type]
+
+        def read_union(data, offset):
+            index, offset = _read_long(data, offset)
+            return readers[index](data, offset)
+        return read_union
+
+    name = _type_name(avro_type)
+    if name == "null":
+        return lambda data, offset: (None, offset)
+    if name == "boolean":
+        return lambda data, offset: (data[offset] == 1, offset + 1)
+    if name in ("int", "long"):
+        return _read_long
+    if name == "double":
+        return lambda data, offset: (_double.unpack_from(data, offset)[0], offset + 8)
+    if name == "float":
+        return lambda data, offset: (_float.unpack_from(data, offset)[0], offset + 4)
+    if name in ("string", "bytes"):
+        def read_bytes(data, offset):
+            length, offset = _read_long(data, offset)
+            value = bytes(data[offset:offset + length])
+            return (value.decode('utf-8') if name == "string" else value), offset + length
+        return read_bytes
+    raise ValueError(f"Unsupported Avro type: {avro_type}")
+
+
+def _type_name(avro_type):
+    return avro_type["type"] if isinstance(avro_type, dict) else avro_type
+
+
+class RecordCodec:
+    """
+        Schemaless Avro binary encoding for flat records of primitive fields
+        (and ["null", T] unions), i.e. what Pinot's SimpleAvroMessageDecoder
+        reads off a topic. Field writers are built once per schema.
+    """
+
+    def __init__(self, schema):
+        if schema.get("type") != "record":
+            raise ValueError("Only record schemas are supported")
+        self.schema = schema
+        self.field_names = [field["name"] for field in schema["fields"]]
+        self._writers = [(field["name"], _writer(field["type"])) for field in schema["fields"]]
+        self._readers = [(field["name"], _reader(field["type"])) for field in schema["fields"]]
+
+    def encode(self, record):
+        out = bytearray()
+        for name, write in self._writers:
+            write(record.get(name), out)
+        return bytes(out)
+
+    def decode(self, data):
+        record = {}
+        offset = 0
+        for name, read in self._readers:
+            record[name], offset = read(data, offset)
+        return record
@@ -0,0 +1,266 @@
+import argparse
+import concurrent.futures
+import datetime
+import glob
+import gzip
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Typed columns of the trades schema, plus tsMs which the realtime table
+# derives from ts at ingestion
+SCHEMA = pa.schema([
+    ("externalId", pa.string()),
+    ("orderSide", pa.string()),
+    ("exchangeId", pa.int64()),
+    ("currencyPairId", pa.int64()),
+    ("marketId", pa.int64()),
+    ("ts", pa.int64()),
+    ("tsMs", pa.int64()),
+    ("price", pa.float64()),
+    ("amount", pa.float64()),
+    ("tsNano", pa.int64()),
+])
+INT_FIELDS = ["exchangeId", "currencyPairId", "marketId", "ts", "tsNano"]
+FLOAT_FIELDS = ["price", "amount"]
+
+JOB_SPEC_TEMPLATE = "config/trades-backfill-job-spec.yml"
+ADMIN_COMMAND = "docker exec pinot-controller-crypto bin/pinot-admin.sh"
+
+
+def normalize(record):
+    """
+        A trade as dumped from the trades topic (every value a string, as in
+        input/trades.json) with the types the table schema expects, or None
+        for a trade without a ts, which can't be placed in a day
+    """
+    if record.get("ts") in (None, ""):
+        return None
+    row = {field: int(record[field]) if field in record else None for field in INT_FIELDS}
+    row.update({field: float(record[field]) if field in record else None for field in FLOAT_FIELDS})
+    row["externalId"] = record.get("externalId")
+    row["orderSide"] = record.get("orderSide")
+    row["tsMs"] = row["ts"] * 1000
+    return row
+
+
+def day_of(ts_ms):
+    return datetime.datetime.fromtimestamp(ts_ms / 1000, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+def _open(path):
+    return gzip.open(path, "rt") if path.endswith(".gz") else open(path)
+
+
+def archive_id(path):
+    return hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:12]
+
+
+def _write_chunk(staging_dir, day, prefix, number, rows):
+    day_dir = os.path.join(staging_dir, day)
+    os.makedirs(day_dir, exist_ok=True)
+    columns = {field.name: [row[field.name] for row in rows] for field in SCHEMA}
+    path = os.path.join(day_dir, f"{prefix}-{number:05d}.parquet")
+    pq.write_table(pa.table(columns, schema=SCHEMA), path)
+    return path
+
+
+def split_archive(path, staging_dir, chunk_rows=500000, max_buffered_rows=2000000):
+    """
+        Streams one archive of JSON lines and writes its trades, typed, into
+        per-day Parquet chunks under staging_dir/<day>/. A day's trades are
+        written out every chunk_rows, and whenever more than
+        max_buffered_rows trades are held in memory over all days, the
+        largest day's are. Lines that aren't a trade with a ts are skipped.
+        Returns (trades per day, lines skipped).
+    """
+    prefix = archive_id(path)
+    # chunks left behind by an interrupted run of this archive
+    for stale in glob.glob(os.path.join(staging_dir, "*", f"{prefix}-*.parquet")):
+        os.remove(stale)
+
+    buffers, chunk_numbers, counts = {}, {}, {}
+    buffered = skipped = 0
+
+    def write(day):
+        nonlocal buffered
+        chunk_numbers[day] = chunk_numbers.get(day, 0) + 1
+        _write_chunk(staging_dir, day, prefix, chunk_numbers[day], buffers[day])
+        buffered -= len(buffers[day])
+        buffers[day] = []
+
+    with _open(path) as archive:
+        for line in archive:
+            if not line.strip():
+                continue
+            try:
+                row = normalize(json.loads(line))
+            except (ValueError, TypeError, AttributeError):
+                row = None
+            if row is None:
+                skipped += 1
+                continue
+            day = day_of(row["tsMs"])
+            buffer = buffers.setdefault(day, [])
+            buffer.append(row)
+            buffered += 1
+            counts[day] = counts.get(day, 0) + 1
+            if len(buffer) >= chunk_rows:
+                write(day)
+            elif buffered > max_buffered_rows:
+                write(max(buffers, key=lambda other: len(buffers[other])))
+    for day, buffer in buffers.items():
+        if buffer:
+            write(day)
+    return counts, skipped
+
+
+def sort_day(day, staging_dir, output_dir, row_group_size=100000):
+    """
+        Merges a day's chunks into one Parquet file sorted by currencyPairId,
+        then tsMs, so segments built from it are sorted on the offline table's
+        sortedColumn and each pair's trades are stored in time order
+    """
+    chunks = sorted(glob.glob(os.path.join(staging_dir, day, "*.parquet")))
+    table = pa.concat_tables([pq.read_table(chunk, schema=SCHEMA) for chunk in chunks])
+    table = table.sort_by([("currencyPairId", "ascending"), ("tsMs", "ascending")])
+    day_dir = os.path.join(output_dir, day)
+    os.makedirs(day_dir, exist_ok=True)
+    path = os.path.join(day_dir, f"trades_{day}.parquet")
+    pq.write_table(table, path + ".tmp", row_group_size=row_group_size)
+    os.replace(path + ".tmp", path)
+    return table.num_rows
+
+
+def generate_segments(day, work_dir, data_dir, container_data_dir, admin_command, dry_run=False):
+    """
+        Renders the job spec template for one day's Parquet file and runs
+        Pinot's ingestion job on it. Paths are translated from data_dir on
+        this machine to container_data_dir, where docker-compose mounts it.
+    """
+    def in_container(path):
+        return os.path.join(container_data_dir, os.path.relpath(path, data_dir))
+
+    with open(JOB_SPEC_TEMPLATE) as template_file:
+        spec = template_file.read().format(
+            input_dir=in_container(os.path.join(work_dir, "days", day)),
+            output_dir=in_container(os.path.join(work_dir, "segments", day)),
+            day=day.replace("-", ""),
+        )
+    spec_path = os.path.join(work_dir, "days", day, "job-spec.yml")
+    with open(spec_path, "w") as spec_file:
+        spec_file.write(spec)
+
+    command = shlex.split(admin_command) + ["LaunchDataIngestionJob", "-jobSpecFile", in_container(spec_path)]
+    if dry_run:
+        print(" ".join(command))
+        return
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+
+class Progress:
+    """
+        Which archives, days and segment jobs are done, saved after every
+        step so an interrupted backfill picks up where it stopped
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {"archives": {}, "sorted": {}, "segments": {}}
+        if os.path.exists(path):
+            with open(path) as progress_file:
+                self.state = json.load(progress_file)
+
+    def save(self):
+        with open(self.path + ".tmp", "w") as progress_file:
+            json.dump(self.state, progress_file, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+    @staticmethod
+    def archive_key(path):
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def run_pool(workers, jobs, on_done):
+    """
+        jobs maps a name to (fn, args); on_done(name, result) runs in this
+        process as each finishes
+    """
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = {executor.submit(fn, *args): name for name, (fn, args) in jobs.items()}
+        for future in concurrent.futures.as_completed(futures):
+            on_done(futures[future], future.result())
+
+
+def backfill(archives, data_dir="data", workers=None, chunk_rows=500000, container_data_dir="/data",
+             admin_command=ADMIN_COMMAND, skip_segments=False, dry_run=False, max_buffered_rows=2000000):
+    work_dir = os.path.join(data_dir, "backfill")
+    staging_dir = os.path.join(work_dir, "staging")
+    output_dir = os.path.join(work_dir, "days")
+    os.makedirs(work_dir, exist_ok=True)
+    progress = Progress(os.path.join(work_dir, "progress.json"))
+    state = progress.state
+
+    # 1. archives -> typed per-day chunks, one archive per process
+    pending = {path: (split_archive, (path, staging_dir, chunk_rows, max_buffered_rows)) for path in archives
+               if state["archives"].get(Progress.archive_key(path)) is None}
+
+    def archive_done(path, result):
+        counts, skipped = result
+        state["archives"][Progress.archive_key(path)] = counts
+        progress.save()
+        print(f"Split {path}: {sum(counts.values())} trades over {len(counts)} days, {skipped} lines skipped")
+
+    run_pool(workers, pending, archive_done)
+
+    # 2. chunks -> one sorted file per day; a day is redone when its chunks changed
+    days = sorted(os.listdir(staging_dir)) if os.path.isdir(staging_dir) else []
+    chunks_of = {day: sorted(os.listdir(os.path.join(staging_dir, day))) for day in days}
+    pending = {day: (sort_day, (day, staging_dir, output_dir)) for day in days
+               if state["sorted"].get(day) != chunks_of[day]}
+
+    def day_done(day, rows):
+        state["sorted"][day] = chunks_of[day]
+        state["segments"].pop(day, None)
+        progress.save()
+        print(f"Sorted {day}: {rows} trades")
+
+    run_pool(workers, pending, day_done)
+
+    # 3. one Pinot ingestion job per day
+    if skip_segments:
+        return
+    pending = {day: (generate_segments, (day, work_dir, data_dir, container_data_dir, admin_command, dry_run))
+               for day in days if not state["segments"].get(day)}
+
+    def segments_done(day, _):
+        if not dry_run:
+            state["segments"][day] = True
+            progress.save()
+        print(f"Ingestion job for {day} done")
+
+    run_pool(workers, pending, segments_done)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backfill the trades table from archives of JSON lines trades")
+    parser.add_argument("archives", nargs="+", help="Files of JSON lines as written to the trades topic (.gz ok)")
+    parser.add_argument("--data-dir", default="data", help="Directory mounted into the Pinot containers")
+    parser.add_argument("--container-data-dir", default="/data")
+    parser.add_argument("--workers", type=int, default=None, help="Processes to use (default: one per core)")
+    parser.add_argument("--chunk-rows", type=int, default=500000)
+    parser.add_argument("--max-buffered-rows", type=int, default=2000000,
+                        help="Trades held in memory per process over all days")
+    parser.add_argument("--admin-command", default=ADMIN_COMMAND)
+    parser.add_argument("--skip-segments", action="store_true", help="Only write the sorted Parquet files")
+    parser.add_argument("--dry-run", action="store_true", help="Print the ingestion commands instead of running them")
+    args = parser.parse_args()
+
+    backfill(args.archives, args.data_dir, args.workers, args.chunk_rows, args.container_data_dir,
+             args.admin_command, args.skip_segments, args.dry_run, args.max_buffered_rows)
@@ -0,0 +1,123 @@
+import argparse
+import concurrent.futures
+import statistics
+import time
+
+from pinotdb import connect
+
+import querydb
+import result_decoding
+
+
+class CountingCursor:
+    """
+        Wraps a pinotdb cursor and counts broker round trips
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.round_trips = 0
+
+    def execute(self, operation, parameters=None):
+        self.round_trips += 1
+        return self.cursor.execute(operation, parameters)
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def raw_query_response(self):
+        return getattr(self.cursor, "raw_query_response", None)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def latest_period_prices(cursor, base_name, interval):
+    # The Assets tab's price stats before asset_snapshot, kept here for the comparison
+    cursor.execute(f"""
+    select avg(price) AS avgPrice, max(price) as maxPrice, min(price) AS minPrice,
+           count(*) AS count, sum(amount) AS amountTraded
+    from trades
+    WHERE {querydb.pair_filter(querydb.pair_ids(base_name, querydb.USD))}
+    AND tsMs > ago(%(intervalString)s)
+    """, {"intervalString": f"PT{interval}M"})
+    return result_decoding.frame(cursor)
+
+
+def previous_period_prices(cursor, base_name, interval):
+    cursor.execute(f"""
+    select avg(price) AS avgPrice, max(price) as maxPrice, min(price) AS minPrice,
+           count(*) AS count, sum(amount) AS amountTraded
+    from trades
+    WHERE {querydb.pair_filter(querydb.pair_ids(base_name, querydb.USD))}
+    AND tsMs < ago(%(intervalString)s)
+    AND tsMs > ago(%(previousIntervalString)s)
+    """, {"intervalString": f"PT{interval}M", "previousIntervalString": f"PT{interval*2}M"})
+    return result_decoding.frame(cursor)
+
+
+def six_queries(cursor, base_name, interval):
+    # What assets_page did before asset_snapshot. The queries share a cursor
+    # here as they did there, so they are run one after another.
+    return {
+        "now": latest_period_prices(cursor, base_name, interval),
+        "prev": previous_period_prices(cursor, base_name, interval),
+        "pairs": querydb.get_pairs(cursor, base_name, interval),
+        "trades": querydb.get_latest_trades(cursor, base_name),
+        "assets": querydb.get_assets(cursor, base_name, interval),
+        "order_side": querydb.get_order_side(cursor, base_name, interval),
+    }
+
+
+def six_queries_parallel(connection, base_name, interval):
+    cursors = [CountingCursor(connection.cursor()) for _ in range(6)]
+    functions = [latest_period_prices, previous_period_prices, querydb.get_pairs,
+                 querydb.get_assets, querydb.get_order_side]
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        futures = [executor.submit(fn, cursor, base_name, interval) for fn, cursor in zip(functions, cursors)]
+        futures.append(executor.submit(querydb.get_latest_trades, cursors[5], base_name))
+        for future in futures:
+            future.result()
+    return sum(cursor.round_trips for cursor in cursors)
+
+
+def measure(refresh, refreshes):
+    latencies, round_trips = [], []
+    for _ in range(refreshes):
+        start = time.perf_counter()
+        round_trips.append(refresh())
+        latencies.append((time.perf_counter() - start) * 1000)
+    return round_trips, latencies
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Broker round trips and latency per Assets tab refresh")
+    parser.add_argument("--base", default="Bitcoin")
+    parser.add_argument("--interval", type=int, default=1)
+    parser.add_argument("--refreshes", type=int, default=20)
+    args = parser.parse_args()
+
+    connection = connect(host="localhost", port="8099", path="/query/sql", scheme="http")
+
+    def before():
+        cursor = CountingCursor(connection.cursor())
+        six_queries(cursor, args.base, args.interval)
+        return cursor.round_trips
+
+    def before_parallel():
+        return six_queries_parallel(connection, args.base, args.interval)
+
+    def after():
+        cursor = CountingCursor(connection.cursor())
+        querydb.asset_snapshot(cursor, args.base, args.interval)
+        querydb.get_latest_trades(cursor, args.base)
+        return cursor.round_trips
+
+    print(f"{'path':<24}{'round trips':>12}{'p50 ms':>10}{'max ms':>10}")
+    for name, refresh in [("six queries (serial)", before), ("six queries (parallel)", before_parallel),
+                          ("asset_snapshot", after)]:
+        round_trips, latencies = measure(refresh, args.refreshes)
+        print(f"{name:<24}{statistics.mean(round_trips):>12.1f}"
+              f"{statistics.median(latencies):>10.1f}{max(latencies):>10.1f}")
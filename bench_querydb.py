@@ -0,0 +1,386 @@
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from cryptowatch.stream.proto.public.stream import stream_pb2
+
+import dimensions
+import querydb
+import result_decoding
+from query_executor import ConnectionPool
+from query_metrics import InstrumentedCursor
+
+INPUT_DIR = dimensions.INPUT_DIR
+
+# name -> (function, arguments before the interval, whether it takes one)
+WORKLOADS = {
+    "get_all_pairs": (querydb.get_all_pairs, (), True),
+    "get_all_assets": (querydb.get_all_assets, (), True),
+    "get_all_assets_approx": (querydb.get_all_assets_approx, (), True),
+    "get_aggregate_trades_current_period": (querydb.get_aggregate_trades_current_period, (), True),
+    "get_aggregate_trades_previous_period": (querydb.get_aggregate_trades_previous_period, (), True),
+    "get_aggregate_trades_current_period_approx": (querydb.get_aggregate_trades_current_period_approx, (), True),
+    "get_aggregate_trades_previous_period_approx": (querydb.get_aggregate_trades_previous_period_approx, (), True),
+    "get_exchange_buy_side": (querydb.get_exchange_buy_side, (), True),
+    "get_quote_buy_side": (querydb.get_quote_buy_side, (), True),
+    "get_top_pairs_buy_side": (querydb.get_top_pairs_buy_side, (querydb.USD,), True),
+    "get_top_pairs_sell_side": (querydb.get_top_pairs_sell_side, (querydb.USD,), True),
+    "get_freshness": (querydb.get_freshness, (), True),
+    "asset_snapshot": (querydb.asset_snapshot, ("{base}",), True),
+    "get_pairs": (querydb.get_pairs, ("{base}",), True),
+    "get_assets": (querydb.get_assets, ("{base}",), True),
+    "get_order_side": (querydb.get_order_side, ("{base}",), True),
+    "all_prices": (querydb.all_prices, ("{base}",), True),
+    "get_trades_since": (querydb.get_trades_since, (), False),
+    "get_latest_trades": (querydb.get_latest_trades, ("{base}",), False),
+    "get_all_latest_trades": (querydb.get_all_latest_trades, (), False),
+    "quotes": (querydb.quotes, (), False),
+    "bases": (querydb.bases, (), False),
+}
+
+
+def _read(name):
+    with open(os.path.join(INPUT_DIR, f"{name}.json")) as input_file:
+        return [json.loads(line) for line in input_file if line.strip()]
+
+
+def load_markets():
+    """
+        (marketId, exchangeId, currencyPairId, baseName) for every market in
+        input/markets.json whose exchange and pair symbols resolve to ids
+    """
+    exchanges = {row["symbol"]: row["id"] for row in _read("exchanges")}
+    pairs = {}
+    for row in _read("pairs"):
+        pairs.setdefault(row["baseSymbol"] + row["quoteSymbol"], (row["id"], row["baseName"]))
+    markets = []
+    for row in _read("markets"):
+        if row["exchange"] in exchanges and row["pair"] in pairs:
+            pair_id, base_name = pairs[row["pair"]]
+            markets.append((row["id"], exchanges[row["exchange"]], pair_id, base_name))
+    return markets
+
+
+def _ranks(keys, counts):
+    # 0 for the key counted most, 1 for the next, ...
+    order = {key: rank for rank, (key, _) in enumerate(counts.most_common())}
+    return np.array([order.get(key, len(order)) for key in keys], dtype=float)
+
+
+def market_weights(markets, exchange_skew=1.0, base_skew=1.2, majors=20):
+    """
+        Zipf-like trade share per market. Bases are ranked by how many
+        exchanges list them (Bitcoin, Litecoin, Ethereum, ...) and exchanges
+        by how many markets they have in the `majors` top bases (Binance,
+        HitBTC, Kraken, ...), so a few markets take most of the volume.
+    """
+    listed_on = collections.Counter({base: len(exchanges) for base, exchanges in _exchanges_by_base(markets).items()})
+    top_bases = {base for base, _ in listed_on.most_common(majors)}
+    major_markets = collections.Counter(market[1] for market in markets if market[3] in top_bases)
+    weights = ((_ranks([market[1] for market in markets], major_markets) + 1) ** -exchange_skew
+               * (_ranks([market[3] for market in markets], listed_on) + 1) ** -base_skew)
+    return weights / weights.sum()
+
+
+def _exchanges_by_base(markets):
+    exchanges = collections.defaultdict(set)
+    for _, exchange_id, _, base_name in markets:
+        exchanges[base_name].add(exchange_id)
+    return exchanges
+
+
+def synthetic_updates(markets, trades, start_ns, end_ns, trades_per_update=5, seed=42):
+    """
+        Yields StreamMessage trade updates, oldest first, for about `trades`
+        trades between start_ns and end_ns. Prices follow a random walk per
+        market around a price level per base asset.
+    """
+    rng = np.random.default_rng(seed)
+    updates = max(1, trades // trades_per_update)
+    market_index = rng.choice(len(markets), size=updates, p=market_weights(markets))
+    received_ns = np.sort(rng.integers(start_ns, end_ns, size=updates))
+    sizes = rng.integers(1, 2 * trades_per_update, size=updates)
+
+    base_level = {}
+    for _, _, _, base_name in markets:
+        base_level.setdefault(base_name, 10 ** rng.uniform(-4, 4.7))
+    levels = np.array([base_level[market[3]] for market in markets])
+    steps = rng.normal(0, 0.001, size=updates)
+    order = np.argsort(market_index, kind="stable")
+    walk = np.cumsum(steps[order])
+    first = np.r_[True, market_index[order][1:] != market_index[order][:-1]]
+    # restart the cumulative sum at each market's first update
+    walk -= (walk - steps[order])[np.maximum.accumulate(np.where(first, np.arange(updates), 0))]
+    prices = np.empty(updates)
+    prices[order] = levels[market_index[order]] * np.exp(walk)
+
+    external_id = 10 ** 9
+    for i in range(updates):
+        market_id, exchange_id, pair_id, _ = markets[market_index[i]]
+        stream_message = stream_pb2.StreamMessage()
+        market = stream_message.marketUpdate.market
+        market.exchangeId, market.currencyPairId, market.marketId = exchange_id, pair_id, market_id
+        amounts = rng.lognormal(0, 2, size=sizes[i])
+        sides = rng.integers(1, 3, size=sizes[i])
+        for j in range(sizes[i]):
+            trade = stream_message.marketUpdate.tradesUpdate.trades.add()
+            external_id += 1
+            trade.externalId = str(external_id)
+            trade.timestamp = int(received_ns[i]) // 10 ** 9
+            trade.timestampNano = int(received_ns[i]) + j
+            trade.priceStr = f"{prices[i]:.6g}"
+            trade.amountStr = f"{amounts[j]:.4f}"
+            trade.orderSide = int(sides[j])
+        yield stream_message
+
+
+def load(args, markets):
+    """
+        Produces the synthetic trades (and OHLCV bars) through stream.py's
+        pipeline, as the live feed would, and returns (trades, start_ms)
+    """
+    import stream
+
+    end_ns = time.time_ns()
+    start_ns = end_ns - args.minutes * 60 * 10 ** 9
+    stream.start_pipeline(args.bootstrap_servers)
+    started = time.perf_counter()
+    for stream_message in synthetic_updates(markets, args.trades, start_ns, end_ns, seed=args.seed):
+        stream.handle_trades_update(stream_message)
+    stream.stop_pipeline()
+    print(f"Produced {stream.trades_processed} trades in {time.perf_counter() - started:.1f}s")
+    return stream.trades_processed, start_ns // 10 ** 6
+
+
+def wait_for_ingestion(pool, expected, start_ms, timeout):
+    deadline = time.time() + timeout
+    while True:
+        with pool.cursor() as cursor:
+            cursor.execute(f"select count(*) from trades where tsMs >= {start_ms}")
+            ingested = result_decoding.frame(cursor).iloc[0, 0]
+        if ingested >= expected or time.time() > deadline:
+            print(f"{ingested} of {expected} trades queryable")
+            return int(ingested)
+        time.sleep(2)
+
+
+def pin_clock(pool):
+    """
+        Pins querydb's clock to just after the newest trade, so every window
+        of the run covers the same trades however long the run takes, and a
+        later --skip-load run over the same tables covers them again
+    """
+    with pool.cursor() as cursor:
+        cursor.execute("select max(tsMs) from trades")
+        newest_ms = result_decoding.frame(cursor).iloc[0, 0]
+    if not np.isfinite(newest_ms) or newest_ms <= 0:
+        raise SystemExit("The trades table is empty")
+    now_ms = int(newest_ms) + 1
+    querydb.clock = lambda: now_ms / 1000
+    return now_ms
+
+
+def _rows(result):
+    if isinstance(result, pd.DataFrame):
+        return result.shape[0]
+    if isinstance(result, tuple):
+        return sum(_rows(item) for item in result)
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict):
+        return sum(_rows(item) for item in result.values())
+    return 0
+
+
+def run_workload(pool, fn, args, concurrency, requests):
+    """
+        Calls fn `requests` times from `concurrency` threads. Returns wall and
+        broker latencies in ms, docs matched and result rows per call, the
+        errors raised and the elapsed seconds.
+    """
+    def call():
+        with pool.cursor() as cursor:
+            instrumented = InstrumentedCursor(cursor)
+            start = time.perf_counter()
+            result = fn(instrumented, *args)
+            wall_ms = (time.perf_counter() - start) * 1000
+            return wall_ms, instrumented.broker_ms, instrumented.docs_scanned, _rows(result)
+
+    walls, brokers, scanned, rows, errors = [], [], [], [], []
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(call) for _ in range(requests)]:
+            try:
+                wall_ms, broker_ms, docs_scanned, result_rows = future.result()
+            except Exception as e:
+                errors.append(repr(e))
+                continue
+            walls.append(wall_ms)
+            brokers.append(broker_ms)
+            scanned.append(docs_scanned)
+            rows.append(result_rows)
+    return walls, brokers, scanned, rows, errors, time.perf_counter() - started
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize(name, interval, concurrency, walls, brokers, scanned, rows, errors, elapsed):
+    walls, brokers = sorted(walls), sorted(brokers)
+    return {
+        "function": name,
+        "interval": interval,
+        "concurrency": concurrency,
+        "requests": len(walls) + len(errors),
+        "errors": len(errors),
+        "firstError": errors[0] if errors else None,
+        "p50Ms": _percentile(walls, 0.5),
+        "p95Ms": _percentile(walls, 0.95),
+        "p99Ms": _percentile(walls, 0.99),
+        "brokerP50Ms": _percentile(brokers, 0.5),
+        # what the window matched: 0 for both means it was empty
+        "docsScanned": int(np.mean(scanned)) if scanned else None,
+        "resultRows": int(np.mean(rows)) if rows else None,
+        "queriesPerSecond": len(walls) / elapsed if elapsed else None,
+    }
+
+
+def benchmark(pool, names, intervals, concurrencies, requests, base_name):
+    results = []
+    for name in names:
+        fn, fixed, takes_interval = WORKLOADS[name]
+        fixed = tuple(arg.format(base=base_name) if isinstance(arg, str) else arg for arg in fixed)
+        for interval in intervals if takes_interval else [None]:
+            args = fixed + (interval,) if takes_interval else fixed
+            # warm up segment caches and the dimension lookups once
+            run_workload(pool, fn, args, 1, 1)
+            for concurrency in concurrencies:
+                row = summarize(name, interval, concurrency, *run_workload(pool, fn, args, concurrency, requests))
+                results.append(row)
+                print(f"{name:45} {str(interval or '-'):>4} {concurrency:>3} "
+                      f"p50={_format(row['p50Ms'])} p95={_format(row['p95Ms'])} p99={_format(row['p99Ms'])} "
+                      f"qps={_format(row['queriesPerSecond'])} docs={row['docsScanned']} rows={row['resultRows']} "
+                      f"errors={row['errors']}{'  EMPTY' if not row['docsScanned'] and not row['resultRows'] else ''}")
+    return results
+
+
+def _format(value):
+    return "-" if value is None else f"{value:8.1f}"
+
+
+def git_revision():
+    def git(*command):
+        return subprocess.run(["git", *command], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout
+
+    try:
+        revision = git("rev-parse", "HEAD")
+        dirty = git("status", "--porcelain", "--untracked-files=no")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision.strip() + ("-dirty" if dirty.strip() else "")
+
+
+def approximation_report(results):
+    """
+        p50 of each *_approx workload against its exact counterpart at the same
+        interval and concurrency, to set QUERYDB_APPROXIMATE_MIN_SAVING where
+        sampling actually beats the routed exact query
+    """
+    exact = {(row["function"], row["interval"], row["concurrency"]): row for row in results}
+    rows = [(row, exact.get((row["function"][:-len("_approx")], row["interval"], row["concurrency"])))
+            for row in results if row["function"].endswith("_approx")]
+    rows = [(row, old) for row, old in rows if old is not None and row["p50Ms"] and old["p50Ms"]]
+    if rows:
+        print("\nsampled vs exact p50")
+    for row, old in rows:
+        print(f"{row['function']:45} {str(row['interval']):>4} {row['concurrency']:>3} "
+              f"exact={_format(old['p50Ms'])} sampled={_format(row['p50Ms'])} x{old['p50Ms'] / row['p50Ms']:5.2f}")
+
+
+def compare(baseline, current, threshold):
+    """
+        Prints p50/p99 of current against baseline for the runs both have and
+        returns how many got slower than threshold times the baseline
+    """
+    def key(row):
+        return row["function"], row["interval"], row["concurrency"]
+
+    before = {key(row): row for row in baseline["results"]}
+    regressions = 0
+    print(f"\n{baseline.get('revision')} -> {current.get('revision')}")
+    for row in current["results"]:
+        old = before.get(key(row))
+        if old is None or not old["p50Ms"] or not row["p50Ms"]:
+            continue
+        p50, p99 = row["p50Ms"] / old["p50Ms"], row["p99Ms"] / old["p99Ms"]
+        slower = max(p50, p99) > threshold
+        regressions += slower
+        # different row counts mean different data or different answers, not just timing
+        changed = (old.get("resultRows"), old.get("docsScanned")) != (row.get("resultRows"), row.get("docsScanned"))
+        print(f"{row['function']:45} {str(row['interval'] or '-'):>4} {row['concurrency']:>3} "
+              f"p50 x{p50:5.2f} p99 x{p99:5.2f}{'  REGRESSION' if slower else ''}"
+              f"{'  ROWS CHANGED' if changed else ''}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Latency and throughput of every querydb function against a synthetic trades dataset")
+    parser.add_argument("--trades", type=int, default=1000000, help="synthetic trades to produce")
+    parser.add_argument("--minutes", type=int, default=60, help="the trades span this many minutes up to now")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-load", action="store_true", help="benchmark whatever the tables hold already")
+    parser.add_argument("--bootstrap-servers", default="localhost:9092")
+    parser.add_argument("--ingestion-timeout", type=float, default=300)
+    parser.add_argument("--functions", nargs="+", choices=sorted(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument("--intervals", type=int, nargs="+", default=[1, 5, 30])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100, help="calls per function, interval and concurrency")
+    parser.add_argument("--base", default="Bitcoin")
+    parser.add_argument("--output", default=f"bench_querydb_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio reported as a regression")
+    parser.add_argument("--approximate-min-saving", type=float, default=0,
+                        help="QUERYDB_APPROXIMATE_MIN_SAVING for the run; 0 times the sample on every window")
+    args = parser.parse_args()
+
+    querydb.APPROXIMATE_MIN_SAVING = args.approximate_min_saving
+    querydb.approximate_rng = np.random.default_rng(args.seed)
+
+    dimensions.cache.load_files()
+    pool = ConnectionPool(size=max(args.concurrency), timeout=30.0)
+    dataset = {"trades": args.trades, "minutes": args.minutes, "seed": args.seed, "loaded": not args.skip_load}
+    if not args.skip_load:
+        produced, start_ms = load(args, load_markets())
+        dataset["ingested"] = wait_for_ingestion(pool, produced, start_ms, args.ingestion_timeout)
+    dataset["nowMs"] = pin_clock(pool)
+
+    current = {
+        "revision": git_revision(),
+        "startedAt": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "dataset": dataset,
+        "settings": {"rollups": querydb.use_rollups, "approximateMinMinutes": querydb.APPROXIMATE_MIN_MINUTES,
+                     "approximateMinSaving": querydb.APPROXIMATE_MIN_SAVING,
+                     "requests": args.requests, "base": args.base},
+        "results": benchmark(pool, args.functions, args.intervals, args.concurrency, args.requests, args.base),
+    }
+    approximation_report(current["results"])
+    with open(args.output, "w") as output_file:
+        json.dump(current, output_file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            sys.exit(1 if compare(json.load(baseline_file), current, args.threshold) else 0)
@@ -0,0 +1,70 @@
+import argparse
+import random
+import statistics
+import time
+
+import pandas as pd
+
+import result_decoding
+
+COLUMNS = [("tsMs", "LONG"), ("externalId", "STRING"), ("currencyPairId", "LONG"), ("amount", "DOUBLE"),
+           ("price", "DOUBLE"), ("marketId", "LONG"), ("exchangeId", "LONG"), ("orderSide", "STRING")]
+
+
+class ResultCursor:
+    """
+        What a pinotdb cursor holds after execute(): the broker response and
+        an iterator over its rows
+    """
+
+    def __init__(self, rows):
+        self.raw_query_response = {"response": {"resultTable": {
+            "dataSchema": {"columnNames": [name for name, _ in COLUMNS],
+                           "columnDataTypes": [kind for _, kind in COLUMNS]},
+            "rows": rows,
+        }}, "status_code": 200}
+        self.description = [(name,) for name, _ in COLUMNS]
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+def make_rows(count, rng):
+    return [[1650000000000 + i, str(rng.randrange(10 ** 9)), rng.randrange(1, 5000), rng.random() * 10,
+             rng.random() * 50000, rng.randrange(1, 10000), rng.randrange(1, 100), rng.choice(["BUYSIDE", "SELLSIDE"])]
+            for i in range(count)]
+
+
+def row_wise(cursor):
+    df = pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
+    df["price"] = df["price"].map('{:,.3f}'.format)
+    return df
+
+
+def columnar(cursor):
+    # formatting now happens in the browser
+    return result_decoding.frame(cursor)
+
+
+def measure(decode, cursor, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decode(cursor)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time building DataFrames from broker results")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    cursor = ResultCursor(make_rows(args.rows, random.Random(42)))
+    assert (row_wise(cursor)["tsMs"] == columnar(cursor)["tsMs"]).all()
+
+    print(f"{'path':<36}{'median ms':>10}")
+    for name, decode in [("DataFrame(cursor) + map(format)", row_wise), ("result_decoding.frame", columnar)]:
+        print(f"{name:<36}{measure(decode, cursor, args.repeat):>10.2f}")
@@ -0,0 +1,87 @@
+import argparse
+import json
+import random
+import time
+
+from google.protobuf.json_format import MessageToJson
+from cryptowatch.stream.proto.public.stream import stream_pb2
+
+import trade_encoder
+
+replace_keys = {
+    "timestamp": "ts", "priceStr": "price", "amountStr": "amount",
+    "timestampNano": "tsNano"
+}
+
+
+def legacy_payloads(trade_update):
+    """
+        The MessageToJson -> json.loads -> json.dumps path stream.py used before
+        trade_encoder, kept here as the baseline.
+    """
+    market_update = json.loads(MessageToJson(trade_update))["marketUpdate"]
+    market = market_update["market"]
+    for trade in market_update["tradesUpdate"]["trades"]:
+        message = {**trade, **market}
+        for old, new in replace_keys.items():
+            message[new] = message.pop(old)
+        yield str(message["currencyPairId"]), json.dumps(message, ensure_ascii=False).encode('utf-8')
+
+
+def fast_payloads(trade_update):
+    return trade_encoder.encode_trades(trade_update)
+
+
+def make_update(trades_per_update, rng):
+    stream_message = stream_pb2.StreamMessage()
+    market = stream_message.marketUpdate.market
+    market.exchangeId = rng.randint(1, 200)
+    market.currencyPairId = rng.randint(1, 200000)
+    market.marketId = rng.randint(1, 100000)
+
+    now = time.time_ns()
+    for i in range(trades_per_update):
+        trade = stream_message.marketUpdate.tradesUpdate.trades.add()
+        trade.externalId = str(rng.randint(1, 10**10))
+        trade.timestamp = now // 10**9
+        trade.timestampNano = now + i
+        trade.priceStr = f"{rng.uniform(0.01, 50000):.3f}"
+        trade.amountStr = f"{rng.uniform(0.0001, 100):.4f}"
+        trade.orderSide = rng.choice([0, 1, 2])
+    return stream_message
+
+
+def run(fn, updates, repeat):
+    trades = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for update in updates:
+            for _key, _payload in fn(update):
+                trades += 1
+    return trades / (time.perf_counter() - start)
+
+
+def check_same_schema(updates):
+    for update in updates:
+        legacy = list(legacy_payloads(update))
+        fast = list(fast_payloads(update))
+        assert [k for k, _ in legacy] == [k for k, _ in fast]
+        assert [json.loads(v) for _, v in legacy] == [json.loads(v) for _, v in fast]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare trade payload encoding paths")
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--trades-per-update", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    updates = [make_update(args.trades_per_update, rng) for _ in range(args.updates)]
+    check_same_schema(updates)
+
+    legacy = run(legacy_payloads, updates, args.repeat)
+    fast = run(fast_payloads, updates, args.repeat)
+    print(f"legacy (MessageToJson):  {legacy:12,.0f} trades/sec")
+    print(f"fast (protobuf direct):  {fast:12,.0f} trades/sec")
+    print(f"speedup:                 {fast / legacy:12.2f}x")
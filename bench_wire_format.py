@@ -0,0 +1,49 @@
+import argparse
+import json
+import random
+import time
+
+import trade_encoder
+from bench_trade_encoder import make_update
+
+
+def measure(encode_trades, updates, repeat):
+    messages = total_bytes = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for update in updates:
+            for _key, payload in encode_trades(update):
+                messages += 1
+                total_bytes += len(payload)
+    elapsed = time.perf_counter() - start
+    return total_bytes / messages, messages / elapsed
+
+
+def check_round_trip(avro_encoder, updates):
+    for update in updates:
+        json_messages = [json.loads(payload) for _, payload in trade_encoder.encode_trades(update)]
+        avro_messages = [avro_encoder.codec.decode(payload) for _, payload in avro_encoder.encode_trades(update)]
+        for from_json, from_avro in zip(json_messages, avro_messages):
+            for field in ("exchangeId", "currencyPairId", "marketId", "ts", "tsNano"):
+                assert int(from_json[field]) == from_avro[field], field
+            for field in ("price", "amount"):
+                assert float(from_json[field]) == from_avro[field], field
+            assert from_json.get("orderSide") == from_avro["orderSide"]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare JSON and Avro encodings of the trades topic")
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--trades-per-update", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    updates = [make_update(args.trades_per_update, rng) for _ in range(args.updates)]
+    avro_encoder = trade_encoder.AvroTradeEncoder()
+    check_round_trip(avro_encoder, updates)
+
+    print(f"{'format':<8}{'bytes/msg':>12}{'trades/sec':>14}")
+    for name, encode_trades in [("json", trade_encoder.encode_trades), ("avro", avro_encoder.encode_trades)]:
+        bytes_per_message, throughput = measure(encode_trades, updates, args.repeat)
+        print(f"{name:<8}{bytes_per_message:>12.1f}{throughput:>14,.0f}")
@@ -1,32 +1,129 @@
+import argparse
+import collections
+import json
+
 import requests
-import csv
 import pandas as pd
 
+import index_advisor
+
 pinot_url = "http://localhost:9000"
-table_name = "trades"
+broker_url = "http://localhost:8099"
+
+SCAN_STATS = ["numDocsScanned", "numEntriesScannedInFilter", "numEntriesScannedPostFilter",
+              "totalDocs", "numSegmentsQueried", "numSegmentsProcessed", "timeUsedMs"]
+
+
+def segment_metadata(table_name, table_type):
+    response = requests.get(f"{pinot_url}/schemas/{table_name}")
+    r = response.json()
+
+    fields = r.get("dimensionFieldSpecs", []) + r.get("dateTimeFieldSpecs", []) + r.get("metricFieldSpecs", [])
+    columns = [field["name"] for field in fields]
+
+    data = { "columns": columns}
+    response = requests.get(f"{pinot_url}/segments/{table_name}_{table_type}/metadata", params=data)
+
+    r = response.json()
+    segments = list(r.items())
+    segments.sort(key=lambda x: x[0])
+    return segments
+
 
-response = requests.get(f"{pinot_url}/schemas/{table_name}")
-r = response.json()
+def print_indexes(segments):
+    for segment, values in segments:
+        print(segment)
+        columns = ["column", "sorted"] + list(list(values["indexes"].values())[0].keys())
+        rows = []
+        for column in values.get("columns", []):
+            column_name = column["fieldSpec"]["name"]
+            filtered_map = {k:v for k,v in values["indexes"].items() if k == column_name}
+            row = [column_name, column["sorted"]] + list(filtered_map[column_name].values())
+            rows.append(row)
 
-fields = r.get("dimensionFieldSpecs", []) + r.get("dateTimeFieldSpecs", []) + r.get("metricFieldSpecs", [])
-columns = [field["name"] for field in fields]
+        new_df = pd.DataFrame(columns=columns, data=rows)
+        print(new_df)
 
-data = { "columns": columns}
-response = requests.get(f"{pinot_url}/segments/{table_name}_REALTIME/metadata", params=data)
 
-r = response.json()
-segments = list(r.items())
-segments.sort(key=lambda x: x[0])
+def verify_indexes(segments, table_config):
+    """
+        Lists, per segment, the indexes table_config asks for that the segment
+        doesn't have yet (segments built before a config change only get them
+        on reload)
+    """
+    index_config = table_config.get("tableIndexConfig", {})
+    missing = {}
+    for segment, values in segments:
+        indexes = values.get("indexes", {})
+        sorted_columns = {column["fieldSpec"]["name"] for column in values.get("columns", []) if column["sorted"]}
+        problems = [f"{column}: inverted-index" for column in index_config.get("invertedIndexColumns", [])
+                    if indexes.get(column, {}).get("inverted-index") != "YES"]
+        problems += [f"{column}: range-index" for column in index_config.get("rangeIndexColumns", [])
+                     if indexes.get(column, {}).get("range-index") != "YES"]
+        problems += [f"{column}: sorted" for column in index_config.get("sortedColumn", [])
+                     if column not in sorted_columns]
+        if problems:
+            missing[segment] = problems
+    return missing
 
-for segment, values in segments:
-    print(segment)
-    columns = ["column", "sorted"] + list(list(values["indexes"].values())[0].keys())
+
+def scan_stats(statements):
+    """
+        Runs each (name, sql) against the broker and keeps the scan
+        statistics from its response, keyed by name and table
+    """
+    stats = {}
+    seen = collections.Counter()
+    for name, sql in statements:
+        analysis_table = index_advisor.analyze(sql, {})["table"]
+        key = f"{name}:{analysis_table}"
+        seen[key] += 1
+        if seen[key] > 1:
+            key = f"{key}#{seen[key]}"
+
+        response = requests.post(f"{broker_url}/query/sql", json={"sql": sql}).json()
+        stats[key] = {stat: response.get(stat) for stat in SCAN_STATS}
+        if response.get("exceptions"):
+            stats[key]["exceptions"] = [exception.get("message") for exception in response["exceptions"]]
+    return stats
+
+
+def compare(before, after):
     rows = []
-    for column in values.get("columns", []):
-        column_name = column["fieldSpec"]["name"]
-        filtered_map = {k:v for k,v in values["indexes"].items() if k == column_name}
-        row = [column_name, column["sorted"]] + list(filtered_map[column_name].values())
-        rows.append(row)
-
-    new_df = pd.DataFrame(columns=columns, data=rows)
-    print(new_df)
\ No newline at end of file
+    for key in sorted(set(before) & set(after)):
+        for stat in ["numDocsScanned", "numEntriesScannedInFilter", "timeUsedMs"]:
+            rows.append([key, stat, before[key].get(stat), after[key].get(stat)])
+    df = pd.DataFrame(columns=["query", "stat", "before", "after"], data=rows)
+    df["change"] = df["after"] - df["before"]
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check segment indexes and dashboard query scan statistics")
+    parser.add_argument("--table", default="trades")
+    parser.add_argument("--table-type", default="REALTIME")
+    parser.add_argument("--table-config", default="config/trades_table.json",
+                        help="Config whose indexes every segment should have")
+    parser.add_argument("--stats-out", help="Write scan statistics for every dashboard query to this JSON file")
+    parser.add_argument("--compare", help="Scan statistics JSON from an earlier run (e.g. before applying indexes)")
+    args = parser.parse_args()
+
+    segments = segment_metadata(args.table, args.table_type)
+    print_indexes(segments)
+
+    with open(args.table_config) as config_file:
+        missing = verify_indexes(segments, json.load(config_file))
+    if missing:
+        print(f"{len(missing)} of {len(segments)} segments are missing configured indexes:")
+        print(json.dumps(missing, indent=2))
+    else:
+        print(f"All {len(segments)} segments have the configured indexes")
+
+    if args.stats_out or args.compare:
+        stats = scan_stats(index_advisor.workload())
+        if args.stats_out:
+            with open(args.stats_out, "w") as stats_file:
+                json.dump(stats, stats_file, indent=2)
+        if args.compare:
+            with open(args.compare) as baseline_file:
+                print(compare(json.load(baseline_file), stats).to_string())
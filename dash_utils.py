@@ -1,24 +1,64 @@
-from dash import html, dash_table
+from dash import html, dash_table, Patch
+from dash.dash_table.Format import Format, Group, Scheme
 import plotly.graph_objects as go
 
-def as_data_table_or_message(df, message):
-    return as_datatable(df) if df.shape[0] > 0 else message
+# Formatted in the browser, so numbers go over the wire as numbers
+FIXED_3 = Format(precision=3, scheme=Scheme.fixed, group=Group.yes)
 
-def as_datatable(df):
-    style_table = {'overflowX': 'auto'}
-    style_cell = {
-        'minWidth': '50px', 'width': '150px', 'maxWidth': '18   0px',
-        'overflow': 'hidden',
-        'textOverflow': 'ellipsis',
-        'padding': '10px'
-    }
+def as_data_table_or_message(df, message, formatted=()):
+    return as_datatable(df, formatted) if df.shape[0] > 0 else message
 
+def table_columns(columns, formatted=()):
+    return [{"name": i, "id": i, "type": "numeric", "format": FIXED_3} if i in formatted else {"name": i, "id": i}
+            for i in columns]
+
+style_table = {'overflowX': 'auto'}
+style_cell = {
+    'minWidth': '50px', 'width': '150px', 'maxWidth': '18   0px',
+    'overflow': 'hidden',
+    'textOverflow': 'ellipsis',
+    'padding': '10px'
+}
+
+def as_datatable(df, formatted=()):
+    return [html.Div([dash_table.DataTable(
+        df.to_dict('records'), table_columns(df.columns, formatted),
+        style_table=style_table,
+        style_cell=style_cell
+    )])]
+
+def empty_datatable(id, columns, formatted=()):
     return [html.Div([dash_table.DataTable(
-        df.to_dict('records'), [{"name": i, "id": i} for i in df.columns],
+        [], table_columns(columns, formatted),
+        id=id,
         style_table=style_table,
         style_cell=style_cell
     )])]
 
+def prepend_rows(df, rows_shown, max_rows):
+    """
+        Puts df's rows (newest first) on top of a DataTable that already shows
+        rows_shown rows, dropping the oldest beyond max_rows. Only the new rows
+        go over the wire. Returns the table data (or a Patch of it) and the
+        number of rows shown afterwards.
+    """
+    records = df.to_dict('records')
+    if rows_shown == 0 or len(records) >= max_rows:
+        return records[:max_rows], min(len(records), max_rows)
+
+    patch = Patch()
+    for row in reversed(records):
+        patch.prepend(row)
+    total = rows_shown + len(records)
+    for index in range(total - 1, max_rows - 1, -1):
+        del patch[index]
+    return patch, min(total, max_rows)
+
+def with_error(title, df, column):
+    # approximate results carry the half width of a confidence interval in <column>Error
+    error = f"{column}Error"
+    return f"{title} ± {df[error][0]:,.0f}" if error in df else title
+
 def add_delta_trace(fig, title, value, last_value, row, column):
     fig.add_trace(go.Indicator(
         mode = "number+delta",
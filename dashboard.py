@@ -1,68 +1,146 @@
 import pandas as pd
 import plotly.express as px  # (version 4.7.0 or higher)
 import plotly.graph_objects as go
-from dash import Dash, dcc, html, Input, Output, dash_table  # pip install dash (version 2.0.0 or higher)
-from pinotdb import connect, db
+from dash import Dash, dcc, html, Input, Output, State, ClientsideFunction, dash_table  # pip install dash (version 2.0.0 or higher)
+from dash.exceptions import PreventUpdate
 import datetime
 import querydb
 import tabs
 import dash_utils
-import concurrent.futures
+import dimensions
+import flask
+import os
+import uuid
+import query_metrics
+import embedded
+import leaderboards
+from incremental import IncrementalAggregates
+from push import OverviewBroadcaster
+from query_cache import QueryCache
+from query_executor import ConnectionPool, QueryExecutor, StaleRefresh
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 app = Dash(__name__, external_stylesheets=external_stylesheets)
 app.title = "Crypto Watch Real-Time Dashboard"
 app.config.suppress_callback_exceptions=True
 
-connection = connect(
+pool = ConnectionPool(
+    size=int(os.environ.get("PINOT_POOL_SIZE", 8)),
+    timeout=float(os.environ.get("PINOT_QUERY_TIMEOUT", 10)),
     host="localhost",
     port="8099",
     path="/query/sql",
     scheme=( "http"),
 )
-cursor = connection.cursor()
-all_quotes = querydb.quotes(cursor)
-all_bases = querydb.bases(cursor)
+query_executor = QueryExecutor(pool, timeout=float(os.environ.get("PINOT_QUERY_TIMEOUT", 10)))
+dimensions.cache.start_refresh(pool)
+query_cache = QueryCache()
 
-app.layout = html.Div([
-    html.H1("Crypto Watch Real-Time Dashboard", style={'text-align': 'center'}),
-    html.Div(children=[
+# With DASHBOARD_INCREMENTAL=1 the overview panels are answered from
+# per-second partial aggregates that only fetch new rows each tick.
+aggregates = IncrementalAggregates() if os.environ.get("DASHBOARD_INCREMENTAL") == "1" else querydb
+# With DASHBOARD_EMBEDDED=1 short windows are answered from trades consumed
+# straight off Kafka into this process, and longer ones as above.
+embedded_trades = embedded.from_env(aggregates) if os.environ.get("DASHBOARD_EMBEDDED") == "1" else None
+if embedded_trades is not None:
+    aggregates = embedded_trades
+asset_queries = embedded_trades or querydb
+# With DASHBOARD_LEADERBOARDS=1 the top-N panels come from heavy-hitter
+# summaries of the trade stream, sharing the embedded consumer if there is one.
+leaderboard_queries = leaderboards.from_env(aggregates, embedded_trades and embedded_trades.consumer) \
+    if os.environ.get("DASHBOARD_LEADERBOARDS") == "1" else None
+if leaderboard_queries is not None:
+    aggregates = leaderboard_queries.start()
+if embedded_trades is not None:
+    embedded_trades.start()
+push_mode = os.environ.get("DASHBOARD_PUSH") == "1"
+debug_mode = os.environ.get("DASHBOARD_DEBUG") == "1"
+# With DASHBOARD_APPROXIMATE=1 long windows of the Overview's totals are
+# estimated from a sample of trades, unless refresh is paused
+approximate_mode = os.environ.get("DASHBOARD_APPROXIMATE") == "1"
+# Price chart buckets, about one per pixel of the chart's default width
+price_chart_points = int(os.environ.get("DASHBOARD_PRICE_POINTS", 700))
+with pool.cursor() as cursor:
+    all_quotes = querydb.quotes(cursor)
+    all_bases = querydb.bases(cursor)
+
+def serve_layout():
+    return html.Div([
+        dcc.Store(id='session-id', data=str(uuid.uuid4())),
+        html.H1("Crypto Watch Real-Time Dashboard", style={'text-align': 'center'}),
         html.Div(children=[
             html.Div(children=[
-                html.Span("Refresh rate (seconds)", style={"font-weight": "bold"})
-            ], className="two columns"),
-            html.Div(children=[
-                dcc.Slider(min=1, max=10, step=1, value=1, id='interval-refresh'),
-            ], className="three columns"),
-            html.Div(children=[
-                html.Span("Data Recency", style={"font-weight": "bold"})
-            ], className="two columns"),
-            html.Div(children=[
-                dcc.Dropdown(id='data-recency', options=[
-                {'label': 'Last 1 minute', 'value': 1},
-                {'label': 'Last 2 minutes', 'value': 2},
-                {'label': 'Last 5 minutes', 'value': 5},
-                {'label': 'Last 10 minutes', 'value':10},
-                {'label': 'Last 30 minutes', 'value': 30},
-            ],
-            value=1),
-            ], className="three columns"),        
-        ], className="one row", style={"padding": "5px 0"}),
-        html.Div(id='latest-timestamp', style={"padding": "5px 0"}),
-    ], className="one row", style={"backgroundColor": "#EFEFEF", "padding": "10px", "margin": "10px 0", "borderRadius": "10px"}),
-
-    dcc.Interval(
-            id='interval-component',
-            interval=1 * 1000,  # in milliseconds
-            n_intervals=0
-        ),
-    dcc.Tabs(id="tabs-example-graph", value='overview', children=[
-        dcc.Tab(label='Overview', value='overview', children=[tabs.overview(all_quotes)]),
-        dcc.Tab(label='Assets', value='by-asset', children=[tabs.assets(all_bases)]),
-        dcc.Tab(label='Latest Trades', value='all-latest-trades', children=[tabs.latest_trades()]),
-    ]),
-    html.Div(id='tabs-content-example-graph')
-])
+                html.Div(children=[
+                    html.Span("Refresh rate (seconds)", style={"font-weight": "bold"})
+                ], className="two columns"),
+                html.Div(children=[
+                    dcc.Slider(min=1, max=10, step=1, value=1, id='interval-refresh'),
+                ], className="three columns"),
+                html.Div(children=[
+                    dcc.Checklist([{"label": " Pause", "value": "paused"}], [], id='refresh-paused'),
+                ], className="one column"),
+                html.Div(children=[
+                    html.Span("Data Recency", style={"font-weight": "bold"})
+                ], className="two columns"),
+                html.Div(children=[
+                    dcc.Dropdown(id='data-recency', options=[
+                    {'label': 'Last 1 minute', 'value': 1},
+                    {'label': 'Last 2 minutes', 'value': 2},
+                    {'label': 'Last 5 minutes', 'value': 5},
+                    {'label': 'Last 10 minutes', 'value':10},
+                    {'label': 'Last 30 minutes', 'value': 30},
+                ],
+                value=1),
+                ], className="three columns"),        
+            ], className="one row", style={"padding": "5px 0"}),
+            html.Div(id='latest-timestamp', style={"padding": "5px 0"}),
+            html.Div(id='freshness-alert', style={"padding": "5px 0"}),
+        ], className="one row", style={"backgroundColor": "#EFEFEF", "padding": "10px", "margin": "10px 0", "borderRadius": "10px"}),
+
+        dcc.Interval(
+                id='interval-component',
+                interval=1 * 1000,  # in milliseconds
+                n_intervals=0
+            ),
+        dcc.Tabs(id="tabs-example-graph", value='overview', children=[
+            dcc.Tab(label='Overview', value='overview', children=[tabs.overview(all_quotes, push_mode)]),
+            dcc.Tab(label='Assets', value='by-asset', children=[tabs.assets(all_bases)]),
+            dcc.Tab(label='Latest Trades', value='all-latest-trades', children=[tabs.latest_trades()]),
+            dcc.Tab(label='Freshness', value='freshness', children=[tabs.freshness()]),
+        ] + ([dcc.Tab(label='Query Metrics', value='query-metrics', children=[tabs.query_metrics()])] if debug_mode else [])),
+        html.Div(id='tabs-content-example-graph')
+    ])
+
+app.layout = serve_layout
+
+@app.server.route("/cache-stats")
+def cache_stats():
+    return flask.jsonify(query_cache.stats())
+
+@app.server.route("/embedded-stats")
+def embedded_stats():
+    return flask.jsonify(embedded_trades.stats() if embedded_trades is not None else {})
+
+@app.server.route("/leaderboard-stats")
+def leaderboard_stats():
+    return flask.jsonify(leaderboard_queries.stats() if leaderboard_queries is not None else {})
+
+@app.server.route("/metrics")
+def metrics():
+    return flask.Response(query_metrics.metrics.prometheus(), mimetype="text/plain; version=0.0.4")
+
+def cached(fn, *args, refresh_ms):
+    # Results live for one refresh period, so every browser on the same
+    # refresh rate shares a single query per tick.
+    return lambda cursor: query_cache.call(query_metrics.metrics.instrument(fn), cursor, *args, ttl=refresh_ms / 1000)
+
+def run_queries(jobs, session_id, callback, interval=None):
+    try:
+        with query_metrics.tagged(callback=callback, interval=interval):
+            return query_executor.run(jobs, client_key=(session_id, callback))
+    except StaleRefresh:
+        # a newer tick for this browser is already running
+        raise PreventUpdate
 
 @app.callback(
     [Output(component_id='interval-component', component_property='interval')],
@@ -70,6 +148,12 @@ app.layout = html.Div([
 def update_refresh_rate(value):
     return [value * 1000]
 
+@app.callback(
+    [Output(component_id='interval-component', component_property='disabled')],
+    [Input('refresh-paused', 'value')])
+def pause_refresh(value):
+    return ["paused" in value]
+
 # @app.callback(
 #     [Output(component_id='latest-trades-bases', component_property='children'),
 #     Output(component_id='prices', component_property='figure'),
@@ -80,31 +164,20 @@ def update_refresh_rate(value):
 #     [Input('bases-dropdown', 'value'), Input('interval-component', 'n_intervals'),  Input('data-recency', 'value')]
 # )
 @app.callback(
-    [Output(component_id='latest-trades-bases', component_property='children'),
-     Output(component_id="asset-charts", component_property="children")
-     ],
-    [Input('bases-dropdown', 'value'), Input('interval-component', 'n_intervals'),  Input('data-recency', 'value')]
+    [Output(component_id="asset-charts", component_property="children")],
+    [Input('bases-dropdown', 'value'), Input('interval-component', 'n_intervals'),  Input('data-recency', 'value')],
+    [State('interval-component', 'interval'), State('session-id', 'data')]
 )
-def assets_page(base_name, n, interval):
-    cursor = connection.cursor()
-
-    results = {}
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = {
-            executor.submit(querydb.latest_period_prices, cursor, base_name, interval): "now",
-            executor.submit(querydb.previous_period_prices, cursor, base_name, interval): "prev",
-            executor.submit(querydb.get_pairs, cursor, base_name, interval): "pairs",
-            executor.submit(querydb.get_latest_trades, cursor, base_name): "trades",
-            executor.submit(querydb.get_assets, cursor, base_name, interval): "assets",
-            executor.submit(querydb.get_order_side, cursor, base_name, interval): "order_side",
-        }
-        for future in concurrent.futures.as_completed(futures):
-            results[futures[future]] = future.result()
-    cursor.close()
+def assets_page(base_name, n, interval, refresh_ms, session_id):
+    queries = run_queries({
+        "snapshot": cached(asset_queries.asset_snapshot, base_name, interval, refresh_ms=refresh_ms),
+        "prices": cached(asset_queries.all_prices, base_name, interval, price_chart_points, refresh_ms=refresh_ms),
+    }, session_id, "assets", interval)
+    prices = queries["prices"]
+    results = queries["snapshot"]._asdict()
 
     df_now = results["now"]
     df_prev = results["prev"]
-    trades_df = results["trades"]
     
     fig = go.Figure()
     if df_now["count"][0] > 0:
@@ -132,39 +205,40 @@ def assets_page(base_name, n, interval):
     fig_asset = px.bar(results["assets"], x='asset', y='count', title="Top assets", color_discrete_sequence =['green'])
     fig_order_side = px.bar(results["order_side"], x='orderSide', y='count', title="Order Side", color_discrete_sequence =['purple'])
     
-    latest_trades = dash_utils.as_datatable(trades_df)
+    # the low-high range of each bucket, with the last price in it as the line
+    times = pd.to_datetime(prices["tsMs"], unit="ms")
+    fig_prices = go.Figure([
+        go.Scatter(x=times, y=prices["maxPrice"], line={"width": 0}, hoverinfo="skip", showlegend=False),
+        go.Scatter(x=times, y=prices["minPrice"], line={"width": 0}, fill="tonexty", fillcolor="rgba(0, 0, 255, 0.2)",
+                   name="Low - High"),
+        go.Scatter(x=times, y=prices["lastPrice"], line={"color": "blue"}, name="Last"),
+    ], layout=go.Layout(title="Price (USD)"))
 
-    charts = [dcc.Graph(figure=fig), dcc.Graph(figure=fig_market), dcc.Graph(figure=fig_asset), dcc.Graph(figure=fig_order_side)] \
+    price_chart = [dcc.Graph(figure=fig_prices)] if prices.shape[0] > 0 else []
+    charts = [dcc.Graph(figure=fig)] + price_chart + [dcc.Graph(figure=fig_market), dcc.Graph(figure=fig_asset), dcc.Graph(figure=fig_order_side)] \
         if results["pairs"].shape[0] > 0  \
         else "No recent trades"
 
-    return latest_trades, charts
+    return [charts]
 
-@app.callback(
-    [Output(component_id='pairs', component_property='children'),
-     Output(component_id='overview-assets', component_property='children'),
-     Output(component_id='latest-timestamp', component_property='children'),
-     Output(component_id='aggregate-trades', component_property='children')
-     ],
-    [Input('interval-component', 'n_intervals'), Input('data-recency', 'value')]
-)
-def overview(n, interval):
-    cursor = connection.cursor()
-
-    results = {}
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = {
-            executor.submit(querydb.get_all_pairs, cursor, interval): "pairs",
-            executor.submit(querydb.get_all_assets, cursor, interval): "assets",
-            executor.submit(querydb.get_aggregate_trades_current_period, cursor, interval): "trades_now",
-            executor.submit(querydb.get_aggregate_trades_previous_period, cursor, interval): "trades_previous"
-        }
-        for future in concurrent.futures.as_completed(futures):
-            results[futures[future]] = future.result()
-    cursor.close()
-
-    pairs = dash_utils.as_data_table_or_message(results["pairs"], "No recent trades")
-    assets = dash_utils.as_data_table_or_message(results["assets"], "No recent trades")
+def overview(n, interval, paused, refresh_ms, session_id):
+    # estimates are only worth it for long windows, and a paused view has time to wait for exact totals
+    approximate = approximate_mode and interval >= querydb.APPROXIMATE_MIN_MINUTES and not paused
+    totals = querydb if approximate else aggregates
+    suffix = "_approx" if approximate else ""
+    results = run_queries({
+        "pairs": cached(aggregates.get_all_pairs, interval, refresh_ms=refresh_ms),
+        "assets": cached(getattr(totals, "get_all_assets" + suffix), interval, refresh_ms=refresh_ms),
+        "trades_now": cached(getattr(totals, "get_aggregate_trades_current_period" + suffix), interval,
+                             refresh_ms=refresh_ms),
+        "trades_previous": cached(getattr(totals, "get_aggregate_trades_previous_period" + suffix), interval,
+                                  refresh_ms=refresh_ms),
+    }, session_id, "overview", interval)
+
+    pairs = dash_utils.as_data_table_or_message(results["pairs"], "No recent trades", tabs.PAIRS_FORMATTED)
+    assets = dash_utils.as_data_table_or_message(results["assets"].rename(columns=tabs.ERROR_COLUMNS),
+                                                 "No recent trades",
+                                                 tabs.ASSETS_FORMATTED + list(tabs.ERROR_COLUMNS.values()))
 
     aggregate_trades_now = results["trades_now"]
     aggregate_trades_prev = results["trades_previous"]
@@ -173,12 +247,12 @@ def overview(n, interval):
     fig = go.Figure(layout=go.Layout(height=300))
     if aggregate_trades_now["count"][0] > 0:
         if aggregate_trades_prev["count"][0] > 0:
-            dash_utils.add_delta_trace(fig, "Transactions", aggregate_trades_now["count"][0], aggregate_trades_prev["count"][0], 0, 0)
-            dash_utils.add_delta_trace(fig, "Amount Traded", aggregate_trades_now["amountTraded"][0], aggregate_trades_prev["amountTraded"][0], 0, 1)
+            dash_utils.add_delta_trace(fig, dash_utils.with_error("Transactions", aggregate_trades_now, "count"), aggregate_trades_now["count"][0], aggregate_trades_prev["count"][0], 0, 0)
+            dash_utils.add_delta_trace(fig, dash_utils.with_error("Amount Traded", aggregate_trades_now, "amountTraded"), aggregate_trades_now["amountTraded"][0], aggregate_trades_prev["amountTraded"][0], 0, 1)
             
         else:
-            dash_utils.add_trace(fig, "Transactions", aggregate_trades_now["count"][0], 0, 0)
-            dash_utils.add_trace(fig, "Amount Traded", aggregate_trades_now["amountTraded"][0], 0, 1)
+            dash_utils.add_trace(fig, dash_utils.with_error("Transactions", aggregate_trades_now, "count"), aggregate_trades_now["count"][0], 0, 0)
+            dash_utils.add_trace(fig, dash_utils.with_error("Amount Traded", aggregate_trades_now, "amountTraded"), aggregate_trades_now["amountTraded"][0], 0, 1)
         fig.update_layout(grid = {"rows": 1, "columns": 2,  'pattern': "independent"},) 
     else:
         fig.update_layout(annotations = [{"text": "No transactions found", "xref": "paper", "yref": "paper", "showarrow": False, "font": {"size": 28}}])
@@ -186,16 +260,72 @@ def overview(n, interval):
 
     overview_fig = dcc.Graph(figure=fig) if aggregate_trades_now["count"][0] > 0 else None
 
-    return pairs, assets, [html.Span(f"Last updated: {datetime.datetime.now()}")], overview_fig
+    estimated = " (totals estimated from a sample, ± is a 95% confidence interval)" if approximate else ""
+    return pairs, assets, [html.Span(f"Last updated: {datetime.datetime.now()}{estimated}")], overview_fig
+
+if push_mode:
+    # The overview panels are computed once per tick by the broadcaster and
+    # streamed to browsers, which apply the deltas in assets/push.js.
+    broadcaster = OverviewBroadcaster(query_executor, aggregates).start()
+
+    @app.server.route("/push/overview")
+    def push_overview():
+        interval = int(flask.request.args.get("interval", 1))
+        return flask.Response(broadcaster.event_stream(interval), mimetype="text/event-stream",
+                              headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    @app.server.route("/push-stats")
+    def push_stats():
+        return flask.jsonify(broadcaster.stats())
+
+    app.clientside_callback(
+        ClientsideFunction(namespace="push", function_name="subscribe"),
+        Output(component_id='push-status', component_property='children'),
+        Input('data-recency', 'value'),
+    )
+else:
+    app.callback(
+        [Output(component_id='pairs', component_property='children'),
+         Output(component_id='overview-assets', component_property='children'),
+         Output(component_id='latest-timestamp', component_property='children'),
+         Output(component_id='aggregate-trades', component_property='children')
+         ],
+        [Input('interval-component', 'n_intervals'), Input('data-recency', 'value'), Input('refresh-paused', 'value')],
+        [State('interval-component', 'interval'), State('session-id', 'data')]
+    )(overview)
+
+
+def follow_trades(tail, refresh_ms, session_id, callback, columns, base_name=None):
+    # Only trades newer than the browser's tail cursor are fetched and sent,
+    # and they are prepended to the rows it already shows.
+    tail = tail or {"since": None, "rows": 0}
+    trades, since = run_queries({
+        "trades": cached(querydb.get_trades_since, tail["since"], base_name, refresh_ms=refresh_ms),
+    }, session_id, callback)["trades"]
+    if trades.shape[0] == 0 and tail["since"] is not None:
+        raise PreventUpdate
+    data, rows = dash_utils.prepend_rows(trades[columns], tail["rows"], querydb.LATEST_TRADES_LIMIT)
+    return data, {"since": since, "rows": rows, "base": base_name}
 
+@app.callback(
+    [Output(component_id='latest-trades-table', component_property='data'),
+     Output(component_id='latest-trades-tail', component_property='data')],
+    [Input('interval-component', 'n_intervals')],
+    [State('latest-trades-tail', 'data'), State('interval-component', 'interval'), State('session-id', 'data')]
+)
+def latest_trades(n, tail, refresh_ms, session_id):
+    return follow_trades(tail, refresh_ms, session_id, "latest_trades", tabs.LATEST_TRADES_COLUMNS)
 
 @app.callback(
-    [Output(component_id='latest-trades', component_property='children')],
-    [Input('interval-component', 'n_intervals')]
+    [Output(component_id='latest-trades-bases-table', component_property='data'),
+     Output(component_id='latest-trades-bases-tail', component_property='data')],
+    [Input('bases-dropdown', 'value'), Input('interval-component', 'n_intervals')],
+    [State('latest-trades-bases-tail', 'data'), State('interval-component', 'interval'), State('session-id', 'data')]
 )
-def latest_trades(n):
-    latest_trades = dash_utils.as_datatable(querydb.get_all_latest_trades(cursor))
-    return latest_trades
+def latest_trades_bases(base_name, n, tail, refresh_ms, session_id):
+    if tail is not None and tail["base"] != base_name:
+        tail = None
+    return follow_trades(tail, refresh_ms, session_id, "latest_trades_bases", tabs.BASE_TRADES_COLUMNS, base_name)
 
 @app.callback(
     [Output(component_id='quote-currency', component_property='style'),
@@ -203,21 +333,15 @@ def latest_trades(n):
      Output(component_id='top-exchange', component_property='children'),
      Output(component_id='top-quote', component_property='children')
      ],
-    [Input('interval-component', 'n_intervals'), Input('quotes-dropdown', 'value'),  Input('data-recency', 'value')]
+    [Input('interval-component', 'n_intervals'), Input('quotes-dropdown', 'value'),  Input('data-recency', 'value')],
+    [State('interval-component', 'interval'), State('session-id', 'data')]
 )
-def charts(n, value, interval):    
-    cursor = connection.cursor()
-
-    results = {}
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = {
-            executor.submit(querydb.get_top_pairs_buy_side, cursor, value, interval): "buy_side",
-            executor.submit(querydb.get_exchange_buy_side, cursor, interval): "exchange",
-            executor.submit(querydb.get_quote_buy_side, cursor, interval): "quote",
-        }
-        for future in concurrent.futures.as_completed(futures):
-            results[futures[future]] = future.result()
-    cursor.close()
+def charts(n, value, interval, refresh_ms, session_id):    
+    results = run_queries({
+        "buy_side": cached(aggregates.get_top_pairs_buy_side, value, interval, refresh_ms=refresh_ms),
+        "exchange": cached(aggregates.get_exchange_buy_side, interval, refresh_ms=refresh_ms),
+        "quote": cached(aggregates.get_quote_buy_side, interval, refresh_ms=refresh_ms),
+    }, session_id, "charts", interval)
 
     df_buy_side = results["buy_side"]
     df_exchange = results["exchange"]
@@ -234,5 +358,37 @@ def charts(n, value, interval):
 
     return quote_currency_styling, buy, exchange, quote
 
+@app.callback(
+    [Output(component_id='freshness-table', component_property='data'),
+     Output(component_id='freshness-alert', component_property='children')],
+    [Input('interval-component', 'n_intervals'), Input('data-recency', 'value')],
+    [State('interval-component', 'interval'), State('session-id', 'data')]
+)
+def freshness(n, interval, refresh_ms, session_id):
+    df = run_queries({
+        "freshness": cached(querydb.get_freshness, interval, refresh_ms=refresh_ms),
+    }, session_id, "freshness", interval)["freshness"]
+
+    # data older than one refresh means the dashboard is redrawing stale trades
+    lagging = df[df["lagP99"] > refresh_ms]
+    if lagging.shape[0] > 0:
+        alert = html.Span(f"Ingestion is lagging: p99 trade-to-queryable lag is over the {refresh_ms / 1000:g}s refresh rate for "
+                          f"{', '.join(lagging['exchange'].fillna(lagging['exchangeId'].astype(str)).head(5))}"
+                          f" (worst {lagging['lagP99'].max() / 1000:,.1f}s)",
+                          style={"color": "#B00020", "font-weight": "bold"})
+    elif df.shape[0] > 0:
+        alert = html.Span(f"Data freshness: p99 trade-to-queryable lag {df['lagP99'].max():,.0f} ms")
+    else:
+        alert = None
+    return df[tabs.FRESHNESS_COLUMNS].to_dict("records"), alert
+
+if debug_mode:
+    @app.callback(
+        [Output(component_id='query-metrics-table', component_property='data')],
+        [Input('interval-component', 'n_intervals')]
+    )
+    def query_metrics_panel(n):
+        return [query_metrics.metrics.snapshot()]
+
 if __name__ == '__main__':
     app.run_server(debug=True)
\ No newline at end of file
@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+import result_decoding
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "input")
+
+# Pinot table -> columns the dashboard needs from it
+TABLES = {
+    "pairs": ["id", "baseName", "quoteName"],
+    "markets": ["id", "exchange"],
+    "exchanges": ["id", "name"],
+}
+
+
+class DimensionCache:
+    """
+        Client-side copy of the small pairs/markets/exchanges dimension tables.
+
+        Names are resolved to id sets before a query (so Pinot filters with
+        currencyPairId IN (...)) and numeric ids are decorated with names after
+        it, instead of per-row lookUp() calls in Pinot. Starts from the
+        input/*.json snapshots and, once start_refresh is called, reloads
+        from Pinot in the background.
+    """
+
+    def __init__(self, input_dir=INPUT_DIR, refresh_seconds=300):
+        self.input_dir = input_dir
+        self.refresh_seconds = refresh_seconds
+        self.tables = None
+        self.loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def load_files(self):
+        tables = {}
+        for table, columns in TABLES.items():
+            with open(os.path.join(self.input_dir, f"{table}.json")) as table_file:
+                rows = [json.loads(line) for line in table_file if line.strip()]
+            tables[table] = pd.DataFrame(rows, columns=columns)
+        self._set(tables)
+
+    def load_pinot(self, cursor):
+        tables = {}
+        for table, columns in TABLES.items():
+            cursor.execute(f"select {', '.join(columns)} from {table} limit 10000000")
+            tables[table] = result_decoding.frame(cursor)[columns]
+        self._set(tables)
+
+    def _set(self, tables):
+        pairs = tables["pairs"].set_index("id")
+        with self._lock:
+            self.tables = tables
+            self.pair_base = pairs["baseName"]
+            self.pair_quote = pairs["quoteName"]
+            self.market_exchange = tables["markets"].set_index("id")["exchange"]
+            self.exchange_name = tables["exchanges"].set_index("id")["name"]
+            self.loaded_at = time.time()
+
+    def _ensure_loaded(self):
+        if self.tables is None:
+            self.load_files()
+
+    def start_refresh(self, pool):
+        def refresh():
+            while True:
+                try:
+                    with pool.cursor() as cursor:
+                        self.load_pinot(cursor)
+                except Exception as e:
+                    print(f"Failed to refresh dimension tables: {e}")
+                time.sleep(self.refresh_seconds)
+
+        self._ensure_loaded()
+        self._thread = threading.Thread(target=refresh, name="dimension-refresh", daemon=True)
+        self._thread.start()
+
+    def pairs(self):
+        self._ensure_loaded()
+        return self.tables["pairs"]
+
+    def pair_ids(self, base_name=None, quote_name=None):
+        pairs = self.pairs()
+        mask = pd.Series(True, index=pairs.index)
+        if base_name is not None:
+            mask &= pairs["baseName"] == base_name
+        if quote_name is not None:
+            mask &= pairs["quoteName"] == quote_name
+        return sorted(pairs.loc[mask, "id"])
+
+    def base_names(self, pair_ids):
+        self._ensure_loaded()
+        return pd.Series(pair_ids).map(self.pair_base).values
+
+    def quote_names(self, pair_ids):
+        self._ensure_loaded()
+        return pd.Series(pair_ids).map(self.pair_quote).values
+
+    def market_exchanges(self, market_ids):
+        self._ensure_loaded()
+        return pd.Series(market_ids).map(self.market_exchange).values
+
+    def exchange_names(self, exchange_ids):
+        self._ensure_loaded()
+        return pd.Series(exchange_ids).map(self.exchange_name).values
+
+    def decorate(self, df):
+        """
+            Adds baseName/quoteName, market and exchange columns for whichever
+            of currencyPairId, marketId and exchangeId df has
+        """
+        if "currencyPairId" in df:
+            df["baseName"] = self.base_names(df["currencyPairId"])
+            df["quoteName"] = self.quote_names(df["currencyPairId"])
+        if "marketId" in df:
+            df["market"] = self.market_exchanges(df["marketId"])
+        if "exchangeId" in df:
+            df["exchange"] = self.exchange_names(df["exchangeId"])
+        return df
+
+
+cache = DimensionCache()
@@ -0,0 +1,386 @@
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+import dimensions
+import querydb
+import trade_columns
+from incremental import IncrementalAggregates
+from trade_columns import ORDER_SIDES
+
+COLUMNS = {
+    "tsMs": np.int64,
+    "price": np.float64,
+    "amount": np.float64,
+    "pairId": np.int64,
+    "exchangeId": np.int64,
+    "side": np.int8,
+}
+
+
+class _Partition:
+    """
+        Columns of the trades of one partition_ms slice of time, in arrays
+        that grow by doubling and are reused when the slot is recycled
+    """
+
+    def __init__(self, capacity=1024):
+        self.start = None
+        self.size = 0
+        self.columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+    def reset(self, start):
+        self.start = start
+        self.size = 0
+
+    def extend(self, columns, index):
+        count = len(index)
+        capacity = len(self.columns["tsMs"])
+        if self.size + count > capacity:
+            capacity = max(capacity * 2, self.size + count)
+            for name, array in self.columns.items():
+                grown = np.empty(capacity, dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                self.columns[name] = grown
+        for name, array in self.columns.items():
+            array[self.size:self.size + count] = columns[name][index]
+        self.size += count
+
+
+class ColumnarRingBuffer:
+    """
+        The last `retention_ms` of trades by trade time, as NumPy columns in
+        a ring of time partitions. Once trade time moves past a partition's
+        slot the oldest partition is recycled, so memory depends on the
+        retention and the trade rate, not on how long the process has run.
+    """
+
+    def __init__(self, retention_ms, partition_ms=5000):
+        self.partition_ms = partition_ms
+        self.slots = [_Partition() for _ in range(-(-retention_ms // partition_ms) + 1)]
+        self.newest = None
+        self.late = 0
+        self._lock = threading.Lock()
+
+    def append(self, columns):
+        """
+            columns maps every name in COLUMNS to an array of the same length
+        """
+        keys = columns["tsMs"] // self.partition_ms
+        with self._lock:
+            newest = max(int(keys.max()), self.newest if self.newest is not None else -1)
+            oldest = newest - len(self.slots) + 1
+            for key in np.unique(keys):
+                key = int(key)
+                index = np.flatnonzero(keys == key)
+                if key < oldest:
+                    self.late += len(index)
+                    continue
+                slot = self.slots[key % len(self.slots)]
+                if slot.start != key * self.partition_ms:
+                    slot.reset(key * self.partition_ms)
+                slot.extend(columns, index)
+            self.newest = newest
+
+    def snapshot(self, start_ms, end_ms):
+        """
+            Copies of the columns for trades with start_ms <= tsMs < end_ms
+        """
+        with self._lock:
+            parts = [slot for slot in self.slots if slot.start is not None
+                     and slot.start < end_ms and slot.start + self.partition_ms > start_ms]
+            columns = {name: np.concatenate([slot.columns[name][:slot.size] for slot in parts])
+                       if parts else np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+        mask = (columns["tsMs"] >= start_ms) & (columns["tsMs"] < end_ms)
+        return {name: array[mask] for name, array in columns.items()}
+
+    def rows(self):
+        with self._lock:
+            return sum(slot.size for slot in self.slots)
+
+
+def _runs(key):
+    """
+        Sorts rows by key: returns the order and where each run of equal keys
+        starts in it, so that every per-key aggregate is a ufunc.reduceat
+    """
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]]) if len(key) else np.empty(0, dtype=np.int64)
+    return order, starts
+
+
+class _BufferAggregates(IncrementalAggregates):
+    """
+        IncrementalAggregates answered from the ring buffer: the per-window
+        partials are grouped from raw rows on each call, so windows are exact
+        rather than bucket-aligned, and there is nothing to refresh
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def refresh(self, cursor):
+        pass
+
+    def _partials(self, start_ms, end_ms, pair_ids=None):
+        columns = self.buffer.snapshot(start_ms, end_ms)
+        if pair_ids is not None:
+            mask = np.isin(columns["pairId"], np.asarray(list(pair_ids), dtype=np.int64))
+            columns = {name: array[mask] for name, array in columns.items()}
+        order, starts = _runs((columns["pairId"] << 16 | columns["exchangeId"]) << 2 | columns["side"])
+        price, amount = columns["price"][order], columns["amount"][order]
+        firsts = order[starts]
+
+        def reduce(ufunc, values):
+            return ufunc.reduceat(values, starts) if len(starts) else values[:0]
+
+        partials = pd.DataFrame({
+            "currencyPairId": columns["pairId"][firsts],
+            "exchangeId": columns["exchangeId"][firsts],
+            "orderSide": ORDER_SIDES[columns["side"][firsts]],
+            "count": np.diff(np.r_[starts, len(order)]),
+            "sumPrice": reduce(np.add, price),
+            "minPrice": reduce(np.minimum, price),
+            "maxPrice": reduce(np.maximum, price),
+            "sumAmount": reduce(np.add, amount),
+            "maxAmount": reduce(np.maximum, amount),
+            "sumAmountPrice": reduce(np.add, amount * price),
+        })
+        return partials
+
+    def _window(self, interval, periods_ago=0, pair_ids=None):
+        start_ms, end_ms, _ = querydb._window(interval, periods_ago)
+        return self._partials(start_ms, end_ms, pair_ids)
+
+    def asset_snapshot(self, cursor, base_name, interval):
+        ids = querydb.pair_ids(base_name)
+        df = pd.concat([self._window(interval, periods_ago, ids).assign(period=1 - periods_ago)
+                        for periods_ago in (1, 0)], ignore_index=True)
+        return querydb._asset_snapshot(df.rename(columns={"sumAmount": "amountTraded"}))
+
+    def all_prices(self, cursor, base_name, interval, points=500):
+        start_ms, end_ms, _ = querydb._window(interval)
+        columns = self.buffer.snapshot(start_ms, end_ms)
+        mask = np.isin(columns["pairId"], np.asarray(querydb.pair_ids(base_name, querydb.USD), dtype=np.int64))
+        ts, price = columns["tsMs"][mask], columns["price"][mask]
+        if len(ts) == 0:
+            return querydb.price_buckets(pd.DataFrame())
+        order = np.argsort(ts, kind="stable")
+        ts, price = ts[order], price[order]
+        # epoch-aligned buckets, like DATETIMECONVERT's, are runs of the trades in time order
+        size = querydb.bucket_ms(end_ms - start_ms, points)
+        buckets = ts - ts % size
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        lasts = np.r_[starts[1:], len(ts)] - 1
+        return querydb.price_buckets(pd.DataFrame({
+            "bucket": buckets[starts],
+            "sumPrice": np.add.reduceat(price, starts),
+            "count": lasts - starts + 1,
+            "minPrice": np.minimum.reduceat(price, starts),
+            "maxPrice": np.maximum.reduceat(price, starts),
+            "firstPrice": price[starts],
+            "firstMs": ts[starts],
+            "lastPrice": price[lasts],
+            "lastMs": ts[lasts],
+        }))
+
+    def get_pairs(self, cursor, base_name, interval):
+        window = self._window(interval, pair_ids=querydb.pair_ids(base_name))
+        window = window.assign(market=dimensions.cache.exchange_names(window["exchangeId"]))
+        df = window.groupby("market", as_index=False)["count"].sum()
+        return df.sort_values("count", ascending=False, ignore_index=True)
+
+    def get_assets(self, cursor, base_name, interval):
+        window = self._window(interval, pair_ids=querydb.pair_ids(base_name))
+        window = window.assign(asset=dimensions.cache.quote_names(window["currencyPairId"]))
+        df = window.groupby("asset", as_index=False)["count"].sum()
+        return df.sort_values("count", ascending=False, ignore_index=True)
+
+    def get_order_side(self, cursor, base_name, interval):
+        window = self._window(interval, pair_ids=querydb.pair_ids(base_name))
+        window = window[window["orderSide"] != "null"]
+        df = window.groupby("orderSide", as_index=False)["count"].sum()
+        return df.sort_values("count", ascending=False, ignore_index=True)
+
+
+def _local_or_fallback(name, periods=1, interval_at=-1, owner="EmbeddedTrades"):
+    """
+        A query method answered from self.local when it holds the `periods`
+        intervals the query reads (args[interval_at] is the interval), and by
+        the fallback otherwise
+    """
+    def query(self, cursor, *args):
+        source = self.local if self.covers(args[interval_at] * periods) else self.fallback_for(name)
+        return getattr(source, name)(cursor, *args)
+    query.__name__ = name
+    query.__qualname__ = f"{owner}.{name}"
+    return query
+
+
+class TradeConsumer:
+    """
+        Consumes the trades topic in a background thread, starting from
+        `retention_ms` ago, and appends each decoded batch of columns to every
+        sink. Every process uses its own consumer group, so each one reads
+        every partition.
+    """
+
+    def __init__(self, retention_ms, sinks=(), bootstrap_servers="localhost:9092", wire_format="json",
+                 batch_size=5000):
+        self.retention_ms = retention_ms
+        self.sinks = list(sinks)
+        self.bootstrap_servers = bootstrap_servers
+        self.batch_size = batch_size
+        self.topic, self.decode = trade_columns.decoder(wire_format)
+
+        # trades are only complete from here on, and only once caught up
+        self.covered_from_ms = None
+        self.caught_up = False
+        self.consumed = 0
+        self.skipped = 0
+        self._started = False
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trades-consumer", daemon=True)
+
+    def add_sink(self, sink, retention_ms=0):
+        self.sinks.append(sink)
+        self.retention_ms = max(self.retention_ms, retention_ms)
+        return self
+
+    def start(self):
+        if not self._started:
+            self._started = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+    def covers(self, ms):
+        """
+            Whether every trade of the last `ms` has been consumed
+        """
+        return self.caught_up and time.time() * 1000 - ms >= self.covered_from_ms
+
+    def stats(self):
+        return {"consumed": self.consumed, "skipped": self.skipped, "caughtUp": self.caught_up,
+                "coveredFromMs": self.covered_from_ms}
+
+    def _on_assign(self, consumer, partitions):
+        # start retention_ms back so the sinks are full as soon as it catches up
+        since = int(time.time() * 1000) - self.retention_ms
+        for partition in partitions:
+            partition.offset = since
+        try:
+            partitions = consumer.offsets_for_times(partitions, timeout=10)
+            self.covered_from_ms = since
+        except Exception:
+            self.covered_from_ms = int(time.time() * 1000)
+        consumer.assign(partitions)
+
+    def handle(self, messages):
+        payloads = [message.value() for message in messages if message.error() is None]
+        if payloads:
+            columns = self.decode(payloads)
+            if len(columns["tsMs"]):
+                for sink in self.sinks:
+                    sink.append(columns)
+            self.consumed += len(columns["tsMs"])
+            self.skipped += len(payloads) - len(columns["tsMs"])
+
+    def _run(self):
+        from confluent_kafka import Consumer
+
+        consumer = Consumer({
+            "bootstrap.servers": self.bootstrap_servers,
+            "group.id": f"dashboard-trades-{uuid.uuid4()}",
+            "enable.auto.commit": False,
+            "auto.offset.reset": "latest",
+        })
+        consumer.subscribe([self.topic], on_assign=self._on_assign)
+        try:
+            while not self._stopping.is_set():
+                messages = consumer.consume(num_messages=self.batch_size, timeout=0.5)
+                try:
+                    self.handle(messages)
+                except Exception as e:
+                    # the sinks miss this batch, so they are only complete from here on
+                    print(f"Failed to consume {len(messages)} trades: {e}")
+                    self.caught_up = False
+                    self.covered_from_ms = int(time.time() * 1000)
+                    continue
+                if self.covered_from_ms is not None and len(messages) < self.batch_size:
+                    self.caught_up = True
+        except Exception as e:
+            print(f"Trades consumer stopped: {e}")
+        finally:
+            # queries go to the fallback from now on
+            self.caught_up = False
+            consumer.close()
+
+
+class EmbeddedTrades:
+    """
+        Consumes the trades topic in the dashboard process into a
+        ColumnarRingBuffer holding `window_minutes` * 2 of trades (a window and
+        the period before it), and answers queries over windows that fit from
+        it with vectorized group-bys instead of a broker round trip. Longer
+        windows, and every query until the consumer has caught up, go to
+        `fallback` (querydb or IncrementalAggregates).
+
+        Methods mirror the querydb functions they replace.
+    """
+
+    def __init__(self, fallback=querydb, window_minutes=2, partition_seconds=5,
+                 bootstrap_servers="localhost:9092", wire_format="json", batch_size=5000):
+        self.fallback = fallback
+        self.window_minutes = window_minutes
+        retention_ms = 2 * window_minutes * 60 * 1000
+        self.buffer = ColumnarRingBuffer(retention_ms, partition_seconds * 1000)
+        self.local = _BufferAggregates(self.buffer)
+        self.consumer = TradeConsumer(retention_ms, [self.buffer], bootstrap_servers, wire_format, batch_size)
+
+    def start(self):
+        self.consumer.start()
+        return self
+
+    def stop(self):
+        self.consumer.stop()
+
+    def covers(self, minutes):
+        return minutes <= 2 * self.window_minutes and self.consumer.covers(minutes * 60 * 1000)
+
+    def fallback_for(self, name):
+        return self.fallback if hasattr(self.fallback, name) else querydb
+
+    def stats(self):
+        return {"rows": self.buffer.rows(), "late": self.buffer.late, **self.consumer.stats()}
+
+    get_all_pairs = _local_or_fallback("get_all_pairs")
+    get_all_assets = _local_or_fallback("get_all_assets")
+    get_aggregate_trades_current_period = _local_or_fallback("get_aggregate_trades_current_period")
+    get_aggregate_trades_previous_period = _local_or_fallback("get_aggregate_trades_previous_period", periods=2)
+    get_exchange_buy_side = _local_or_fallback("get_exchange_buy_side")
+    get_quote_buy_side = _local_or_fallback("get_quote_buy_side")
+    get_top_pairs_buy_side = _local_or_fallback("get_top_pairs_buy_side")
+    get_top_pairs_sell_side = _local_or_fallback("get_top_pairs_sell_side")
+    asset_snapshot = _local_or_fallback("asset_snapshot", periods=2)
+    all_prices = _local_or_fallback("all_prices", interval_at=1)
+    get_pairs = _local_or_fallback("get_pairs")
+    get_assets = _local_or_fallback("get_assets")
+    get_order_side = _local_or_fallback("get_order_side")
+
+
+def from_env(fallback):
+    return EmbeddedTrades(
+        fallback,
+        window_minutes=int(os.environ.get("EMBEDDED_WINDOW_MINUTES", 2)),
+        bootstrap_servers=os.environ.get("EMBEDDED_BOOTSTRAP_SERVERS", "localhost:9092"),
+        wire_format=os.environ.get("TRADES_WIRE_FORMAT", "json"),
+    )
@@ -0,0 +1,152 @@
+import threading
+import time
+
+import pandas as pd
+
+import dimensions
+import result_decoding
+
+PARTIAL_COLUMNS = [
+    "bucket", "currencyPairId", "exchangeId", "orderSide",
+    "count", "sumPrice", "minPrice", "maxPrice", "sumAmount", "maxAmount", "sumAmountPrice"
+]
+
+USD = "United States Dollar"
+
+
+class IncrementalAggregates:
+    """
+        Keeps per-second partial aggregates (count, sum/min/max price,
+        sum/max amount, sum of amount*price) per pair, exchange and order side
+        for the last `retention_minutes`. Each refresh only asks Pinot for
+        buckets newer than the watermark (minus `late_seconds`, which are
+        re-fetched to pick up late arrivals) and evicts expired buckets, so
+        the cost of a tick depends on new data rather than window size.
+
+        Windows are answered at bucket granularity, so edges can be off by up
+        to one bucket compared to ago() on raw rows.
+
+        Methods mirror the querydb functions they replace.
+    """
+
+    def __init__(self, retention_minutes=60, bucket_seconds=1, late_seconds=5,
+                 min_refresh_seconds=1.0):
+        self.retention_ms = retention_minutes * 60 * 1000
+        self.bucket_ms = bucket_seconds * 1000
+        self.late_ms = late_seconds * 1000
+        self.min_refresh_seconds = min_refresh_seconds
+
+        self.partials = pd.DataFrame(columns=PARTIAL_COLUMNS)
+        self.watermark = None
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, cursor):
+        with self._lock:
+            now = time.time()
+            if now - self._refreshed_at < self.min_refresh_seconds:
+                return
+
+            now_ms = int(now * 1000)
+            oldest = now_ms - self.retention_ms
+            since = oldest if self.watermark is None else max(oldest, self.watermark - self.late_ms)
+            since -= since % self.bucket_ms
+
+            new_partials = self._fetch(cursor, since)
+            kept = self.partials[(self.partials["bucket"] >= oldest) & (self.partials["bucket"] < since)]
+            self.partials = pd.concat([kept, new_partials], ignore_index=True) if kept.shape[0] > 0 else new_partials
+            if new_partials.shape[0] > 0:
+                self.watermark = max(self.watermark or 0, int(new_partials["bucket"].max()))
+            self._refreshed_at = now
+
+    def _fetch(self, cursor, since):
+        cursor.execute("""
+        select DATETIMECONVERT(tsMs, '1:MILLISECONDS:EPOCH', '1:MILLISECONDS:EPOCH', %(granularity)s) AS bucket,
+               currencyPairId, exchangeId, orderSide,
+               count(*) AS count, sum(price) AS sumPrice, min(price) AS minPrice, max(price) AS maxPrice,
+               sum(amount) AS sumAmount, max(amount) AS maxAmount, sum(amount*price) AS sumAmountPrice
+        from trades
+        WHERE tsMs >= %(since)s
+        group by bucket, currencyPairId, exchangeId, orderSide
+        limit 10000000
+        """, {"since": since, "granularity": f"{self.bucket_ms}:MILLISECONDS"})
+        df = result_decoding.frame(cursor)
+        return df[PARTIAL_COLUMNS].astype({"bucket": "int64"})
+
+    def _window(self, interval, periods_ago=0):
+        end = int(time.time() * 1000) - periods_ago * interval * 60 * 1000
+        start = end - interval * 60 * 1000
+        partials = self.partials
+        return partials[(partials["bucket"] > start - self.bucket_ms) & (partials["bucket"] <= end)]
+
+    def _with_pairs(self, partials):
+        return partials.assign(
+            baseName=dimensions.cache.base_names(partials["currencyPairId"]),
+            quoteName=dimensions.cache.quote_names(partials["currencyPairId"]),
+        )
+
+    def get_all_assets(self, cursor, interval):
+        self.refresh(cursor)
+        window = self._with_pairs(self._window(interval))
+        window = window[window["quoteName"] == USD]
+        df = window.groupby("baseName").agg(
+            minPrice=("minPrice", "min"), sumPrice=("sumPrice", "sum"), maxPrice=("maxPrice", "max"),
+            count=("count", "sum"), amountTraded=("sumAmount", "sum"),
+        ).reset_index()
+        df["avgPrice"] = df["sumPrice"] / df["count"]
+        df = df.sort_values("count", ascending=False)
+        df = df[["baseName", "minPrice", "avgPrice", "maxPrice", "count", "amountTraded"]].reset_index(drop=True)
+        return df
+
+    def get_all_pairs(self, cursor, interval):
+        self.refresh(cursor)
+        window = self._with_pairs(self._window(interval))
+        df = window.groupby(["baseName", "quoteName"]).agg(
+            transactions=("count", "sum"), biggestTrade=("maxAmount", "max"), amountTraded=("sumAmount", "sum"),
+        ).reset_index()
+        df["averageTrade"] = df["amountTraded"] / df["transactions"]
+        df = df.rename(columns={"baseName": "base", "quoteName": "quote"})
+        df = df.sort_values("transactions", ascending=False).head(10)
+        df = df[["base", "quote", "transactions", "biggestTrade", "averageTrade", "amountTraded"]].reset_index(drop=True)
+        return df
+
+    def _aggregate_trades(self, window):
+        return pd.DataFrame({"count": [int(window["count"].sum())], "amountTraded": [float(window["sumAmount"].sum())]})
+
+    def get_aggregate_trades_current_period(self, cursor, interval):
+        self.refresh(cursor)
+        return self._aggregate_trades(self._window(interval))
+
+    def get_aggregate_trades_previous_period(self, cursor, interval):
+        self.refresh(cursor)
+        return self._aggregate_trades(self._window(interval, periods_ago=1))
+
+    def get_exchange_buy_side(self, cursor, interval, n=20):
+        self.refresh(cursor)
+        window = self._window(interval)
+        window = window[window["orderSide"] == "BUYSIDE"]
+        window = window.assign(exchangeName=dimensions.cache.exchange_names(window["exchangeId"]))
+        df = window.groupby("exchangeName")["count"].sum().reset_index(name="transactions")
+        return df.sort_values("transactions", ascending=False).reset_index(drop=True).head(n)
+
+    def get_quote_buy_side(self, cursor, interval, n=20):
+        self.refresh(cursor)
+        window = self._window(interval)
+        window = self._with_pairs(window[window["orderSide"] == "BUYSIDE"])
+        df = window.groupby("quoteName")["count"].sum().reset_index(name="transactions")
+        return df.sort_values("transactions", ascending=False).reset_index(drop=True).head(n)
+
+    def get_top_pairs_buy_side(self, cursor, quote_name, interval, n=20):
+        return self._top_pairs(cursor, quote_name, interval, "BUYSIDE", n)
+
+    def get_top_pairs_sell_side(self, cursor, quote_name, interval, n=20):
+        return self._top_pairs(cursor, quote_name, interval, "SELLSIDE", n)
+
+    def _top_pairs(self, cursor, quote_name, interval, order_side, n):
+        self.refresh(cursor)
+        window = self._window(interval)
+        window = self._with_pairs(window[window["orderSide"] == order_side])
+        window = window[window["quoteName"] == quote_name]
+        df = window.groupby(["baseName", "quoteName"])["sumAmountPrice"].sum().reset_index(name="totalAmount")
+        df = df.sort_values("totalAmount", ascending=False).reset_index(drop=True)
+        return df[["totalAmount", "baseName", "quoteName"]].head(n)
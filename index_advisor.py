@@ -0,0 +1,283 @@
+import argparse
+import collections
+import json
+import re
+
+from pinotdb.db import apply_parameters
+
+import dimensions
+import partitioning
+import querydb
+from trade_columns import SIDE_CODES
+
+CONFIG_DIR = "config"
+QUERIES_FILE = f"{CONFIG_DIR}/queries.sql"
+
+# table name -> table configs that should carry its indexes
+TABLE_CONFIGS = {
+    "trades": ["trades_table.json", "trades_table_avro.json", "trades_offline_table.json"],
+    "trades_ohlcv_1s": ["trades_ohlcv_1s_table.json"],
+    "trades_ohlcv_1m": ["trades_ohlcv_1m_table.json"],
+    "trades_ohlcv_1h": ["trades_ohlcv_1h_table.json"],
+}
+
+# What the dashboard runs, at the shortest and longest recency so that both
+# raw trades and the rollups show up in the workload, and over a day, which
+# only the 1h rollup (kept a year) serves for history and ad hoc charts.
+DASHBOARD_QUERIES = [
+    (name, fn, args)
+    for interval in (1, 30, 24 * 60)
+    for name, fn, args in [
+        ("get_all_pairs", querydb.get_all_pairs, (interval,)),
+        ("get_all_assets", querydb.get_all_assets, (interval,)),
+        ("get_aggregate_trades_current_period", querydb.get_aggregate_trades_current_period, (interval,)),
+        ("get_aggregate_trades_previous_period", querydb.get_aggregate_trades_previous_period, (interval,)),
+        ("get_exchange_buy_side", querydb.get_exchange_buy_side, (interval,)),
+        ("get_quote_buy_side", querydb.get_quote_buy_side, (interval,)),
+        ("get_top_pairs_buy_side", querydb.get_top_pairs_buy_side, (querydb.USD, interval)),
+        ("asset_snapshot", querydb.asset_snapshot, ("Bitcoin", interval)),
+        ("all_prices", querydb.all_prices, ("Bitcoin", interval)),
+    ]
+] + [
+    ("get_trades_since", querydb.get_trades_since, ()),
+    ("get_latest_trades", querydb.get_latest_trades, ("Bitcoin",)),
+    ("quotes", querydb.quotes, ()),
+]
+
+AGGREGATE_FUNCTIONS = {"count": "COUNT", "sum": "SUM", "min": "MIN", "max": "MAX", "avg": "AVG",
+                       "firstwithtime": "FIRSTWITHTIME", "lastwithtime": "LASTWITHTIME"}
+# What a star-tree can pre-aggregate; a query using anything else skips it
+STAR_TREE_FUNCTIONS = {"COUNT", "SUM", "MIN", "MAX"}
+
+_string_literal = re.compile(r"'(?:[^']|'')*'")
+_comparison = re.compile(r"\b(\w+)\s*(>=|<=|<>|!=|=|>|<)")
+_in_list = re.compile(r"\b(\w+)\s+(?:NOT\s+)?IN\s*\(", re.IGNORECASE)
+_set_function = re.compile(r"\b(?:IN_SUBQUERY|IN_PARTITIONED_SUBQUERY|IN_ID_SET)\s*\(\s*(\w+)", re.IGNORECASE)
+_aggregate = re.compile(r"\b(count|sum|min|max|avg)\s*\(\s*(\*|\w+)\s*\)", re.IGNORECASE)
+_time_aggregate = re.compile(r"\b(firstwithtime|lastwithtime)\s*\(\s*(\w+)\s*,\s*(\w+)\s*,", re.IGNORECASE)
+_expression_aggregate = re.compile(r"\b(?:count|sum|min|max|avg)\s*\(\s*\w+\s*[-+*/]", re.IGNORECASE)
+
+
+class RecordingCursor:
+    """
+        Stands in for a pinotdb cursor: records each statement and answers it
+        with no rows, so querydb functions can be run to see the SQL they send
+    """
+
+    def __init__(self):
+        self.statements = []
+        self.description = []
+
+    def execute(self, operation, parameters=None):
+        sql = apply_parameters(operation, parameters) if parameters else operation
+        self.statements.append(sql)
+        self.description = [(name,) for name in _select_names(sql)]
+
+    def __iter__(self):
+        return iter([])
+
+
+def _select_names(sql):
+    select = re.search(r"select\s+(.*?)\s+from\s", sql, re.IGNORECASE | re.DOTALL).group(1)
+    names, depth, current = [], 0, ""
+    for char in select + ",":
+        if char == "," and depth == 0:
+            names.append(re.split(r"\s+AS\s+", current.strip(), flags=re.IGNORECASE)[-1])
+            current = ""
+            continue
+        depth += {"(": 1, ")": -1}.get(char, 0)
+        current += char
+    return names
+
+
+def querydb_statements():
+    # Names are resolved from the files in input/, as the dashboard does at startup
+    dimensions.cache.load_files()
+    # route to every rollup, as a deployment that has them all does
+    querydb.pin_rollup_coverage({table: 0 for table, _ in querydb.ROLLUPS})
+    statements = []
+    for name, fn, args in DASHBOARD_QUERIES:
+        cursor = RecordingCursor()
+        try:
+            fn(cursor, *args)
+        except Exception:
+            # post-processing may not cope with empty results, the SQL is recorded by then
+            pass
+        statements += [(name, sql) for sql in cursor.statements]
+    return statements
+
+
+def file_statements(path=QUERIES_FILE):
+    with open(path) as queries_file:
+        text = "\n".join(line for line in queries_file if not line.lstrip().startswith("--"))
+    parts = re.split(r"(?=^\s*select\b)", text, flags=re.IGNORECASE | re.MULTILINE)
+    return [(f"{path}#{index}", part.strip()) for index, part in enumerate(parts, 1) if part.strip()]
+
+
+def _clause(sql, keyword, terminators):
+    match = re.search(rf"\b{keyword}\b(.*?)(?=\b(?:{'|'.join(terminators)})\b|$)", sql, re.IGNORECASE | re.DOTALL)
+    return match.group(1) if match else ""
+
+
+def analyze(sql, columns_by_table):
+    """
+        Which columns a statement filters on by equality/IN and by range,
+        groups by and aggregates, restricted to its table's schema
+    """
+    table = re.search(r"\bfrom\s+(\w+)", sql, re.IGNORECASE).group(1)
+    columns = columns_by_table.get(table, set())
+    unquoted = _string_literal.sub("''", sql)
+    where = _clause(unquoted, "where", ["group", "order", "limit"])
+    group_by = _clause(unquoted, "group\\s+by", ["order", "limit"])
+    select = _clause(unquoted, "select", ["from"])
+
+    equality, ranges = set(), set()
+    for column, operator in _comparison.findall(where):
+        (equality if operator in ("=", "<>", "!=") else ranges).add(column)
+    equality.update(_in_list.findall(where))
+    equality.update(_set_function.findall(where))
+
+    aggregates = {f"{AGGREGATE_FUNCTIONS[fn.lower()]}__{column}"
+                  for fn, column in _aggregate.findall(select) if column == "*" or column in columns}
+    aggregates.update(f"{AGGREGATE_FUNCTIONS[fn.lower()]}__{column}"
+                      for fn, column, _ in _time_aggregate.findall(select) if column in columns)
+    return {
+        "table": table,
+        "equality": sorted(equality & columns),
+        "range": sorted(ranges & columns),
+        "groupBy": sorted(set(re.findall(r"\w+", group_by)) & columns),
+        "aggregates": sorted(aggregates),
+        "expressionAggregates": bool(_expression_aggregate.search(select)),
+    }
+
+
+def load_schema_columns():
+    columns_by_table, time_granularity = {}, {}
+    for table in TABLE_CONFIGS:
+        with open(f"{CONFIG_DIR}/{table}_schema.json") as schema_file:
+            schema = json.load(schema_file)
+        fields = schema.get("dimensionFieldSpecs", []) + schema.get("metricFieldSpecs", []) \
+            + schema.get("dateTimeFieldSpecs", [])
+        columns_by_table[table] = {field["name"] for field in fields}
+        for field in schema.get("dateTimeFieldSpecs", []):
+            size, unit = field["granularity"].split(":")
+            time_granularity[(table, field["name"])] = int(size) * {"NANOSECONDS": 1e-6, "MILLISECONDS": 1}.get(unit, 1)
+    return columns_by_table, time_granularity
+
+
+def column_cardinalities():
+    """
+        Distinct values each filtered column can take: the ids in input/, and
+        buy or sell for orderSide
+    """
+    dimensions.cache.load_files()
+    tables = dimensions.cache.tables
+    return {
+        "currencyPairId": len(tables["pairs"]),
+        "marketId": len(tables["markets"]),
+        "exchangeId": len(tables["exchanges"]),
+        "orderSide": len(SIDE_CODES),
+    }
+
+
+def recommend(analyses, time_granularity, cardinalities=None, star_tree_min_granularity_ms=60 * 1000):
+    """
+        Per table: the equality-filtered column that lets statements skip the
+        most rows is sorted, the other equality-filtered columns get inverted
+        indexes and range-filtered columns get range indexes. A filter on a
+        column with n values keeps about 1/n of the rows, so each statement
+        counts 1 - 1/n for its column; ties go to the table's partition
+        column, then to the column grouped on more often. A star-tree covering
+        the group-by and filter columns is added when the time filter is
+        coarse enough (at least star_tree_min_granularity_ms) to be a dimension.
+    """
+    cardinalities = column_cardinalities() if cardinalities is None else cardinalities
+    by_table = collections.defaultdict(list)
+    for analysis in analyses:
+        by_table[analysis["table"]].append(analysis)
+
+    recommendations = {}
+    for table, table_analyses in by_table.items():
+        if table not in TABLE_CONFIGS:
+            continue
+        equality = collections.Counter(column for a in table_analyses for column in a["equality"])
+        ranges = collections.Counter(column for a in table_analyses for column in a["range"])
+        group_by = collections.Counter(column for a in table_analyses for column in a["groupBy"])
+
+        partition_columns = partitioning.partition_columns(f"{CONFIG_DIR}/{TABLE_CONFIGS[table][0]}")
+
+        def skipped(column):
+            cardinality = cardinalities.get(column)
+            return equality[column] * (1 - 1 / cardinality) if cardinality else equality[column]
+
+        sorted_column = [max(equality, key=lambda column: (
+            skipped(column), column in partition_columns, group_by[column]))] if equality else []
+        recommendation = {
+            "sortedColumn": sorted_column,
+            "invertedIndexColumns": sorted(set(equality) - set(sorted_column)),
+            "rangeIndexColumns": sorted(ranges),
+            "starTreeIndexConfigs": [],
+            "statements": len(table_analyses),
+        }
+
+        coarse_time = all(time_granularity.get((table, column), 0) >= star_tree_min_granularity_ms for column in ranges)
+        if coarse_time:
+            dimensions_counter = equality + group_by
+            split_order = [column for column, _ in dimensions_counter.most_common()] + \
+                [column for column in ranges if column not in dimensions_counter]
+            pairs = {pair for a in table_analyses for pair in a["aggregates"]}
+            recommendation["starTreeIndexConfigs"] = [{
+                "dimensionsSplitOrder": split_order,
+                "skipStarNodeCreationForDimensions": [],
+                "functionColumnPairs": sorted(pair for pair in pairs
+                                              if pair.split("__")[0] in STAR_TREE_FUNCTIONS),
+                "maxLeafRecords": 10000,
+            }]
+            # e.g. FIRSTWITHTIME: statements using these are answered from the segments instead
+            unsupported = sorted(pair for pair in pairs
+                                 if pair.split("__")[0] not in STAR_TREE_FUNCTIONS | {"AVG"})
+            if unsupported:
+                recommendation["starTreeUnsupported"] = unsupported
+        else:
+            recommendation["starTreeSkipped"] = "time filter is finer than star-tree dimensions should be"
+        recommendations[table] = recommendation
+    return recommendations
+
+
+def apply(recommendations):
+    for table, recommendation in recommendations.items():
+        for config_name in TABLE_CONFIGS[table]:
+            path = f"{CONFIG_DIR}/{config_name}"
+            with open(path) as config_file:
+                config = json.load(config_file)
+            index_config = config.setdefault("tableIndexConfig", {})
+            for key in ["sortedColumn", "invertedIndexColumns", "rangeIndexColumns", "starTreeIndexConfigs"]:
+                if recommendation[key]:
+                    index_config[key] = recommendation[key]
+                else:
+                    index_config.pop(key, None)
+            with open(path, "w") as config_file:
+                json.dump(config, config_file, indent=2)
+            print(f"Updated {path}")
+
+
+def workload():
+    return querydb_statements() + file_statements()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Index and star-tree recommendations from the dashboard's queries")
+    parser.add_argument("--apply", action="store_true", help="Write the recommendations into config/*_table.json")
+    parser.add_argument("--show-queries", action="store_true")
+    args = parser.parse_args()
+
+    columns_by_table, time_granularity = load_schema_columns()
+    statements = workload()
+    analyses = [analyze(sql, columns_by_table) for _, sql in statements]
+    if args.show_queries:
+        for (name, sql), analysis in zip(statements, analyses):
+            print(name, json.dumps(analysis))
+    recommendations = recommend(analyses, time_granularity)
+    print(json.dumps(recommendations, indent=2))
+    if args.apply:
+        apply(recommendations)
@@ -0,0 +1,403 @@
+import heapq
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import dimensions
+import embedded
+import querydb
+import trade_columns
+
+# Mersenne prime for the count-min sketch's hash family
+PRIME = 2 ** 31 - 1
+# Base and quote codes stay below this, so (base, quote) packs into one int key
+CODE_LIMIT = 1 << 15
+
+
+class SpaceSaving:
+    """
+        Space-Saving summary (Metwally et al.) of the heaviest keys of a
+        weighted stream, in at most `capacity` counters. A key that is not
+        monitored when the summary is full takes over the smallest counter and
+        inherits its count as error: every count overestimates its key's
+        weight by at most its error, and every key heavier than
+        total / capacity is monitored.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counters = {}
+        self.total = 0.0
+        # (count, key) entries, stale once the key's count has moved on
+        self._heap = []
+
+    def add(self, key, weight=1.0):
+        self.total += weight
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self.counters) < self.capacity:
+            counter = self.counters[key] = [weight, 0.0]
+        else:
+            floor = self._evict()
+            counter = self.counters[key] = [floor + weight, floor]
+        heapq.heappush(self._heap, (counter[0], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heapify()
+
+    def _heapify(self):
+        self._heap = [(count, key) for key, (count, _) in self.counters.items()]
+        heapq.heapify(self._heap)
+
+    def _evict(self):
+        while True:
+            count, key = heapq.heappop(self._heap)
+            counter = self.counters.get(key)
+            if counter is not None and counter[0] == count:
+                del self.counters[key]
+                return count
+
+    def floor(self):
+        """
+            The most an unmonitored key can have weighed
+        """
+        if len(self.counters) < self.capacity:
+            return 0.0
+        return min(count for count, _ in self.counters.values())
+
+    @classmethod
+    def merge(cls, summaries, capacity):
+        """
+            One summary of the streams summarized by `summaries`. A key
+            missing from a full summary may have weighed up to its floor there,
+            which is added to the key's count and error, so merged counts stay
+            upper bounds.
+        """
+        merged = cls(capacity)
+        floors = [summary.floor() for summary in summaries]
+        unmonitored = sum(floors)
+        counters = {}
+        for summary, floor in zip(summaries, floors):
+            merged.total += summary.total
+            for key, (count, error) in summary.counters.items():
+                counter = counters.setdefault(key, [unmonitored, unmonitored])
+                counter[0] += count - floor
+                counter[1] += error - floor
+        merged.counters = dict(heapq.nlargest(capacity, counters.items(), key=lambda item: item[1][0]))
+        merged._heapify()
+        return merged
+
+    def top(self, n):
+        """
+            The n heaviest keys as (key, count, error), heaviest first
+        """
+        items = heapq.nlargest(n, self.counters.items(), key=lambda item: item[1][0])
+        return [(key, count, error) for key, (count, error) in items]
+
+
+class CountMinSketch:
+    """
+        Count-min sketch (Cormode and Muthukrishnan): `depth` rows of `width`
+        cells, with each key hashed to one cell per row. Adding weights and
+        taking the smallest of a key's cells bounds its total from above;
+        combining with np.maximum instead bounds its largest weight. Sketches
+        with the same shape and seed merge cell by cell.
+    """
+
+    def __init__(self, width=512, depth=4, seed=0, ufunc=np.add):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, PRIME, depth, dtype=np.int64)[:, None]
+        self.b = rng.integers(0, PRIME, depth, dtype=np.int64)[:, None]
+        self.rows = np.arange(depth)[:, None]
+        self.ufunc = ufunc
+        self.table = np.zeros((depth, width))
+
+    def _cells(self, keys):
+        keys = np.asarray(keys, dtype=np.int64) % PRIME
+        return (self.a * keys + self.b) % PRIME % self.table.shape[1]
+
+    def add(self, keys, weights):
+        cells = self._cells(keys)
+        self.ufunc.at(self.table, (np.broadcast_to(self.rows, cells.shape), cells),
+                      np.broadcast_to(np.asarray(weights, dtype=np.float64), cells.shape))
+
+    def estimate(self, keys, table=None):
+        table = self.table if table is None else table
+        return table[self.rows, self._cells(keys)].min(axis=0)
+
+    def merged_table(self, sketches):
+        return self.ufunc.reduce([sketch.table for sketch in sketches]) if sketches else np.zeros_like(self.table)
+
+
+class _Codes:
+    """
+        Small int codes for base and quote names, assigned as names are first
+        seen and never reused, so keys in older slices stay valid when the
+        dimension cache reloads
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.names = []
+        self._loaded_at = None
+        self._base = self._quote = np.empty(0, dtype=np.int64)
+
+    def code(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def lookup(self, pair_ids):
+        """
+            Base and quote codes of each pair id, -1 for pairs not in the
+            dimension cache
+        """
+        pairs = dimensions.cache.pairs()
+        if self._loaded_at != dimensions.cache.loaded_at:
+            size = int(pairs["id"].max()) + 1 if pairs.shape[0] > 0 else 0
+            self._base = np.full(size, -1, dtype=np.int64)
+            self._quote = np.full(size, -1, dtype=np.int64)
+            self._base[pairs["id"].values] = [self.code(name) for name in pairs["baseName"]]
+            self._quote[pairs["id"].values] = [self.code(name) for name in pairs["quoteName"]]
+            self._loaded_at = dimensions.cache.loaded_at
+        known = (pair_ids >= 0) & (pair_ids < len(self._base))
+        base = np.full(len(pair_ids), -1, dtype=np.int64)
+        quote = np.full(len(pair_ids), -1, dtype=np.int64)
+        base[known] = self._base[pair_ids[known]]
+        quote[known] = self._quote[pair_ids[known]]
+        return base, quote
+
+
+def _totals(keys, weights):
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return zip(keys.tolist(), np.bincount(inverse, weights=weights, minlength=len(keys)).tolist())
+
+
+class _Slice:
+    """
+        The summaries and sketches of one slice of trade time
+    """
+
+    def __init__(self, capacity, sketch_width, sketch_depth):
+        self.capacity = capacity
+        self.boards = {}
+        self.sketches = {
+            "pairs": CountMinSketch(sketch_width, sketch_depth),
+            "pairs_amount": CountMinSketch(sketch_width, sketch_depth),
+            "pairs_biggest": CountMinSketch(sketch_width, sketch_depth, ufunc=np.maximum),
+            "top": CountMinSketch(sketch_width, sketch_depth),
+        }
+
+    def board(self, name):
+        board = self.boards.get(name)
+        if board is None:
+            board = self.boards[name] = SpaceSaving(self.capacity)
+        return board
+
+    def add(self, base, quote, exchange, side, amount, amount_price):
+        market = base * CODE_LIMIT + quote
+        side = side.astype(np.int64)
+        ones = np.ones(len(market))
+        for key, weight in _totals(market, ones):
+            self.board("pairs").add(key, weight)
+        self.sketches["pairs"].add(market, ones)
+        self.sketches["pairs_amount"].add(market, amount)
+        self.sketches["pairs_biggest"].add(market, amount)
+
+        buys = side == trade_columns.SIDE_CODES["BUYSIDE"]
+        for key, weight in _totals(exchange[buys], ones[buys]):
+            self.board("exchange_buy").add(key, weight)
+        for key, weight in _totals(quote[buys], ones[buys]):
+            self.board("quote_buy").add(key, weight)
+
+        sided = side > 0
+        self.sketches["top"].add(side[sided] * CODE_LIMIT * CODE_LIMIT + market[sided], amount_price[sided])
+        for key, weight in _totals((side[sided] * CODE_LIMIT + quote[sided]) * CODE_LIMIT + base[sided],
+                                   amount_price[sided]):
+            side_quote, base_code = divmod(key, CODE_LIMIT)
+            self.board(("top", side_quote)).add(base_code, weight)
+
+
+class Leaderboards:
+    """
+        Top-N lists of the trade stream without scanning trades: a
+        Space-Saving summary per list, plus count-min sketches for the totals
+        shown next to the keys, for each `slice_seconds` of trade time over
+        the last `window_minutes`. A query merges the slices of its window,
+        takes the summary's candidates and reports the smaller of the two
+        upper bounds for each, so counts can be slightly high and windows are
+        answered at slice granularity.
+
+        Methods mirror the querydb functions they replace.
+    """
+
+    def __init__(self, window_minutes=30, slice_seconds=10, capacity=100, sketch_width=512, sketch_depth=4):
+        self.retention_ms = window_minutes * 60 * 1000
+        self.slice_ms = slice_seconds * 1000
+        self.slice_count = -(-self.retention_ms // self.slice_ms) + 1
+        self.capacity = capacity
+        self.sketch_width = sketch_width
+        self.sketch_depth = sketch_depth
+        self.slices = {}
+        self.newest = None
+        self.late = 0
+        self.codes = _Codes()
+        self._lock = threading.Lock()
+
+    def append(self, columns):
+        base, quote = self.codes.lookup(columns["pairId"])
+        known = (base >= 0) & (quote >= 0)
+        columns = {name: array[known] for name, array in columns.items()}
+        base, quote = base[known], quote[known]
+        if len(base) == 0:
+            return
+        keys = columns["tsMs"] // self.slice_ms
+        amount_price = columns["amount"] * columns["price"]
+        with self._lock:
+            self.newest = max(int(keys.max()), self.newest if self.newest is not None else -1)
+            oldest = self.newest - self.slice_count + 1
+            for key in np.unique(keys).tolist():
+                index = np.flatnonzero(keys == key)
+                if key < oldest:
+                    self.late += len(index)
+                    continue
+                part = self.slices.get(key)
+                if part is None:
+                    part = self.slices[key] = _Slice(self.capacity, self.sketch_width, self.sketch_depth)
+                part.add(base[index], quote[index], columns["exchangeId"][index], columns["side"][index],
+                         columns["amount"][index], amount_price[index])
+            for key in [key for key in self.slices if key < oldest]:
+                del self.slices[key]
+
+    def stats(self):
+        with self._lock:
+            return {"slices": len(self.slices), "late": self.late,
+                    "boards": sum(len(part.boards) for part in self.slices.values())}
+
+    def _window(self, interval):
+        first = (int(time.time() * 1000) - interval * 60 * 1000) // self.slice_ms
+        with self._lock:
+            return [part for key, part in self.slices.items() if key >= first]
+
+    # slices keep changing under append, so they are only read under the lock
+
+    def _board(self, window, name):
+        with self._lock:
+            return SpaceSaving.merge([part.boards[name] for part in window if name in part.boards], self.capacity)
+
+    def _estimate(self, window, name, keys):
+        sketch = CountMinSketch(self.sketch_width, self.sketch_depth,
+                                ufunc=np.maximum if name == "pairs_biggest" else np.add)
+        with self._lock:
+            table = sketch.merged_table([part.sketches[name] for part in window])
+        return sketch.estimate(keys, table)
+
+    def get_all_pairs(self, cursor, interval, n=10):
+        window = self._window(interval)
+        top = self._board(window, "pairs").top(n)
+        markets = np.array([key for key, _, _ in top], dtype=np.int64)
+        df = pd.DataFrame({
+            "base": [self.codes.names[code] for code in (markets // CODE_LIMIT).tolist()],
+            "quote": [self.codes.names[code] for code in (markets % CODE_LIMIT).tolist()],
+            "transactions": np.minimum([count for _, count, _ in top], self._estimate(window, "pairs", markets)),
+            "biggestTrade": self._estimate(window, "pairs_biggest", markets),
+            "amountTraded": self._estimate(window, "pairs_amount", markets),
+        })
+        df["transactions"] = df["transactions"].round().astype("int64")
+        df["averageTrade"] = df["amountTraded"] / df["transactions"]
+        df = df.sort_values("transactions", ascending=False, ignore_index=True)
+        return df[["base", "quote", "transactions", "biggestTrade", "averageTrade", "amountTraded"]]
+
+    def get_exchange_buy_side(self, cursor, interval, n=20):
+        top = self._board(self._window(interval), "exchange_buy").top(n)
+        return pd.DataFrame({
+            "exchangeName": dimensions.cache.exchange_names([key for key, _, _ in top]),
+            "transactions": [round(count) for _, count, _ in top],
+        })
+
+    def get_quote_buy_side(self, cursor, interval, n=20):
+        top = self._board(self._window(interval), "quote_buy").top(n)
+        return pd.DataFrame({
+            "quoteName": [self.codes.names[key] for key, _, _ in top],
+            "transactions": [round(count) for _, count, _ in top],
+        })
+
+    def get_top_pairs_buy_side(self, cursor, quote_name, interval, n=20):
+        return self._top_pairs(quote_name, interval, "BUYSIDE", n)
+
+    def get_top_pairs_sell_side(self, cursor, quote_name, interval, n=20):
+        return self._top_pairs(quote_name, interval, "SELLSIDE", n)
+
+    def _top_pairs(self, quote_name, interval, order_side, n):
+        window = self._window(interval)
+        quote = self.codes.codes.get(quote_name, -1)
+        side = trade_columns.SIDE_CODES[order_side]
+        top = self._board(window, ("top", side * CODE_LIMIT + quote)).top(n)
+        bases = np.array([key for key, _, _ in top], dtype=np.int64)
+        keys = side * CODE_LIMIT * CODE_LIMIT + bases * CODE_LIMIT + quote
+        df = pd.DataFrame({
+            "totalAmount": np.minimum([count for _, count, _ in top], self._estimate(window, "top", keys)),
+            "baseName": [self.codes.names[code] for code in bases.tolist()],
+            "quoteName": quote_name,
+        })
+        return df.sort_values("totalAmount", ascending=False, ignore_index=True)
+
+
+class LeaderboardQueries:
+    """
+        Serves the Overview's top-N panels from Leaderboards fed by
+        `consumer`, once it has consumed the whole window asked for, and
+        everything else, longer windows included, from `fallback`
+    """
+
+    def __init__(self, fallback, leaderboards, consumer):
+        self.fallback = fallback
+        self.local = leaderboards
+        self.consumer = consumer
+        self.window_minutes = leaderboards.retention_ms // (60 * 1000)
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+    def start(self):
+        self.consumer.start()
+        return self
+
+    def covers(self, minutes):
+        return minutes <= self.window_minutes and self.consumer.covers(minutes * 60 * 1000)
+
+    def fallback_for(self, name):
+        return self.fallback if hasattr(self.fallback, name) else querydb
+
+    def stats(self):
+        return {**self.local.stats(), **self.consumer.stats()}
+
+    get_all_pairs = embedded._local_or_fallback("get_all_pairs", owner="LeaderboardQueries")
+    get_exchange_buy_side = embedded._local_or_fallback("get_exchange_buy_side", owner="LeaderboardQueries")
+    get_quote_buy_side = embedded._local_or_fallback("get_quote_buy_side", owner="LeaderboardQueries")
+    get_top_pairs_buy_side = embedded._local_or_fallback("get_top_pairs_buy_side", owner="LeaderboardQueries")
+    get_top_pairs_sell_side = embedded._local_or_fallback("get_top_pairs_sell_side", owner="LeaderboardQueries")
+
+
+def from_env(fallback, consumer=None):
+    """
+        Leaderboards fed by `consumer` (e.g. the embedded mode's) or, without
+        one, by a consumer of their own
+    """
+    leaderboards = Leaderboards(
+        window_minutes=int(os.environ.get("LEADERBOARD_WINDOW_MINUTES", 30)),
+        slice_seconds=int(os.environ.get("LEADERBOARD_SLICE_SECONDS", 10)),
+    )
+    if consumer is None:
+        consumer = embedded.TradeConsumer(
+            0,
+            bootstrap_servers=os.environ.get("EMBEDDED_BOOTSTRAP_SERVERS", "localhost:9092"),
+            wire_format=os.environ.get("TRADES_WIRE_FORMAT", "json"),
+        )
+    consumer.add_sink(leaderboards, leaderboards.retention_ms)
+    return LeaderboardQueries(fallback, leaderboards, consumer)
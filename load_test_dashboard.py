@@ -0,0 +1,131 @@
+import argparse
+import json
+import statistics
+import threading
+import time
+import uuid
+
+import httpx
+
+OVERVIEW_OUTPUT = "pairs.children"
+
+
+def overview_request(url, client):
+    """
+        Finds the Overview callback in the dashboard's dependency list and
+        returns a function building its request body for one tick
+    """
+    dependencies = client.get(f"{url}/_dash-dependencies").json()
+    for dependency in dependencies:
+        if OVERVIEW_OUTPUT in dependency["output"]:
+            break
+    else:
+        raise SystemExit("The dashboard has no polling Overview callback, is it running with DASHBOARD_PUSH=1?")
+
+    outputs = [dict(zip(("id", "property"), output.strip(".").split(".")))
+               for output in dependency["output"].split("...")]
+
+    def body(n, interval, session_id):
+        values = {
+            "interval-component.n_intervals": n,
+            "data-recency.value": interval,
+            "interval-component.interval": 1000,
+            "session-id.data": session_id,
+            "refresh-paused.value": [],
+        }
+        return {
+            "output": dependency["output"],
+            "outputs": outputs,
+            "inputs": [dict(item, value=values[f"{item['id']}.{item['property']}"]) for item in dependency["inputs"]],
+            "state": [dict(item, value=values[f"{item['id']}.{item['property']}"]) for item in dependency["state"]],
+            "changedPropIds": ["interval-component.n_intervals"],
+        }
+
+    return body
+
+
+def poll_client(url, interval, refresh_seconds, deadline, results):
+    session_id = str(uuid.uuid4())
+    with httpx.Client(timeout=60.0) as client:
+        body = overview_request(url, client)
+        n = 0
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            response = client.post(f"{url}/_dash-update-component", json=body(n, interval, session_id))
+            elapsed = time.monotonic() - started
+            results.append({"latency": elapsed, "bytes": len(response.content), "status": response.status_code})
+            n += 1
+            time.sleep(max(0.0, refresh_seconds - elapsed))
+
+
+def push_client(url, interval, deadline, results):
+    with httpx.Client(timeout=httpx.Timeout(60.0, read=None)) as client:
+        with client.stream("GET", f"{url}/push/overview", params={"interval": interval}) as response:
+            for line in response.iter_lines():
+                if time.monotonic() >= deadline:
+                    break
+                if not line.startswith("data: "):
+                    continue
+                message = json.loads(line[len("data: "):])
+                # updatedAt is set when the broadcaster computed the panels
+                results.append({
+                    "latency": max(0.0, time.time() - message["updatedAt"] / 1000),
+                    "bytes": len(line),
+                    "status": response.status_code,
+                    "type": message["type"],
+                })
+
+
+def summarize(results, clients, duration):
+    latencies = sorted(result["latency"] for result in results)
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+    return {
+        "clients": clients,
+        "durationSeconds": duration,
+        "messages": len(results),
+        "errors": sum(1 for result in results if result["status"] != 200),
+        "bytesReceived": sum(result["bytes"] for result in results),
+        "bytesPerClientPerSecond": sum(result["bytes"] for result in results) / clients / duration,
+        "requestsPerSecond": len(results) / duration,
+        "latencyMsP50": statistics.median(latencies) * 1000 if latencies else None,
+        "latencyMsP99": percentile(0.99) * 1000 if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent browsers on the dashboard's Overview tab")
+    parser.add_argument("--url", default="http://localhost:8050")
+    parser.add_argument("--mode", choices=["poll", "push"], default="poll",
+                        help="poll: hit the Overview callback every tick; push: subscribe to /push/overview "
+                             "(the dashboard must be running with DASHBOARD_PUSH=1)")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--interval", type=int, default=1, help="Data recency in minutes")
+    parser.add_argument("--refresh", type=float, default=1.0, help="Seconds between polls")
+    args = parser.parse_args()
+
+    results = []
+    deadline = time.monotonic() + args.duration
+    if args.mode == "poll":
+        target, extra = poll_client, (args.refresh,)
+    else:
+        target, extra = push_client, ()
+    threads = [threading.Thread(target=target, args=(args.url, args.interval, *extra, deadline, results), daemon=True)
+               for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(args.duration + 60)
+
+    report = summarize(results, args.clients, args.duration)
+    report["mode"] = args.mode
+    stats_path = "/push-stats" if args.mode == "push" else "/cache-stats"
+    try:
+        report["server"] = httpx.get(f"{args.url}{stats_path}").json()
+    except httpx.HTTPError:
+        pass
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
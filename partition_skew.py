@@ -0,0 +1,50 @@
+import argparse
+import collections
+import json
+import statistics
+import sys
+
+import partitioning
+
+
+def read_records(paths):
+    for path in paths:
+        with (sys.stdin if path == "-" else open(path)) as records:
+            for line in records:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def partition_counts(records, key_for, num_partitions):
+    counts = collections.Counter()
+    for record in records:
+        counts[partitioning.partition_for(key_for(record), num_partitions)] += 1
+    return [counts[partition] for partition in range(num_partitions)]
+
+
+def skew_report(counts):
+    mean = statistics.mean(counts)
+    return {
+        "messages": sum(counts),
+        "maxOverMean": round(max(counts) / mean, 3) if mean else 0.0,
+        "stdDevOverMean": round(statistics.pstdev(counts) / mean, 3) if mean else 0.0,
+        "emptyPartitions": sum(1 for count in counts if count == 0),
+        "counts": counts,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Report Kafka partition skew for each keying strategy over a sample of trades (JSON lines)")
+    parser.add_argument("files", nargs="*", default=["-"],
+                        help="JSON lines of trades, e.g. from kafka-console-consumer; - for stdin")
+    parser.add_argument("--partitions", type=int, default=10)
+    parser.add_argument("--fanout", type=int, default=4)
+    parser.add_argument("--strategy", choices=partitioning.KEY_STRATEGIES, action="append")
+    args = parser.parse_args()
+
+    records = list(read_records(args.files))
+    for name in args.strategy or partitioning.KEY_STRATEGIES:
+        report = skew_report(partition_counts(records, partitioning.key_strategy(name, args.fanout), args.partitions))
+        print(f"{name:<18} max/mean={report['maxOverMean']:<7} stddev/mean={report['stdDevOverMean']:<7} "
+              f"empty={report['emptyPartitions']:<3} counts={report['counts']}")
@@ -0,0 +1,126 @@
+import itertools
+import json
+import os
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config")
+TABLE_CONFIGS = {"json": "trades_table.json", "avro": "trades_table_avro.json"}
+
+KEY_STRATEGIES = ("pair", "market", "exchange", "composite", "pair-round-robin")
+
+
+def murmur2(data):
+    """
+        Kafka's murmur2, as used by the Java client's default partitioner and
+        by Pinot's Murmur partition function
+    """
+    length = len(data)
+    seed = 0x9747b28c
+    m = 0x5bd1e995
+    r = 24
+    mask = 0xFFFFFFFF
+
+    h = (seed ^ length) & mask
+    length4 = length // 4
+    for i in range(length4):
+        i4 = i * 4
+        k = (data[i4] & 0xff) + ((data[i4 + 1] & 0xff) << 8) + \
+            ((data[i4 + 2] & 0xff) << 16) + ((data[i4 + 3] & 0xff) << 24)
+        k = (k * m) & mask
+        k ^= k >> r
+        k = (k * m) & mask
+        h = (h * m) & mask
+        h ^= k
+
+    extra = length % 4
+    if extra >= 3:
+        h ^= (data[(length & ~3) + 2] & 0xff) << 16
+    if extra >= 2:
+        h ^= (data[(length & ~3) + 1] & 0xff) << 8
+    if extra >= 1:
+        h ^= data[length & ~3] & 0xff
+        h = (h * m) & mask
+
+    h ^= h >> 13
+    h = (h * m) & mask
+    h ^= h >> 15
+    return h
+
+
+def partition_for(key, num_partitions):
+    return (murmur2(key.encode('utf-8')) & 0x7fffffff) % num_partitions
+
+
+def pair_key(record):
+    return str(record.get("currencyPairId", ""))
+
+
+def market_key(record):
+    return str(record.get("marketId", ""))
+
+
+def exchange_key(record):
+    return str(record.get("exchangeId", ""))
+
+
+def composite_key(record):
+    return f"{record.get('currencyPairId', '')}:{record.get('exchangeId', '')}:{record.get('marketId', '')}"
+
+
+class PairRoundRobinKey:
+    """
+        Spreads each pair over `fanout` keys (<pair>:0 .. <pair>:fanout-1) so a
+        hot pair lands on several partitions instead of one
+    """
+
+    def __init__(self, fanout):
+        self.fanout = fanout
+        self._counters = {}
+
+    def __call__(self, record):
+        pair = record.get("currencyPairId", "")
+        counter = self._counters.get(pair)
+        if counter is None:
+            counter = self._counters[pair] = itertools.cycle(range(self.fanout))
+        return f"{pair}:{next(counter)}"
+
+
+def key_strategy(name, fanout=4):
+    """
+        Only the pair strategy lines Kafka partitions up with Pinot's
+        currencyPairId partition config, so only it allows segment pruning
+    """
+    if name == "pair":
+        return pair_key
+    if name == "market":
+        return market_key
+    if name == "exchange":
+        return exchange_key
+    if name == "composite":
+        return composite_key
+    if name == "pair-round-robin":
+        return PairRoundRobinKey(fanout)
+    raise ValueError(f"key strategy must be one of {KEY_STRATEGIES}, got {name!r}")
+
+
+def partition_columns(table_config_path):
+    with open(table_config_path) as table_config_file:
+        table_config = json.load(table_config_file)
+    partition_config = table_config.get("tableIndexConfig", {}).get("segmentPartitionConfig") or {}
+    return set(partition_config.get("columnPartitionMap", {}))
+
+
+def check_key_strategy(name, wire_format="json", table_config_path=None):
+    """
+        Refuses a key strategy that would break the realtime table's
+        segmentPartitionConfig: Pinot would prune segments holding the pair
+        and queries would silently miss trades
+    """
+    if name == "pair" or (table_config_path is None and wire_format not in TABLE_CONFIGS):
+        return
+    path = table_config_path or os.path.join(CONFIG_DIR, TABLE_CONFIGS[wire_format])
+    columns = partition_columns(path)
+    if columns:
+        raise ValueError(
+            f"key strategy {name!r} scatters each pair over partitions, but {path} partitions segments "
+            f"on {', '.join(sorted(columns))}; remove its segmentPartitionConfig and segmentPrunerTypes "
+            f"(and recreate the table) first, or use the pair strategy")
@@ -0,0 +1,212 @@
+import collections
+import datetime
+import functools
+import os
+import queue
+import struct
+import threading
+import time
+
+ON_FULL_POLICIES = ("block", "drop-oldest", "spill")
+
+_spill_header = struct.Struct("<II")
+
+
+def producer_config(bootstrap_servers, linger_ms=50, batch_num_messages=10000,
+                    compression_type="lz4", queue_buffering_max_messages=200000):
+    """
+        librdkafka settings for the trades producer. Larger linger/batch values
+        trade a little latency for far fewer, bigger requests to the broker.
+        murmur2_random matches the Java client's partitioner, and therefore
+        Pinot's Murmur partition function.
+    """
+    return {
+        'bootstrap.servers': bootstrap_servers,
+        'partitioner': 'murmur2_random',
+        'linger.ms': linger_ms,
+        'batch.num.messages': batch_num_messages,
+        'compression.type': compression_type,
+        'queue.buffering.max.messages': queue_buffering_max_messages,
+    }
+
+
+def producer_config_from_env(bootstrap_servers):
+    return producer_config(
+        bootstrap_servers,
+        linger_ms=int(os.environ.get("KAFKA_LINGER_MS", 50)),
+        batch_num_messages=int(os.environ.get("KAFKA_BATCH_NUM_MESSAGES", 10000)),
+        compression_type=os.environ.get("KAFKA_COMPRESSION_TYPE", "lz4"),
+        queue_buffering_max_messages=int(os.environ.get("KAFKA_QUEUE_MAX_MESSAGES", 200000)),
+    )
+
+
+class ProducerPipeline:
+    """
+        Decouples the websocket callback from Kafka: submit() only puts the
+        message on a bounded queue, and a background thread hands messages to
+        the producer and calls poll() on a schedule so delivery callbacks run
+        without ever blocking on flush().
+
+        on_full decides what submit() does when the queue is full:
+          block       - wait for the delivery thread to make room
+          drop-oldest - discard the oldest queued message
+          spill       - append to spill_path, replayed once the queue drains;
+                        until then new messages are spilled behind them, so
+                        messages with the same key stay in order
+
+        stamp(value, produced_ms), if given, is applied to each message just
+        before it is handed to the producer.
+    """
+
+    def __init__(self, producer, topic, max_queue_size=100000, on_full="block",
+                 spill_path="trades.spill", poll_interval=0.05, stats_interval=10.0,
+                 latency_samples=10000, stamp=None):
+        if on_full not in ON_FULL_POLICIES:
+            raise ValueError(f"on_full must be one of {ON_FULL_POLICIES}, got {on_full!r}")
+
+        self.producer = producer
+        self.topic = topic
+        self.on_full = on_full
+        self.spill_path = spill_path
+        self.poll_interval = poll_interval
+        self.stats_interval = stats_interval
+        self.stamp = stamp
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._latencies = collections.deque(maxlen=latency_samples)
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._spilled_pending = 0
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="producer-pipeline", daemon=True)
+
+        self.submitted = 0
+        self.produced = 0
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self.spilled = 0
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, key, value):
+        item = (key, value, time.monotonic())
+        self.submitted += 1
+        if self.on_full == "block":
+            self._queue.put(item)
+            return
+
+        if self._spilled_pending:
+            self._spill(key, value)
+            return
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if self.on_full == "drop-oldest":
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+                self._queue.put_nowait(item)
+            else:
+                self._spill(key, value)
+
+    def close(self, timeout=30.0):
+        self._stopping.set()
+        self._thread.join(timeout)
+        self.producer.flush(timeout)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+        return {
+            "queueDepth": self._queue.qsize(),
+            "producerQueueDepth": len(self.producer),
+            "submitted": self.submitted,
+            "produced": self.produced,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "latencyMsP50": _percentile(latencies, 0.50),
+            "latencyMsP99": _percentile(latencies, 0.99),
+        }
+
+    def _run(self):
+        last_poll = last_stats = time.monotonic()
+        while not (self._stopping.is_set() and self._queue.empty() and not self._spilled_pending):
+            try:
+                key, value, enqueued = self._queue.get(timeout=self.poll_interval)
+                self._produce(key, value, enqueued)
+            except queue.Empty:
+                if self._spilled_pending:
+                    self._replay_spill()
+
+            now = time.monotonic()
+            if now - last_poll >= self.poll_interval:
+                self.producer.poll(0)
+                last_poll = now
+            if self.stats_interval and now - last_stats >= self.stats_interval:
+                print(f"{str(datetime.datetime.now())} Producer stats: {self.stats()}")
+                last_stats = now
+
+    def _produce(self, key, value, enqueued):
+        if self.stamp is not None:
+            value = self.stamp(value, time.time_ns() // 1000000)
+        while True:
+            try:
+                self.producer.produce(
+                    topic=self.topic, key=key, value=value,
+                    callback=functools.partial(self._acked, enqueued)
+                )
+                self.produced += 1
+                return
+            except BufferError:
+                # librdkafka's own queue is full, let it drain some deliveries
+                self.producer.poll(self.poll_interval)
+
+    def _acked(self, enqueued, err, msg):
+        if err is not None:
+            self.failed += 1
+            print("Failed to deliver message: {0}: {1}"
+                  .format(msg.value(), err.str()))
+            return
+        self.delivered += 1
+        with self._lock:
+            self._latencies.append((time.monotonic() - enqueued) * 1000)
+
+    def _spill(self, key, value):
+        key_bytes = (key or "").encode('utf-8')
+        with self._spill_lock, open(self.spill_path, "ab") as spill_file:
+            spill_file.write(_spill_header.pack(len(key_bytes), len(value)))
+            spill_file.write(key_bytes)
+            spill_file.write(value)
+            self._spilled_pending += 1
+        self.spilled += 1
+
+    def _replay_spill(self):
+        with self._spill_lock:
+            with open(self.spill_path, "rb") as spill_file:
+                data = spill_file.read()
+            os.remove(self.spill_path)
+            self._spilled_pending = 0
+
+        offset = 0
+        now = time.monotonic()
+        while offset < len(data):
+            key_length, value_length = _spill_header.unpack_from(data, offset)
+            offset += _spill_header.size
+            key = data[offset:offset + key_length].decode('utf-8')
+            offset += key_length
+            value = data[offset:offset + value_length]
+            offset += value_length
+            self._produce(key, value, now)
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return round(sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))], 3)
@@ -0,0 +1,200 @@
+import json
+import math
+import queue
+import threading
+import time
+
+import pandas as pd
+
+import query_metrics
+
+# table name -> columns making up a row's key
+TABLE_KEYS = {
+    "pairs": ["base", "quote"],
+    "assets": ["baseName"],
+}
+
+
+def _json_value(value):
+    # JSON has no NaN or infinity, and NaN != NaN would re-send the row every tick
+    return None if isinstance(value, float) and not math.isfinite(value) else value
+
+
+def _table_state(df, key_columns):
+    rows = {}
+    order = []
+    for row in df.to_dict('records'):
+        key = "/".join(str(row[column]) for column in key_columns)
+        rows[key] = {column: _json_value(value) for column, value in row.items()}
+        order.append(key)
+    return {"rows": rows, "order": order}
+
+
+def _totals(df):
+    if df.shape[0] == 0 or pd.isna(df["count"][0]):
+        return {"count": 0, "amountTraded": 0.0}
+    amount_traded = df["amountTraded"][0]
+    return {"count": int(df["count"][0]), "amountTraded": 0.0 if pd.isna(amount_traded) else float(amount_traded)}
+
+
+def _encode(message):
+    return json.dumps(message, default=str, allow_nan=False)
+
+
+def diff(previous, current):
+    """
+        Delta that turns panel state `previous` into `current`: changed or new
+        rows per table, removed keys, the row order when it changed, and totals
+        when they changed. Returns None when nothing changed.
+    """
+    delta = {"tables": {}}
+    for table, state in current["tables"].items():
+        before = previous["tables"][table]
+        upsert = {key: row for key, row in state["rows"].items() if before["rows"].get(key) != row}
+        remove = [key for key in before["rows"] if key not in state["rows"]]
+        table_delta = {}
+        if upsert:
+            table_delta["upsert"] = upsert
+        if remove:
+            table_delta["remove"] = remove
+        if state["order"] != before["order"]:
+            table_delta["order"] = state["order"]
+        if table_delta:
+            delta["tables"][table] = table_delta
+    if current["totals"] != previous["totals"]:
+        delta["totals"] = current["totals"]
+
+    if not delta["tables"] and "totals" not in delta:
+        return None
+    delta["type"] = "delta"
+    delta["updatedAt"] = current["updatedAt"]
+    return delta
+
+
+class OverviewBroadcaster:
+    """
+        Computes the Overview panels once per tick for each recency interval
+        somebody is watching, and pushes only what changed to every subscribed
+        client. Query load therefore depends on the number of distinct
+        intervals being watched, not the number of browsers.
+    """
+
+    def __init__(self, query_executor, aggregates, tick_seconds=1.0, max_backlog=100):
+        self.query_executor = query_executor
+        self.aggregates = aggregates
+        self.tick_seconds = tick_seconds
+        self.max_backlog = max_backlog
+
+        self._subscribers = {}
+        self._state = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="overview-broadcaster", daemon=True)
+
+        self.ticks = 0
+        self.messages_sent = 0
+        self.bytes_sent = 0
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def subscribe(self, interval):
+        subscriber = queue.Queue(maxsize=self.max_backlog)
+        with self._lock:
+            self._subscribers.setdefault(interval, set()).add(subscriber)
+            state = self._state.get(interval)
+        if state is not None:
+            self._send(subscriber, dict(state, type="snapshot"))
+        return subscriber
+
+    def unsubscribe(self, interval, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(interval, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(interval, None)
+                self._state.pop(interval, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": {interval: len(subs) for interval, subs in self._subscribers.items()},
+                "ticks": self.ticks,
+                "messagesSent": self.messages_sent,
+                "bytesSent": self.bytes_sent,
+            }
+
+    def compute(self, interval):
+        instrument = query_metrics.metrics.instrument
+        with query_metrics.tagged(callback="push", interval=interval):
+            results = self.query_executor.run({
+                "pairs": lambda cursor: instrument(self.aggregates.get_all_pairs)(cursor, interval),
+                "assets": lambda cursor: instrument(self.aggregates.get_all_assets)(cursor, interval),
+                "now": lambda cursor: instrument(self.aggregates.get_aggregate_trades_current_period)(cursor, interval),
+                "prev": lambda cursor: instrument(self.aggregates.get_aggregate_trades_previous_period)(cursor, interval),
+            })
+        return {
+            "tables": {table: _table_state(results[table], keys) for table, keys in TABLE_KEYS.items()},
+            "totals": {"now": _totals(results["now"]), "prev": _totals(results["prev"])},
+            "updatedAt": int(time.time() * 1000),
+        }
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            with self._lock:
+                intervals = list(self._subscribers)
+            for interval in intervals:
+                try:
+                    self._tick(interval)
+                except Exception as e:
+                    print(f"Failed to refresh overview for interval {interval}: {e}")
+            self.ticks += 1
+            time.sleep(max(0.0, self.tick_seconds - (time.monotonic() - started)))
+
+    def _tick(self, interval):
+        current = self.compute(interval)
+        with self._lock:
+            previous = self._state.get(interval)
+            self._state[interval] = current
+            subscribers = list(self._subscribers.get(interval, ()))
+
+        message = dict(current, type="snapshot") if previous is None else diff(previous, current)
+        if message is None:
+            return
+        for subscriber in subscribers:
+            self._send(subscriber, message)
+
+    def _send(self, subscriber, message):
+        data = _encode(message)
+        try:
+            subscriber.put_nowait(data)
+        except queue.Full:
+            # the client has fallen behind: drop its backlog and resync it
+            while not subscriber.empty():
+                subscriber.get_nowait()
+            with self._lock:
+                state = None
+                for interval, subs in self._subscribers.items():
+                    if subscriber in subs:
+                        state = self._state.get(interval)
+            if state is None:
+                return
+            data = _encode(dict(state, type="snapshot"))
+            subscriber.put_nowait(data)
+        self.messages_sent += 1
+        self.bytes_sent += len(data)
+
+    def event_stream(self, interval, keepalive_seconds=15.0):
+        """
+            Generator of server-sent events for one client
+        """
+        subscriber = self.subscribe(interval)
+        try:
+            while True:
+                try:
+                    yield f"data: {subscriber.get(timeout=keepalive_seconds)}\n\n"
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(interval, subscriber)
@@ -0,0 +1,113 @@
+import collections
+import threading
+import time
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def _normalize(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _normalize(item)) for key, item in value.items()))
+    if hasattr(value, "item"):  # numpy scalars
+        return value.item()
+    return value
+
+
+class QueryCache:
+    """
+        Shares querydb results between Dash callbacks and browsers.
+
+        Entries are keyed on (function, normalized args, time bucket), where the
+        bucket is ttl seconds wide, so everyone refreshing within the same
+        bucket gets the same result. Concurrent misses for the same key are
+        coalesced: one caller runs the query and the rest wait for it.
+        Results are shared, so callers must not mutate them.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def call(self, fn, cursor, *args, ttl=1.0):
+        """
+            Returns fn(cursor, *args), from cache when a result for the current
+            ttl-second bucket exists. The cursor is not part of the key.
+        """
+        now = time.time()
+        bucket = int(now // ttl) if ttl > 0 else now
+        key = (fn.__module__, fn.__qualname__, _normalize(args), ttl, bucket)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                self.misses += 1
+                in_flight = self._in_flight[key] = _InFlight()
+                leader = True
+
+        if not leader:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.value
+
+        try:
+            in_flight.value = fn(cursor, *args)
+        except Exception as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if in_flight.error is None and ttl > 0:
+                    self._put(key, (bucket + 1) * ttl, in_flight.value)
+            in_flight.done.set()
+        return in_flight.value
+
+    def _put(self, key, expires_at, value):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        now = time.time()
+        for stale in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+            del self._entries[stale]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hitRatio": round((self.hits + self.coalesced) / lookups, 3) if lookups else None,
+            }
@@ -0,0 +1,115 @@
+import concurrent.futures
+import contextlib
+import contextvars
+import itertools
+import queue
+import threading
+
+from pinotdb import connect
+
+
+class StaleRefresh(Exception):
+    """
+        Raised when a newer refresh for the same client superseded this one
+    """
+
+
+class ConnectionPool:
+    """
+        Bounded, thread-safe pool of broker cursors. Each cursor belongs to its
+        own pinotdb connection, and so its own keep-alive HTTP client, and is
+        only ever used by one thread at a time.
+    """
+
+    def __init__(self, size=8, timeout=10.0, checkout_timeout=30.0,
+                 host="localhost", port="8099", path="/query/sql", scheme="http"):
+        self.checkout_timeout = checkout_timeout
+        self._cursors = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            connection = connect(host=host, port=port, path=path, scheme=scheme, timeout=timeout)
+            self._cursors.put(connection.cursor())
+
+    @contextlib.contextmanager
+    def cursor(self):
+        try:
+            cursor = self._cursors.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            raise TimeoutError("Timed out waiting for a free broker connection")
+        try:
+            yield cursor
+        finally:
+            self._cursors.put(cursor)
+
+
+class QueryExecutor:
+    """
+        Runs a refresh's queries concurrently on one long-lived thread pool,
+        each with a pooled cursor.
+
+        Refreshes are tracked per client key (e.g. browser session + callback):
+        when a newer refresh for the same key starts, queries of the older one
+        that haven't started yet are skipped and the older run() raises
+        StaleRefresh instead of returning results nobody will render. A key is
+        only tracked while a refresh for it is running.
+    """
+
+    def __init__(self, pool, max_workers=16, timeout=10.0):
+        self.pool = pool
+        self.timeout = timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix="query")
+        # client key -> generation of its newest running refresh; generations
+        # are never reused, so a finished key can be dropped
+        self._generations = {}
+        self._next = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def run(self, jobs, client_key=None):
+        """
+            jobs maps a name to a callable taking a cursor. Returns a dict of
+            name to result.
+        """
+        generation = self._next_generation(client_key)
+        try:
+            # each job runs in a copy of the caller's context (e.g. query_metrics tags)
+            futures = {
+                self._executor.submit(contextvars.copy_context().run, self._execute, job, client_key, generation): name
+                for name, job in jobs.items()
+            }
+            done, not_done = concurrent.futures.wait(futures, timeout=self.timeout)
+            for future in not_done:
+                future.cancel()
+
+            if self._is_stale(client_key, generation):
+                raise StaleRefresh(client_key)
+            if not_done:
+                raise TimeoutError(f"Queries {sorted(futures[f] for f in not_done)} took longer than {self.timeout}s")
+            return {futures[future]: future.result() for future in done}
+        finally:
+            self._finish(client_key, generation)
+
+    def _execute(self, job, client_key, generation):
+        if self._is_stale(client_key, generation):
+            raise StaleRefresh(client_key)
+        with self.pool.cursor() as cursor:
+            return job(cursor)
+
+    def _next_generation(self, client_key):
+        if client_key is None:
+            return None
+        with self._lock:
+            generation = self._generations[client_key] = next(self._next)
+            return generation
+
+    def _finish(self, client_key, generation):
+        if client_key is None:
+            return
+        with self._lock:
+            if self._generations.get(client_key) == generation:
+                del self._generations[client_key]
+
+    def _is_stale(self, client_key, generation):
+        return client_key is not None and self._generations.get(client_key) != generation
+
+    def forget(self, client_key):
+        with self._lock:
+            self._generations.pop(client_key, None)
@@ -0,0 +1,194 @@
+import collections
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+
+# callback/interval of the refresh a query runs for; QueryExecutor copies the
+# context into its worker threads
+_tags = contextvars.ContextVar("query_tags", default={})
+
+COUNTERS = ["queries", "errors", "statements", "wallMs", "brokerMs",
+            "numDocsScanned", "numEntriesScannedPostFilter", "rows", "bytes"]
+
+
+@contextlib.contextmanager
+def tagged(**tags):
+    token = _tags.set({**_tags.get(), **{key: value for key, value in tags.items() if value is not None}})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def _remember_response(holder, response):
+    holder.last_response = response
+
+
+class InstrumentedCursor:
+    """
+        Wraps a pinotdb cursor and adds up, over the statements a query
+        function executes, the broker's own timing and scan statistics and
+        the size of its responses
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.statements = 0
+        self.broker_ms = 0
+        self.docs_scanned = 0
+        self.entries_scanned_post_filter = 0
+        self.bytes = 0
+        session = getattr(cursor, "session", None)
+        if session is not None and not hasattr(cursor, "last_response"):
+            cursor.last_response = None
+            session.event_hooks["response"].append(functools.partial(_remember_response, cursor))
+
+    def execute(self, operation, parameters=None):
+        result = self.cursor.execute(operation, parameters)
+        self.statements += 1
+        raw = getattr(self.cursor, "raw_query_response", None) or {}
+        payload = raw.get("response") if isinstance(raw.get("response"), dict) else {}
+        self.broker_ms += payload.get("timeUsedMs", 0)
+        self.docs_scanned += payload.get("numDocsScanned", 0)
+        self.entries_scanned_post_filter += payload.get("numEntriesScannedPostFilter", 0)
+        response = getattr(self.cursor, "last_response", None)
+        if response is not None:
+            self.bytes += len(response.content)
+        return result
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def raw_query_response(self):
+        return getattr(self.cursor, "raw_query_response", None)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+class QueryMetrics:
+    """
+        Per query function, callback and recency interval: counters plus the
+        last `samples` wall times for percentiles
+    """
+
+    def __init__(self, samples=500):
+        self.samples = samples
+        self._series = {}
+        self._lock = threading.Lock()
+        self._instrumented = {}
+
+    def instrument(self, fn):
+        """
+            Wraps a querydb-style function (cursor first) so every call is
+            recorded. Wrappers keep fn's name, so QueryCache keys don't change.
+        """
+        key = (fn.__module__, fn.__qualname__, id(getattr(fn, "__self__", None)))
+        wrapper = self._instrumented.get(key)
+        if wrapper is None:
+            @functools.wraps(fn)
+            def wrapper(cursor, *args, **kwargs):
+                instrumented = InstrumentedCursor(cursor)
+                started = time.perf_counter()
+                error = False
+                try:
+                    result = fn(instrumented, *args, **kwargs)
+                except Exception:
+                    error = True
+                    raise
+                finally:
+                    wall_ms = (time.perf_counter() - started) * 1000
+                    rows = _rows(result) if not error else 0
+                    self.record(fn.__name__, instrumented, wall_ms, rows, error)
+                return result
+            self._instrumented[key] = wrapper
+        return wrapper
+
+    def record(self, function, cursor, wall_ms, rows, error=False):
+        tags = _tags.get()
+        key = (function, tags.get("callback", ""), str(tags.get("interval", "")))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    "counters": dict.fromkeys(COUNTERS, 0),
+                    "wallMs": collections.deque(maxlen=self.samples),
+                }
+            counters = series["counters"]
+            counters["queries"] += 1
+            counters["errors"] += int(error)
+            counters["statements"] += cursor.statements
+            counters["wallMs"] += wall_ms
+            counters["brokerMs"] += cursor.broker_ms
+            counters["numDocsScanned"] += cursor.docs_scanned
+            counters["numEntriesScannedPostFilter"] += cursor.entries_scanned_post_filter
+            counters["rows"] += rows
+            counters["bytes"] += cursor.bytes
+            series["wallMs"].append(wall_ms)
+
+    def snapshot(self):
+        """
+            One dict per series, slowest p99 first
+        """
+        with self._lock:
+            series = [(key, dict(value["counters"]), sorted(value["wallMs"])) for key, value in self._series.items()]
+        rows = []
+        for (function, callback, interval), counters, wall_ms in series:
+            rows.append({
+                "function": function, "callback": callback, "interval": interval,
+                **counters,
+                "wallMsP50": _percentile(wall_ms, 0.50),
+                "wallMsP99": _percentile(wall_ms, 0.99),
+            })
+        return sorted(rows, key=lambda row: row["wallMsP99"] or 0, reverse=True)
+
+    def prometheus(self):
+        lines = []
+        metrics = [
+            ("querydb_queries_total", "counter", "queries"),
+            ("querydb_query_errors_total", "counter", "errors"),
+            ("querydb_statements_total", "counter", "statements"),
+            ("querydb_wall_milliseconds_total", "counter", "wallMs"),
+            ("querydb_broker_milliseconds_total", "counter", "brokerMs"),
+            ("querydb_docs_scanned_total", "counter", "numDocsScanned"),
+            ("querydb_entries_scanned_post_filter_total", "counter", "numEntriesScannedPostFilter"),
+            ("querydb_result_rows_total", "counter", "rows"),
+            ("querydb_response_bytes_total", "counter", "bytes"),
+        ]
+        rows = self.snapshot()
+        for name, kind, field in metrics:
+            lines.append(f"# TYPE {name} {kind}")
+            lines += [f"{name}{{{_labels(row)}}} {row[field]}" for row in rows]
+        lines.append("# TYPE querydb_wall_milliseconds summary")
+        for row in rows:
+            for quantile, field in [("0.5", "wallMsP50"), ("0.99", "wallMsP99")]:
+                lines.append(f'querydb_wall_milliseconds{{{_labels(row)},quantile="{quantile}"}} {row[field]}')
+        return "\n".join(lines) + "\n"
+
+
+def _labels(row):
+    return f'function="{row["function"]}",callback="{row["callback"]}",interval="{row["interval"]}"'
+
+
+def _rows(result):
+    # querydb functions return a DataFrame, a list, or a tuple/namedtuple of them
+    if hasattr(result, "shape"):
+        return result.shape[0]
+    if isinstance(result, tuple):
+        return sum(_rows(item) for item in result)
+    if isinstance(result, list):
+        return len(result)
+    return 0
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+metrics = QueryMetrics()
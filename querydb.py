@@ -1,261 +1,663 @@
+import collections
+import math
+import os
+import threading
+import numpy as np
 import pandas as pd
+import time
+
+import dimensions
+import result_decoding
+
+USD = "United States Dollar"
+
+# Windows end at clock() seconds since the epoch; bench_querydb pins it
+clock = time.time
+
+# OHLCV rollup tables fed by rollup.py, coarsest first
+ROLLUPS = [("trades_ohlcv_1h", 60 * 60 * 1000), ("trades_ohlcv_1m", 60 * 1000), ("trades_ohlcv_1s", 1000)]
+# A rollup is only used when the window spans at least this many of its buckets
+ROLLUP_MIN_BUCKETS = 10
+# Bars are closed 5s after they end (rollup.py's grace) and take a moment to be ingested
+ROLLUP_LAG_MS = 10 * 1000
+# Aggregate over raw trades -> the same aggregate over rollup bars
+ROLLUP_AGGREGATES = {
+    "count(*)": "sum(tradeCount)",
+    "sum(amount)": "sum(volume)",
+    "max(amount)": "max(maxAmount)",
+    "min(price)": "min(low)",
+    "max(price)": "max(high)",
+    "sum(price)": "sum(sumPrice)",
+    "sum(amount*price)": "sum(quoteVolume)",
+    "min(tsMs)": "min(openMs)",
+    "max(tsMs)": "max(closeMs)",
+    "FIRSTWITHTIME(price, tsMs, 'DOUBLE')": "FIRSTWITHTIME(open, openMs, 'DOUBLE')",
+    "LASTWITHTIME(price, tsMs, 'DOUBLE')": "LASTWITHTIME(close, closeMs, 'DOUBLE')",
+}
+use_rollups = os.environ.get("QUERYDB_ROLLUPS", "1") == "1"
+# How often routed_query re-reads which rollup tables exist and where they start
+ROLLUP_CHECK_SECONDS = 60
+# rollup table -> earliest bucketMs it holds, None until first checked
+rollup_since = None
+_rollup_checked_at = 0.0
+_rollup_lock = threading.Lock()
+# The *_approx functions estimate a window from a few 1-second slices of each
+# of APPROXIMATE_STRATA equal parts of it, read through the tsMs range index
+APPROXIMATE_MIN_MINUTES = int(os.environ.get("QUERYDB_APPROXIMATE_MIN_MINUTES", 30))
+APPROXIMATE_STRATA = 30
+APPROXIMATE_SLICES_PER_STRATUM = 4
+# ...and only where the exact routed query would read at least this many times
+# the raw trades the sample does; the sample's ORed ranges cost more per trade
+APPROXIMATE_MIN_SAVING = float(os.environ.get("QUERYDB_APPROXIMATE_MIN_SAVING", 2))
+# Draws the sampled slices; seed it with QUERYDB_APPROXIMATE_SEED for repeatable estimates
+approximate_rng = np.random.default_rng(
+    int(os.environ["QUERYDB_APPROXIMATE_SEED"]) if os.environ.get("QUERYDB_APPROXIMATE_SEED") else None)
+# half width of a 95% confidence interval, in standard errors
+Z_95 = 1.96
+
+def pair_ids(base_name=None, quote_name=None):
+    """
+        Resolves base/quote names to currency pair ids from the dimension
+        cache, so queries can filter with a plain currencyPairId IN (...) that
+        Pinot's partition pruner understands, rather than IN_SUBQUERY.
+    """
+    return dimensions.cache.pair_ids(base_name, quote_name)
+
+def pair_filter(ids):
+    # -1 never matches, keeping the query valid when nothing resolved
+    return f"currencyPairId IN ({', '.join(str(id) for id in ids) or '-1'})"
+
+def _sum_by_name(df, names, value_columns):
+    """
+        Re-aggregates a result grouped on raw ids by the names those ids map to
+    """
+    df = df.assign(**names)
+    return df.groupby(list(names), as_index=False)[value_columns].sum()
+
+LATEST_TRADES_LIMIT = 100
+
+def get_trades_since(cursor, since=None, base_name=None, limit=LATEST_TRADES_LIMIT):
+    """
+        Tail-follows the trades table. `since` is the cursor returned by the
+        previous call ({"tsMs": ..., "ids": [...]}, or None for the newest
+        `limit` trades) and only trades newer than it are fetched. Trades that
+        share the cursor's timestamp are told apart by externalId, so rows
+        arriving in the same millisecond are neither lost nor repeated.
+        Returns the new trades, newest first, and the cursor for the next call.
+    """
+    filters = []
+    seen = set()
+    if since is not None:
+        filters.append(f"tsMs >= '{since['tsMs']}'")
+        seen = set(since["ids"])
+    if base_name is not None:
+        filters.append(pair_filter(pair_ids(base_name)))
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
 
-def get_latest_trades(cursor, base_name):
     cursor.execute(f"""
-    select tsMs, currencyPairId, amount, price,  marketId, orderSide,
-           lookUp('pairs', 'baseName', 'id', currencyPairId) AS baseName,
-           lookUp('pairs', 'quoteName', 'id', currencyPairId) AS quoteName,
-           lookUp('markets', 'exchange', 'id', marketId) AS market,
-           lookUp('exchanges', 'name', 'id', exchangeId) AS exchange
+    select tsMs, externalId, currencyPairId, amount, price,  marketId, exchangeId, orderSide
     from trades 
-    WHERE IN_SUBQUERY(
-        currencyPairId, 
-        'SELECT ID_SET(id) FROM pairs WHERE baseName = ''{base_name}'''
-        ) = 1
+    {where}
     order by tsMs DESC
-    """, {"baseName": base_name})
+    LIMIT {limit + len(seen)}
+    """)
 
-    df = pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])    
+    df = result_decoding.frame(cursor)
+    if since is not None:
+        df = df[~((df["tsMs"].astype(str) == str(since["tsMs"])) & df["externalId"].isin(seen))]
+    df = dimensions.cache.decorate(df.head(limit).reset_index(drop=True))
+
+    if df.shape[0] == 0:
+        return df, since
+    newest = str(df["tsMs"][0])
+    ids = df.loc[df["tsMs"].astype(str) == newest, "externalId"].tolist()
+    if since is not None and str(since["tsMs"]) == newest:
+        ids = sorted(seen.union(ids))
+    return df, {"tsMs": newest, "ids": ids}
+
+def pin_rollup_coverage(since):
+    """
+        Fixes what rollup_coverage returns, for callers without a broker
+        (index_advisor's recording cursor)
+    """
+    global rollup_since, _rollup_checked_at
+    rollup_since, _rollup_checked_at = since, math.inf
+
+def rollup_coverage(cursor):
+    """
+        Earliest bucketMs of every rollup table that exists and has bars,
+        re-read at most every ROLLUP_CHECK_SECONDS. Missing or empty tables
+        are left out, so nothing is routed to them.
+    """
+    global rollup_since, _rollup_checked_at
+    if not use_rollups:
+        return {}
+    with _rollup_lock:
+        if time.time() - _rollup_checked_at < ROLLUP_CHECK_SECONDS:
+            return rollup_since or {}
+        # other threads keep the previous answer while this one checks
+        _rollup_checked_at = time.time()
+    since = {}
+    for table, _ in ROLLUPS:
+        try:
+            cursor.execute(f"select min(bucketMs) from {table}")
+            earliest = result_decoding.frame(cursor).iloc[0, 0]
+        except Exception:
+            continue
+        if math.isfinite(earliest) and earliest > 0:
+            since[table] = int(earliest)
+    rollup_since = since
+    return since
+
+def route(start_ms, end_ms, now_ms, granularity_ms=None, coverage=None):
+    """
+        Splits [start_ms, end_ms) between the tables that can answer it. The
+        coarsest rollup that fits the window ROLLUP_MIN_BUCKETS times (and
+        whose buckets divide granularity_ms, when results are bucketed) serves
+        the whole, already closed buckets from where its bars start, and the
+        rest is routed the same way, ending in raw trades. coverage maps each
+        rollup table to its earliest bucketMs (see rollup_coverage); tables
+        missing from it are not used. Returns a list of (table, start_ms, end_ms).
+    """
+    coverage = (rollup_since or {}) if coverage is None else coverage
+    closed_ms = min(end_ms, now_ms - ROLLUP_LAG_MS)
+    for table, resolution in ROLLUPS:
+        if table not in coverage:
+            continue
+        if end_ms - start_ms < resolution * ROLLUP_MIN_BUCKETS:
+            continue
+        if granularity_ms is not None and granularity_ms % resolution != 0:
+            continue
+        first = -(-max(start_ms, coverage[table]) // resolution) * resolution
+        last = closed_ms - closed_ms % resolution
+        if last <= first:
+            continue
+        parts = [(table, first, last)]
+        if start_ms < first:
+            parts += route(start_ms, first, now_ms, granularity_ms, coverage)
+        if last < end_ms:
+            parts += route(last, end_ms, now_ms, granularity_ms, coverage)
+        return parts
+    return [("trades", start_ms, end_ms)]
+
+def _window(interval, periods_ago=0):
+    now_ms = int(clock() * 1000)
+    end_ms = now_ms - periods_ago * interval * 60 * 1000
+    return end_ms - interval * 60 * 1000, end_ms, now_ms
+
+def routed_query(cursor, aggregates, window, group_by=(), where=(), params=None, granularity_ms=None, limit=1000000):
+    """
+        Runs one group-by per table that route() picks for window (a
+        (start_ms, end_ms, now_ms) tuple) and returns the partial results of
+        every table in one frame; callers re-aggregate them by group.
+        aggregates maps each output column to its aggregate over raw trades.
+        With granularity_ms the results are also grouped by a `bucket` column.
+    """
+    start_ms, end_ms, now_ms = window
+    ranges = collections.defaultdict(list)
+    for table, start, end in route(start_ms, end_ms, now_ms, granularity_ms, rollup_coverage(cursor)):
+        ranges[table].append((start, end))
+
+    frames = []
+    for table, table_ranges in ranges.items():
+        time_column = "tsMs" if table == "trades" else "bucketMs"
+        columns = list(group_by)
+        if granularity_ms is not None:
+            columns.append(f"DATETIMECONVERT({time_column}, '1:MILLISECONDS:EPOCH', '1:MILLISECONDS:EPOCH', "
+                           f"'{granularity_ms}:MILLISECONDS') AS bucket")
+        group_columns = [column.split(" AS ")[-1] for column in columns]
+        columns += [f"{expression if table == 'trades' else ROLLUP_AGGREGATES[expression]} AS {name}"
+                    for name, expression in aggregates.items()]
+        time_filter = " OR ".join(f"({time_column} >= {start} AND {time_column} < {end})" for start, end in table_ranges)
+        filters = list(where) + [f"({time_filter})"]
+
+        cursor.execute(f"""
+        select {', '.join(columns)}
+        from {table}
+        WHERE {' AND '.join(filters)}
+        {f"group by {', '.join(group_columns)}" if group_columns else ""}
+        limit {limit}
+        """, params)
+        frames.append(result_decoding.frame(cursor))
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+def get_latest_trades(cursor, base_name):
+    df, _ = get_trades_since(cursor, base_name=base_name)
     return df[["tsMs", "quoteName", "market", "exchange", "amount", "price", "orderSide"]]
 
-def latest_period_prices(cursor, base_name, interval):
-    cursor.execute(f"""
-    select avg(price) AS avgPrice, max(price) as maxPrice, min(price) AS minPrice, 
-           count(*) AS count, sum(amount) AS amountTraded
-    from trades 
-    WHERE IN_SUBQUERY(
-        currencyPairId, 
-        'SELECT ID_SET(id) FROM pairs WHERE baseName = ''{base_name}'' AND quoteName = ''United States Dollar'''
-        ) = 1
-    AND tsMs > ago(%(intervalString)s)
-    """, {"baseName": base_name, "intervalString": f"PT{interval}M"})
-    df = pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
-    return df
+AssetSnapshot = collections.namedtuple(
+    "AssetSnapshot", ["now", "prev", "pairs", "assets", "order_side"]
+)
 
-def previous_period_prices(cursor, base_name, interval):
+def _period_prices(df):
+    count = int(df["count"].sum())
+    return pd.DataFrame({
+        "avgPrice": [df["sumPrice"].sum() / count if count else None],
+        "maxPrice": [df["maxPrice"].max() if count else None],
+        "minPrice": [df["minPrice"].min() if count else None],
+        "count": [count],
+        "amountTraded": [df["amountTraded"].sum() if count else None],
+    })
 
-    cursor.execute(f"""
-    select avg(price) AS avgPrice, max(price) as maxPrice, min(price) AS minPrice, 
-           count(*) AS count, sum(amount) AS amountTraded
-    from trades 
-    WHERE IN_SUBQUERY(
-        currencyPairId, 
-        'SELECT ID_SET(id) FROM pairs WHERE baseName = ''{base_name}'' AND quoteName = ''United States Dollar'''
-        ) = 1
-    AND tsMs < ago(%(intervalString)s)
-    AND tsMs > ago(%(previousIntervalString)s)
-    """, {"baseName": base_name, "intervalString": f"PT{interval}M", "previousIntervalString": f"PT{interval*2}M"})
-    df = pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
-    
-    return df
+def _counts_by(df, column, name):
+    counts = df.groupby(column)["count"].sum().reset_index()
+    return counts.rename(columns={column: name}).sort_values("count", ascending=False).reset_index(drop=True)
 
-def all_prices(cursor, base_name, interval):
+def asset_snapshot(cursor, base_name, interval):
+    """
+        Everything the Assets tab shows for base_name, in one result. Replaces
+        the tab's separate period price queries, get_pairs, get_assets and
+        get_order_side: the pair ids are resolved once, and a single
+        group-by over the current and previous periods feeds all of the stats
+        and charts. The latest trades table tail-follows separately with
+        get_trades_since.
+    """
+    ids = pair_ids(base_name)
+    interval_ms = interval * 60 * 1000
+    now_ms = int(clock() * 1000)
+    start_ms = now_ms - 2 * interval_ms
+
+    # period is 0 for the previous interval and 1 for the current one
     cursor.execute(f"""
-    select tsMs, price
-    from trades 
-    WHERE IN_SUBQUERY(
-        currencyPairId, 
-        'SELECT ID_SET(id) FROM pairs WHERE baseName = ''{base_name}'' AND quoteName = ''United States Dollar'''
-        ) = 1
-    AND tsMs > cago(%(intervalString)s)
-    ORDER BY tsMs DESC
-    LIMIT 10000
-    """, {"baseName": base_name,"intervalString": f"PT{interval}M"})
-    return pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
+    select floor(div(minus(tsMs, {start_ms}), {interval_ms})) AS period,
+           currencyPairId, exchangeId, orderSide,
+           count(*) AS count, sum(price) AS sumPrice, min(price) AS minPrice, max(price) AS maxPrice,
+           sum(amount) AS amountTraded
+    from trades
+    WHERE {pair_filter(ids)}
+    AND tsMs > {start_ms} AND tsMs <= {now_ms}
+    group by period, currencyPairId, exchangeId, orderSide
+    limit 1000000
+    """)
+    return _asset_snapshot(result_decoding.frame(cursor))
+
+def _asset_snapshot(df):
+    """
+        AssetSnapshot from partial aggregates per period (0 previous, 1
+        current), pair, exchange and order side
+    """
+    df["asset"] = dimensions.cache.quote_names(df["currencyPairId"])
+    df["market"] = dimensions.cache.exchange_names(df["exchangeId"])
+
+    current = df[df["period"] >= 1]
+    usd = df[df["asset"] == USD]
+
+    return AssetSnapshot(
+        now=_period_prices(usd[usd["period"] >= 1]),
+        prev=_period_prices(usd[usd["period"] < 1]),
+        pairs=_counts_by(current, "market", "market"),
+        assets=_counts_by(current, "asset", "asset"),
+        order_side=_counts_by(current[current["orderSide"] != "null"], "orderSide", "orderSide"),
+    )
+
+def bucket_ms(span_ms, buckets):
+    """
+        The width of at most `buckets` buckets covering span_ms, rounded up to
+        whole buckets of the coarsest rollup it spans, so that the rollups
+        can answer it
+    """
+    size = -(-span_ms // buckets)
+    for _, resolution in ROLLUPS:
+        if size >= resolution:
+            return -(-size // resolution) * resolution
+    return ROLLUPS[-1][1]
+
+# Per-bucket price columns, over raw trades; the first and last times order
+# the partials of different tables when they are re-aggregated
+PRICE_BUCKET_AGGREGATES = {
+    "sumPrice": "sum(price)",
+    "count": "count(*)",
+    "minPrice": "min(price)",
+    "maxPrice": "max(price)",
+    "firstPrice": "FIRSTWITHTIME(price, tsMs, 'DOUBLE')",
+    "firstMs": "min(tsMs)",
+    "lastPrice": "LASTWITHTIME(price, tsMs, 'DOUBLE')",
+    "lastMs": "max(tsMs)",
+}
+
+def price_buckets(df):
+    """
+        Re-aggregates PRICE_BUCKET_AGGREGATES partials to one row per bucket,
+        newest first
+    """
+    if df.shape[0] == 0:
+        return pd.DataFrame(columns=["tsMs", "price", "firstPrice", "minPrice", "maxPrice", "lastPrice", "count"])
+    df = df.reset_index(drop=True)
+    groups = df.groupby("bucket")
+    count = groups["count"].sum()
+    df = pd.DataFrame({
+        "tsMs": count.index,
+        "price": (groups["sumPrice"].sum() / count).values,
+        "firstPrice": df["firstPrice"].values[groups["firstMs"].idxmin().values],
+        "minPrice": groups["minPrice"].min().values,
+        "maxPrice": groups["maxPrice"].max().values,
+        "lastPrice": df["lastPrice"].values[groups["lastMs"].idxmax().values],
+        "count": count.values,
+    })
+    return df.sort_values("tsMs", ascending=False, ignore_index=True)
+
+def all_prices(cursor, base_name, interval, points=500):
+    """
+        USD price of base_name over the last interval minutes in at most
+        about `points` time buckets (one per pixel of the chart, say): the average,
+        first, lowest, highest and last price of each. The payload stays the
+        same size whatever the window and trade rate, and the extremes
+        survive, which averaging or sampling raw trades would lose.
+    """
+    window = _window(interval)
+    df = routed_query(cursor, PRICE_BUCKET_AGGREGATES, window, where=[pair_filter(pair_ids(base_name, USD))],
+                      granularity_ms=bucket_ms(interval * 60 * 1000, points))
+    return price_buckets(df)
 
 def get_pairs(cursor, base_name, interval):
+    start_ms, end_ms, _ = _window(interval)
     cursor.execute(f"""
-    select lookUp('exchanges', 'name', 'id', exchangeId) AS market, count(*) AS count
+    select exchangeId, count(*) AS count
     from trades     
-    WHERE IN_SUBQUERY(
-        currencyPairId, 
-        'SELECT ID_SET(id) FROM pairs WHERE baseName = ''{base_name}'''
-        ) = 1
-    AND tsMs > ago(%(intervalString)s)
-    group by market
-	order by count DESC
-    """, {"baseName": base_name, "intervalString": f"PT{interval}M"})
-    df = pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
-    return df
+    WHERE {pair_filter(pair_ids(base_name))}
+    AND tsMs > {start_ms} AND tsMs <= {end_ms}
+    group by exchangeId
+    limit 100000
+    """)
+    df = result_decoding.frame(cursor)
+    df = _sum_by_name(df, {"market": dimensions.cache.exchange_names(df["exchangeId"])}, ["count"])
+    return df.sort_values("count", ascending=False, ignore_index=True)
 
 def get_assets(cursor, base_name, interval):
+    start_ms, end_ms, _ = _window(interval)
     cursor.execute(f"""
-    select lookUp('pairs', 'quoteName', 'id', currencyPairId) AS asset, count(*) AS count
+    select currencyPairId, count(*) AS count
     from trades 
-    WHERE IN_SUBQUERY(
-        currencyPairId, 
-        'SELECT ID_SET(id) FROM pairs WHERE baseName = ''{base_name}'''
-        ) = 1
-    AND tsMs > ago(%(intervalString)s)
-    group by asset
-	order by count DESC
-    """, {"baseName": base_name, "intervalString": f"PT{interval}M"})
-    df = pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
-    return df
+    WHERE {pair_filter(pair_ids(base_name))}
+    AND tsMs > {start_ms} AND tsMs <= {end_ms}
+    group by currencyPairId
+    limit 100000
+    """)
+    df = result_decoding.frame(cursor)
+    df = _sum_by_name(df, {"asset": dimensions.cache.quote_names(df["currencyPairId"])}, ["count"])
+    return df.sort_values("count", ascending=False, ignore_index=True)
 
 def get_order_side(cursor, base_name, interval):
+    start_ms, end_ms, _ = _window(interval)
     cursor.execute(f"""
     select orderSide, count(*) AS count
     from trades 
-    WHERE IN_SUBQUERY(
-        currencyPairId, 
-        'SELECT ID_SET(id) FROM pairs WHERE baseName = ''{base_name}'''
-        ) = 1
+    WHERE {pair_filter(pair_ids(base_name))}
     AND orderSide != 'null'
-    AND tsMs > ago(%(intervalString)s)
+    AND tsMs > {start_ms} AND tsMs <= {end_ms}
     group by orderSide
 	order by count DESC
-    """, {"baseName": base_name, "intervalString": f"PT{interval}M"})
-    df = pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
+    """)
+    df = result_decoding.frame(cursor)
     return df
 
 def get_all_latest_trades(cursor):
-    cursor.execute("""
-    select tsMs, currencyPairId, amount, price,  marketId, orderSide,
-           lookUp('pairs', 'baseName', 'id', currencyPairId) AS baseName,
-           lookUp('pairs', 'quoteName', 'id', currencyPairId) AS quoteName,
-           lookUp('markets', 'exchange', 'id', marketId) AS market,
-           lookUp('exchanges', 'name', 'id', exchangeId) AS exchange
-    from trades 
-    order by tsMs DESC
-    LIMIT 50
-    """)
-
-    df = pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])    
+    df, _ = get_trades_since(cursor, limit=50)
     return df[["tsMs", "baseName", "quoteName", "market", "exchange", "amount", "price", "orderSide"]]
 
 def get_all_pairs(cursor, interval):
-    cursor.execute("""
-    select lookUp('pairs', 'baseName', 'id', currencyPairId) AS base,
-       lookUp('pairs', 'quoteName', 'id', currencyPairId) AS quote, 
-	   count(*) AS transactions,	   
-       max(amount) as biggestTrade,
-       avg(amount) as averageTrade,
-       sum(amount) AS amountTraded
-    from trades 
-    where tsMs > ago(%(intervalString)s)
-    group by quote, base
-    order by transactions DESC
-    limit 10
-    """, {"intervalString": f"PT{interval}M"})
-
-    df = pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
-    for column in ["transactions", "amountTraded", "biggestTrade", "averageTrade"]:
-        df[column]=df[column].map('{:,.3f}'.format)
-    return df
+    df = routed_query(cursor, {
+        "transactions": "count(*)", "biggestTrade": "max(amount)", "amountTraded": "sum(amount)",
+    }, _window(interval), group_by=["currencyPairId"])
+
+    df = df.assign(
+        base=dimensions.cache.base_names(df["currencyPairId"]),
+        quote=dimensions.cache.quote_names(df["currencyPairId"]),
+    ).groupby(["base", "quote"], as_index=False).agg(
+        transactions=("transactions", "sum"), biggestTrade=("biggestTrade", "max"), amountTraded=("amountTraded", "sum"),
+    )
+    df["averageTrade"] = df["amountTraded"] / df["transactions"]
+    df = df.nlargest(10, "transactions")[["base", "quote", "transactions", "biggestTrade", "averageTrade", "amountTraded"]]
+    return df.reset_index(drop=True)
 
 def get_all_assets(cursor, interval):
-    cursor.execute("""
-    select lookUp('pairs', 'baseName', 'id', currencyPairId) AS baseName, 
-           min(price) AS minPrice, avg(price) AS avgPrice, max(price) as maxPrice,  
-           count(*) AS count, sum(amount) AS amountTraded		   
-    from trades 
-    WHERE lookUp('pairs', 'quoteName', 'id', currencyPairId) = 'United States Dollar'
-    AND tsMs > ago(%(intervalString)s)
-	group by baseName
-	order by count DESC
-    """, {"intervalString": f"PT{interval}M"})
+    df = routed_query(cursor, {
+        "minPrice": "min(price)", "sumPrice": "sum(price)", "maxPrice": "max(price)",
+        "count": "count(*)", "amountTraded": "sum(amount)",
+    }, _window(interval), group_by=["currencyPairId"], where=[pair_filter(pair_ids(quote_name=USD))])
 
-    df = pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
+    df = df.assign(baseName=dimensions.cache.base_names(df["currencyPairId"])).groupby("baseName", as_index=False).agg(
+        minPrice=("minPrice", "min"), sumPrice=("sumPrice", "sum"), maxPrice=("maxPrice", "max"),
+        count=("count", "sum"), amountTraded=("amountTraded", "sum"),
+    )
+    df["avgPrice"] = df["sumPrice"] / df["count"]
+    df = df.sort_values("count", ascending=False, ignore_index=True)
+    return df[["baseName", "minPrice", "avgPrice", "maxPrice", "count", "amountTraded"]]
 
-    for column in ["avgPrice", "minPrice", "maxPrice", "amountTraded", "count"]:
-        df[column]=df[column].map('{:,.3f}'.format)
-    return df
+def _aggregate_trades(cursor, window):
+    df = routed_query(cursor, {"count": "count(*)", "amountTraded": "sum(amount)"}, window)
+    return pd.DataFrame({"count": [int(df["count"].sum())], "amountTraded": [df["amountTraded"].sum()]})
 
 def get_aggregate_trades_current_period(cursor, interval):
-    cursor.execute("""
-    select count(*) AS count, sum(amount) AS amountTraded	   
-    from trades 
-    WHERE tsMs > ago(%(intervalString)s)
-	order by count DESC
-    """, {"intervalString": f"PT{interval}M"})
-
-    return pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
+    return _aggregate_trades(cursor, _window(interval))
 
 def get_aggregate_trades_previous_period(cursor, interval):
-    cursor.execute("""
-    select count(*) AS count, sum(amount) AS amountTraded	   
-    from trades 
-    WHERE tsMs < ago(%(intervalString)s)
-    AND tsMs > ago(%(previousIntervalString)s)
-	order by count DESC
-    """, {"intervalString": f"PT{interval}M", "previousIntervalString": f"PT{interval*2}M"})
+    return _aggregate_trades(cursor, _window(interval, periods_ago=1))
 
-    return pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
+def _sample_slices(window, strata=APPROXIMATE_STRATA, per_stratum=APPROXIMATE_SLICES_PER_STRATUM, rng=None):
+    """
+        Start times of `per_stratum` random 1-second slices from each of
+        `strata` equal parts of window's whole seconds, as a (strata,
+        per_stratum) array, how many slices each part has, and the partial
+        seconds at the window's edges, which are read whole
+    """
+    start_ms, end_ms, _ = window
+    first, last = -(-start_ms // 1000), end_ms // 1000
+    # at least two slices per part to estimate its variance from
+    bounds = np.linspace(0, last - first, max(1, min(strata, (last - first) // 2)) + 1).astype(int)
+    sizes = np.diff(bounds)
+    per_stratum = min(per_stratum, sizes.min())
+    rng = approximate_rng if rng is None else rng
+    picks = [bound + rng.choice(size, per_stratum, replace=False) for bound, size in zip(bounds, sizes)]
+    edges = [(start, end) for start, end in [(start_ms, first * 1000), (last * 1000, end_ms)] if start < end]
+    return (first + np.array(picks)) * 1000, sizes, edges
 
-def get_exchange_buy_side(cursor, interval):
-    cursor.execute("""
-    select lookUp('exchanges', 'name', 'id', exchangeId) AS exchangeName, count(*) AS transactions
-    from trades
-    where orderSide = 'BUYSIDE'
-    AND tsMs > ago(%(intervalString)s)
-    group by exchangeName
-    order by transactions DESC
-    """, {"intervalString": f"PT{interval}M"})
-    return pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
-
-def get_quote_buy_side(cursor, interval):
-    cursor.execute("""
-    select lookUp('pairs', 'quoteName', 'id', currencyPairId) AS quoteName, count(*) AS transactions
+def _sampling_pays(cursor, window, slices, edges):
+    """
+        Whether the sample reads APPROXIMATE_MIN_SAVING times fewer raw trade
+        milliseconds than the exact query routed over the rollups would. Bars
+        are few beside trades, so only the raw parts of the route count.
+    """
+    start_ms, end_ms, now_ms = window
+    raw_ms = sum(end - start for table, start, end in route(start_ms, end_ms, now_ms, coverage=rollup_coverage(cursor))
+                 if table == "trades")
+    sampled_ms = slices.size * 1000 + sum(end - start for start, end in edges)
+    return raw_ms >= APPROXIMATE_MIN_SAVING * sampled_ms
+
+def _sampled_query(cursor, aggregates, slices, edges, group_by=(), where=()):
+    """
+        aggregates over raw trades per sampled slice or edge (a `bucket`
+        column) and group_by columns
+    """
+    columns = list(group_by) + [f"{expression} AS {name}" for name, expression in aggregates.items()]
+    ranges = [(start, start + 1000) for start in slices.ravel().tolist()] + edges
+    time_filter = " OR ".join(f"(tsMs >= {start} AND tsMs < {end})" for start, end in ranges)
+    cursor.execute(f"""
+    select DATETIMECONVERT(tsMs, '1:MILLISECONDS:EPOCH', '1:MILLISECONDS:EPOCH', '1000:MILLISECONDS') AS bucket,
+           {', '.join(columns)}
     from trades
-    where orderSide = 'BUYSIDE'
-    AND tsMs > ago(%(intervalString)s)
-    group by quoteName
-    order by transactions DESC
-    """, {"intervalString": f"PT{interval}M"})
-    return pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
-
-def get_top_pairs_buy_side(cursor, quote_name, interval):
-    cursor.execute("""
-    select sum(amount*price) AS totalAmount,
-           lookUp('pairs', 'baseName', 'id', currencyPairId) AS baseName,
-           lookUp('pairs', 'quoteName', 'id', currencyPairId) AS quoteName
-    from trades 
-    where quoteName = (%(quoteName)s) AND orderSide = 'BUYSIDE'
-    AND tsMs > ago(%(intervalString)s)
-    group by baseName, quoteName
-    order by totalAmount DESC
-    """, {"quoteName": quote_name, "intervalString": f"PT{interval}M"})
-    return pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
-
-def get_top_pairs_sell_side(cursor, quote_name, interval):
-    cursor.execute("""
-    select sum(amount*price) AS totalAmount,
-           lookUp('pairs', 'baseName', 'id', currencyPairId) AS baseName,
-           lookUp('pairs', 'quoteName', 'id', currencyPairId) AS quoteName
-    from trades 
-    where quoteName = (%(quoteName)s) AND orderSide = 'SELLSIDE'
-    AND tsMs > ago(%(intervalString)s)
-    group by baseName, quoteName
-    order by totalAmount DESC
-    """, {"quoteName": quote_name, "intervalString": f"PT{interval}M"})
-    return pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
-
-def quotes(cursor):
-    cursor.execute("""
-    select count(*) AS count,
-       lookUp('pairs', 'quoteName', 'id', currencyPairId) AS quoteName
-    from trades 
-    where quoteName != 'null'
-    group by quoteName
-    order by count desc
-    limit 20
+    WHERE {' AND '.join(list(where) + [f"({time_filter})"])}
+    group by {', '.join(['bucket'] + list(group_by))}
+    limit 1000000
     """)
-    df = pd.DataFrame(cursor, columns=[item[0] for item in cursor.description]) 
+    return result_decoding.frame(cursor)
 
-    return df["quoteName"].values
+def _slice_values(df, slices, groups, group_column, columns):
+    """
+        Per group, the sums of columns in each sampled slice (zero for slices
+        without trades) as (groups, strata, per_stratum) arrays, and their
+        sums over the window's edges
+    """
+    position = {start: index for index, start in enumerate(slices.ravel().tolist())}
+    slot = df["bucket"].astype("int64").map(position).fillna(-1).astype(int).values
+    sampled = slot >= 0
+    row = pd.Index(groups).get_indexer(df[group_column]) if group_column else np.zeros(df.shape[0], dtype=int)
+    values, edges = {}, {}
+    for column in columns:
+        column_values = df[column].values.astype(float)
+        dense = np.zeros((len(groups), slices.size))
+        np.add.at(dense, (row[sampled], slot[sampled]), column_values[sampled])
+        values[column] = dense.reshape((len(groups),) + slices.shape)
+        edges[column] = np.bincount(row[~sampled], weights=column_values[~sampled], minlength=len(groups))
+    return values, edges
 
-def bases(cursor):
-    cursor.execute("""
-    select count(*) AS count,
-       lookUp('pairs', 'baseName', 'id', currencyPairId) AS baseName
-    from trades 
-    where baseName != 'null'
-    group by baseName
-    order by count desc
-    limit 20
+def _stratified_total(values, sizes, exact=0):
+    """
+        Estimated window totals from (groups, strata, per_stratum) slice
+        values plus the exactly known part, and the variances of the estimates
+    """
+    per_stratum = values.shape[-1]
+    total = (values.mean(axis=-1) * sizes).sum(axis=-1) + exact
+    variance = (sizes ** 2 * (1 - per_stratum / sizes) * values.var(axis=-1, ddof=1) / per_stratum).sum(axis=-1)
+    return total, variance
+
+def _stratified_ratio(numerator, denominator, sizes, numerator_exact=0, denominator_exact=0):
+    """
+        Estimated ratio of two window totals and its (linearized) variance
+    """
+    top, _ = _stratified_total(numerator, sizes, numerator_exact)
+    bottom, _ = _stratified_total(denominator, sizes, denominator_exact)
+    ratio = np.divide(top, bottom, out=np.zeros_like(top), where=bottom > 0)
+    _, variance = _stratified_total(numerator - ratio[:, None, None] * denominator, sizes)
+    return ratio, np.divide(variance, bottom ** 2, out=np.zeros_like(top), where=bottom > 0)
+
+def get_all_assets_approx(cursor, interval, rng=None):
+    """
+        get_all_assets estimated from a stratified sample of 1-second slices
+        of the window, with the half widths of 95% confidence intervals in
+        avgPriceError, countError and amountTradedError. minPrice and maxPrice
+        are the sample's, so they can only be inside the true range. Answered
+        exactly, without the error columns, where that is cheaper.
+    """
+    window = _window(interval)
+    slices, sizes, edges = _sample_slices(window, rng=rng)
+    if not _sampling_pays(cursor, window, slices, edges):
+        return get_all_assets(cursor, interval)
+    df = _sampled_query(cursor, {
+        "minPrice": "min(price)", "sumPrice": "sum(price)", "maxPrice": "max(price)",
+        "count": "count(*)", "amountTraded": "sum(amount)",
+    }, slices, edges, group_by=["currencyPairId"], where=[pair_filter(pair_ids(quote_name=USD))])
+    df["baseName"] = dimensions.cache.base_names(df["currencyPairId"])
+    df = df.dropna(subset=["baseName"])
+    bases = df.groupby("baseName").agg(minPrice=("minPrice", "min"), maxPrice=("maxPrice", "max"))
+
+    values, exact = _slice_values(df, slices, bases.index, "baseName", ["sumPrice", "count", "amountTraded"])
+    count, count_variance = _stratified_total(values["count"], sizes, exact["count"])
+    amount, amount_variance = _stratified_total(values["amountTraded"], sizes, exact["amountTraded"])
+    avg_price, avg_price_variance = _stratified_ratio(values["sumPrice"], values["count"], sizes,
+                                                      exact["sumPrice"], exact["count"])
+    df = bases.reset_index().assign(
+        avgPrice=avg_price, avgPriceError=Z_95 * np.sqrt(avg_price_variance),
+        count=count.round().astype("int64"), countError=(Z_95 * np.sqrt(count_variance)).round(),
+        amountTraded=amount, amountTradedError=Z_95 * np.sqrt(amount_variance),
+    )
+    df = df.sort_values("count", ascending=False, ignore_index=True)
+    return df[["baseName", "minPrice", "avgPrice", "avgPriceError", "maxPrice", "count", "countError",
+               "amountTraded", "amountTradedError"]]
+
+def _aggregate_trades_approx(cursor, window, rng=None):
+    slices, sizes, edges = _sample_slices(window, rng=rng)
+    if not _sampling_pays(cursor, window, slices, edges):
+        return _aggregate_trades(cursor, window)
+    df = _sampled_query(cursor, {"count": "count(*)", "amountTraded": "sum(amount)"}, slices, edges)
+    values, exact = _slice_values(df, slices, [None], None, ["count", "amountTraded"])
+    count, count_variance = _stratified_total(values["count"], sizes, exact["count"])
+    amount, amount_variance = _stratified_total(values["amountTraded"], sizes, exact["amountTraded"])
+    return pd.DataFrame({
+        "count": count.round().astype("int64"), "countError": (Z_95 * np.sqrt(count_variance)).round(),
+        "amountTraded": amount, "amountTradedError": Z_95 * np.sqrt(amount_variance),
+    })
+
+def get_aggregate_trades_current_period_approx(cursor, interval, rng=None):
+    """
+        get_aggregate_trades_current_period estimated like
+        get_all_assets_approx, with countError and amountTradedError
+    """
+    return _aggregate_trades_approx(cursor, _window(interval), rng)
+
+def get_aggregate_trades_previous_period_approx(cursor, interval, rng=None):
+    return _aggregate_trades_approx(cursor, _window(interval, periods_ago=1), rng)
+
+def get_exchange_buy_side(cursor, interval, n=20):
+    df = routed_query(cursor, {"transactions": "count(*)"}, _window(interval),
+                      group_by=["exchangeId"], where=["orderSide = 'BUYSIDE'"], limit=100000)
+    df = _sum_by_name(df, {"exchangeName": dimensions.cache.exchange_names(df["exchangeId"])}, ["transactions"])
+    return df.sort_values("transactions", ascending=False, ignore_index=True).head(n)
+
+def get_quote_buy_side(cursor, interval, n=20):
+    df = routed_query(cursor, {"transactions": "count(*)"}, _window(interval),
+                      group_by=["currencyPairId"], where=["orderSide = 'BUYSIDE'"])
+    df = _sum_by_name(df, {"quoteName": dimensions.cache.quote_names(df["currencyPairId"])}, ["transactions"])
+    return df.sort_values("transactions", ascending=False, ignore_index=True).head(n)
+
+def get_top_pairs_buy_side(cursor, quote_name, interval, n=20):
+    return _top_pairs(cursor, quote_name, interval, 'BUYSIDE', n)
+
+def get_top_pairs_sell_side(cursor, quote_name, interval, n=20):
+    return _top_pairs(cursor, quote_name, interval, 'SELLSIDE', n)
+
+def _top_pairs(cursor, quote_name, interval, order_side, n):
+    df = routed_query(cursor, {"totalAmount": "sum(amount*price)"}, _window(interval), group_by=["currencyPairId"],
+                      where=[pair_filter(pair_ids(quote_name=quote_name)), "orderSide = %(orderSide)s"],
+                      params={"orderSide": order_side})
+    df = _sum_by_name(df, {
+        "baseName": dimensions.cache.base_names(df["currencyPairId"]),
+        "quoteName": dimensions.cache.quote_names(df["currencyPairId"]),
+    }, ["totalAmount"])
+    return df.sort_values("totalAmount", ascending=False, ignore_index=True)[["totalAmount", "baseName", "quoteName"]].head(n)
+
+def get_freshness(cursor, interval):
+    """
+        Per exchange, p50/p99 of the time from a trade on the exchange to
+        stream.py receiving it (received*) and to it being produced to Kafka
+        (produced*). The time from Kafka to queryable is estimated as the age
+        of the newest produced trade Pinot has ingested (ingestMs) and added
+        on for lag*, the end-to-end lag from trade to queryable.
+    """
+    start_ms, _, now_ms = _window(interval)
+    cursor.execute(f"""
+    select exchangeId, count(*) AS trades,
+      percentiletdigest(receivedMs - tsNano / 1000000, 50) AS receivedP50,
+      percentiletdigest(receivedMs - tsNano / 1000000, 99) AS receivedP99,
+      percentiletdigest(producedMs - tsNano / 1000000, 50) AS producedP50,
+      percentiletdigest(producedMs - tsNano / 1000000, 99) AS producedP99,
+      max(producedMs) AS lastProducedMs
+    from trades
+    WHERE tsMs >= {start_ms} AND producedMs > 0
+    group by exchangeId
+    limit 10000
     """)
-    
-    df = pd.DataFrame(cursor, columns=[item[0] for item in cursor.description]) 
+    df = result_decoding.frame(cursor)
+    df["exchange"] = dimensions.cache.exchange_names(df["exchangeId"])
+    # clamped, as stream.py's clock may run slightly ahead of this one
+    ingest_ms = max(0, now_ms - df["lastProducedMs"].max()) if df.shape[0] > 0 else 0
+    df["ingestMs"] = ingest_ms
+    df["lagP50"] = df["producedP50"] + ingest_ms
+    df["lagP99"] = df["producedP99"] + ingest_ms
+    df["idleMs"] = (now_ms - df["lastProducedMs"]).clip(lower=0)
+    lag_columns = ["receivedP50", "receivedP99", "producedP50", "producedP99", "ingestMs", "lagP50", "lagP99", "idleMs"]
+    df[lag_columns] = df[lag_columns].round()
+    return df.sort_values("lagP99", ascending=False, ignore_index=True)
+
+# quotes() and bases() rank names by the trades of the last day, not all history
+NAMES_WINDOW_MINUTES = 24 * 60
+
+def _top_names(cursor, column, n):
+    """
+        The n most traded names in column (baseName or quoteName) over the
+        last NAMES_WINDOW_MINUTES, served by the rollups where they exist.
+        Names of the dimension cache's pairs that did not trade come after,
+        most listed first, so the dropdowns are full on a fresh deployment.
+    """
+    df = routed_query(cursor, {"count": "count(*)"}, _window(NAMES_WINDOW_MINUTES), group_by=["currencyPairId"])
+    pairs = dimensions.cache.pairs()
+    traded = pd.Series(df["count"].values, index=df["currencyPairId"].values).groupby(level=0).sum()
+    counts = pairs.assign(count=pairs["id"].map(traded).fillna(0), listed=1)
+    counts = counts.groupby(column)[["count", "listed"]].sum()
+    return counts.sort_values(["count", "listed"], ascending=False).index[:n].tolist()
+
+def quotes(cursor, n=20):
+    return _top_names(cursor, "quoteName", n)
 
-    return df["baseName"].values
\ No newline at end of file
+def bases(cursor, n=20):
+    return _top_names(cursor, "baseName", n)
\ No newline at end of file
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+# Pinot column type -> NumPy dtype. Anything else (STRING, TIMESTAMP, JSON,
+# BYTES, arrays) stays an object column holding what the broker returned.
+DTYPES = {
+    "INT": np.int32,
+    "LONG": np.int64,
+    "FLOAT": np.float32,
+    "DOUBLE": np.float64,
+    "BOOLEAN": np.bool_,
+}
+
+
+def frame(cursor):
+    """
+        DataFrame of the cursor's last result, built column by column from
+        the broker's resultTable: the rows go into one 2-D array in a single
+        step and each column is cast to its Pinot type, instead of pandas
+        walking the DB-API cursor one tuple at a time.
+        Falls back to the cursor for results without a resultTable.
+    """
+    raw = getattr(cursor, "raw_query_response", None) or {}
+    response = raw.get("response")
+    if not isinstance(response, dict) or "resultTable" not in response:
+        return pd.DataFrame(cursor, columns=[item[0] for item in cursor.description])
+
+    schema = response["resultTable"]["dataSchema"]
+    names, types = schema["columnNames"], schema["columnDataTypes"]
+    rows = response["resultTable"]["rows"]
+
+    if not rows:
+        return pd.DataFrame({name: np.array([], dtype=DTYPES.get(kind, object)) for name, kind in zip(names, types)})
+
+    values = np.empty((len(rows), len(names)), dtype=object)
+    values[:] = rows
+    columns = {}
+    for index, (name, kind) in enumerate(zip(names, types)):
+        column = values[:, index]
+        dtype = DTYPES.get(kind)
+        if dtype is not None:
+            try:
+                column = column.astype(dtype)
+            except (TypeError, ValueError):
+                # e.g. nulls in a numeric column: leave it for pandas to infer
+                pass
+        columns[name] = column
+    return pd.DataFrame(columns, columns=names)
@@ -0,0 +1,296 @@
+import multiprocessing
+import queue
+import time
+
+import numpy as np
+
+import trade_columns
+import trade_encoder
+from trade_columns import ORDER_SIDES
+from partitioning import pair_key
+
+# topic/table suffix -> bar width in milliseconds
+RESOLUTIONS = {
+    "1s": 1000,
+    "1m": 60 * 1000,
+    "1h": 60 * 60 * 1000,
+}
+
+BAR_FIELDS = [
+    "bucketMs", "currencyPairId", "exchangeId", "orderSide",
+    "open", "high", "low", "close", "openMs", "closeMs",
+    "tradeCount", "volume", "quoteVolume", "sumPrice", "maxAmount",
+]
+
+
+def topic_for(name):
+    return f"trades_ohlcv_{name}"
+
+
+class OhlcvRollup:
+    """
+        Rolls trades up into OHLCV bars per pair, exchange and order side, one
+        bar per `resolution_ms`. A bar is closed once a trade more than
+        `grace_ms` past its end has been seen. A trade arriving after its bar
+        was closed opens a new partial bar for the same bucket, which closes
+        straight away; queries re-aggregate bars, so the extra row adds up.
+    """
+
+    def __init__(self, resolution_ms, grace_ms=5000):
+        self.resolution_ms = resolution_ms
+        self.grace_ms = grace_ms
+        self.bars = {}
+        self.watermark = 0
+        # end of the oldest open bar, so closed() is cheap until it passes
+        self._oldest_end = None
+
+    def add(self, ts_ms, currency_pair_id, exchange_id, order_side, price, amount):
+        bucket = ts_ms - ts_ms % self.resolution_ms
+        key = (bucket, currency_pair_id, exchange_id, order_side)
+        bar = self.bars.get(key)
+        if bar is None:
+            self.bars[key] = {
+                "bucketMs": bucket, "currencyPairId": currency_pair_id,
+                "exchangeId": exchange_id, "orderSide": order_side,
+                "open": price, "high": price, "low": price, "close": price,
+                "openMs": ts_ms, "closeMs": ts_ms,
+                "tradeCount": 1, "volume": amount, "quoteVolume": amount * price,
+                "sumPrice": price, "maxAmount": amount,
+            }
+            end = bucket + self.resolution_ms
+            if self._oldest_end is None or end < self._oldest_end:
+                self._oldest_end = end
+        else:
+            if ts_ms < bar["openMs"]:
+                bar["open"], bar["openMs"] = price, ts_ms
+            if ts_ms >= bar["closeMs"]:
+                bar["close"], bar["closeMs"] = price, ts_ms
+            bar["high"] = max(bar["high"], price)
+            bar["low"] = min(bar["low"], price)
+            bar["tradeCount"] += 1
+            bar["volume"] += amount
+            bar["quoteVolume"] += amount * price
+            bar["sumPrice"] += price
+            bar["maxAmount"] = max(bar["maxAmount"], amount)
+        self.watermark = max(self.watermark, ts_ms)
+
+    def add_bar(self, bar):
+        """
+            Merges a closed bar of a finer resolution into this one's bars.
+            The watermark is left to advance().
+        """
+        bucket = bar["bucketMs"] - bar["bucketMs"] % self.resolution_ms
+        key = (bucket, bar["currencyPairId"], bar["exchangeId"], bar["orderSide"])
+        current = self.bars.get(key)
+        if current is None:
+            self.bars[key] = dict(bar, bucketMs=bucket)
+            end = bucket + self.resolution_ms
+            if self._oldest_end is None or end < self._oldest_end:
+                self._oldest_end = end
+            return
+        if bar["openMs"] < current["openMs"]:
+            current["open"], current["openMs"] = bar["open"], bar["openMs"]
+        if bar["closeMs"] >= current["closeMs"]:
+            current["close"], current["closeMs"] = bar["close"], bar["closeMs"]
+        current["high"] = max(current["high"], bar["high"])
+        current["low"] = min(current["low"], bar["low"])
+        current["tradeCount"] += bar["tradeCount"]
+        current["volume"] += bar["volume"]
+        current["quoteVolume"] += bar["quoteVolume"]
+        current["sumPrice"] += bar["sumPrice"]
+        current["maxAmount"] = max(current["maxAmount"], bar["maxAmount"])
+
+    def advance(self, watermark):
+        self.watermark = max(self.watermark, watermark)
+
+    def closed(self):
+        """
+            Removes and returns the bars that can no longer receive on-time trades
+        """
+        cutoff = self.watermark - self.grace_ms
+        if self._oldest_end is None or self._oldest_end > cutoff:
+            return []
+        keys = [key for key in self.bars if key[0] + self.resolution_ms <= cutoff]
+        bars = [self.bars.pop(key) for key in keys]
+        self._oldest_end = min((key[0] for key in self.bars), default=None)
+        if self._oldest_end is not None:
+            self._oldest_end += self.resolution_ms
+        return bars
+
+    def flush(self):
+        bars = list(self.bars.values())
+        self.bars.clear()
+        self._oldest_end = None
+        return bars
+
+
+class RollupSet:
+    """
+        The 1s/1m/1h rollups fed from the same trade updates as the `trades`
+        topic. `sinks` maps each resolution name to a callable taking
+        (key, payload) - in stream.py, a ProducerPipeline's submit.
+
+        Only the finest rollup sees every trade; the coarser ones are built
+        from its closed bars, with its watermark, so they close at the same
+        point they would if they saw the trades themselves.
+    """
+
+    def __init__(self, sinks, grace_ms=5000, key_for=pair_key):
+        names = sorted(sinks, key=RESOLUTIONS.get)
+        self.rollups = {name: OhlcvRollup(RESOLUTIONS[name], grace_ms) for name in names}
+        self.finest, *self.coarser = names
+        self.sinks = sinks
+        self.key_for = key_for
+
+    def add_columns(self, columns):
+        """
+            Adds a batch of trades, as NumPy columns (see trade_columns), to
+            the finest rollup. The batch is grouped into bars with NumPy first,
+            so the per-trade work is vectorized and only bars go through the
+            rollup's dict.
+        """
+        if not len(columns["tsMs"]):
+            return
+        finest = self.rollups[self.finest]
+        ts, price, amount = columns["tsMs"], columns["price"], columns["amount"]
+        bucket = ts - ts % finest.resolution_ms
+        # stable, so trades with the same timestamp keep their arrival order
+        order = np.lexsort((ts, columns["side"], columns["exchangeId"], columns["pairId"], bucket))
+        keys = [bucket[order], columns["pairId"][order], columns["exchangeId"][order], columns["side"][order]]
+        starts = np.flatnonzero(np.r_[True, np.any([key[1:] != key[:-1] for key in keys], axis=0)])
+        ends = np.r_[starts[1:], len(order)] - 1
+        ts, price, amount = ts[order], price[order], amount[order]
+        bars = zip(
+            keys[0][starts].tolist(), keys[1][starts].tolist(), keys[2][starts].tolist(),
+            ORDER_SIDES[keys[3][starts]].tolist(),
+            price[starts].tolist(), np.maximum.reduceat(price, starts).tolist(),
+            np.minimum.reduceat(price, starts).tolist(), price[ends].tolist(),
+            ts[starts].tolist(), ts[ends].tolist(), (ends - starts + 1).tolist(),
+            np.add.reduceat(amount, starts).tolist(), np.add.reduceat(amount * price, starts).tolist(),
+            np.add.reduceat(price, starts).tolist(), np.maximum.reduceat(amount, starts).tolist(),
+        )
+        for bar in bars:
+            finest.add_bar(dict(zip(BAR_FIELDS, bar)))
+        finest.advance(int(ts.max()))
+        self.emit(self._cascade(finest.closed(), OhlcvRollup.closed))
+
+    def flush(self):
+        self.emit(self._cascade(self.rollups[self.finest].flush(), OhlcvRollup.flush))
+
+    def _cascade(self, finest_bars, take):
+        bars_by_name = {self.finest: finest_bars}
+        watermark = self.rollups[self.finest].watermark
+        for name in self.coarser:
+            rollup = self.rollups[name]
+            for bar in finest_bars:
+                rollup.add_bar(bar)
+            rollup.advance(watermark)
+            bars_by_name[name] = take(rollup)
+        return bars_by_name
+
+    def emit(self, bars_by_name):
+        for name, bars in bars_by_name.items():
+            for bar in bars:
+                self.sinks[name](self.key_for(bar), trade_encoder.encode(bar))
+
+
+class RollupProcess:
+    """
+        Builds the OHLCV bars in a child process, so neither the websocket
+        callback nor the trades producer thread shares the GIL with them.
+        submit() takes the payloads just handed to the trades topic and sends
+        them over in batches of `batch_size`; the child decodes them with
+        trade_columns.decoder(wire_format), rolls them up and produces the
+        bars with a producer of its own from make_producer(producer_config).
+        Both are pickled for the spawned child, so make_producer has to be a
+        module-level callable and producer_config a plain dict. stop() emits
+        the bars still open and sets `produced`, the bars delivered per topic.
+
+        A child that falls `max_batches` behind never blocks submit(): the
+        batch is dropped instead and its trades counted in `dropped`.
+    """
+
+    def __init__(self, names, producer_config, make_producer=None, wire_format="json", grace_ms=5000,
+                 batch_size=1000, max_batches=100, send_interval=0.2):
+        context = multiprocessing.get_context("spawn")
+        self.batch_size = batch_size
+        self.send_interval = send_interval
+        self.produced = None
+        self.dropped = 0
+        self._batch = []
+        self._sent = time.monotonic()
+        self._batches = context.Queue(maxsize=max_batches)
+        self._results = context.Queue()
+        self._process = context.Process(
+            target=_rollup_main, name="rollups", daemon=True,
+            args=(self._batches, self._results, list(names), make_producer or kafka_producer,
+                  dict(producer_config), wire_format, grace_ms),
+        )
+
+    def start(self):
+        self._process.start()
+        return self
+
+    def submit(self, payloads):
+        self._batch += payloads
+        if len(self._batch) >= self.batch_size or time.monotonic() - self._sent >= self.send_interval:
+            self._send()
+
+    def stop(self, timeout=30.0):
+        if self._batch:
+            self._send()
+        if not self._process.is_alive():
+            return
+        try:
+            self._batches.put(None, timeout=timeout)
+        except queue.Full:
+            print("Rollup process did not catch up before the timeout")
+            return
+        try:
+            self.produced = self._results.get(timeout=timeout)
+        except queue.Empty:
+            print("Rollup process did not report back before the timeout")
+        self._process.join(timeout)
+
+    def _send(self):
+        # never let a dead or lagging child block the websocket callback
+        if self._process.is_alive():
+            try:
+                self._batches.put_nowait(self._batch)
+            except queue.Full:
+                if not self.dropped:
+                    print("Rollup process is falling behind, dropping trades from the OHLCV bars")
+                self.dropped += len(self._batch)
+        elif self.produced is None:
+            self.produced = {}
+            print("Rollup process exited, OHLCV bars are no longer produced")
+        self._batch = []
+        self._sent = time.monotonic()
+
+
+def kafka_producer(config):
+    from confluent_kafka import Producer
+
+    return Producer(config)
+
+
+def _rollup_main(batches, results, names, make_producer, producer_config, wire_format, grace_ms):
+    from producer_pipeline import ProducerPipeline
+
+    producer = make_producer(producer_config)
+    pipelines = {
+        name: ProducerPipeline(producer, topic_for(name), spill_path=f"{topic_for(name)}.spill",
+                               stats_interval=0).start()
+        for name in names
+    }
+    rollups = RollupSet({name: pipeline.submit for name, pipeline in pipelines.items()}, grace_ms)
+    decode = trade_columns.decoder(wire_format)[1]
+    for batch in iter(batches.get, None):
+        try:
+            rollups.add_columns(decode(batch))
+        except Exception as e:
+            print(f"Failed to roll up {len(batch)} trades: {e}")
+    rollups.flush()
+    for pipeline in pipelines.values():
+        pipeline.close()
+    results.put({pipeline.topic: pipeline.delivered for pipeline in pipelines.values()})
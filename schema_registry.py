@@ -0,0 +1,98 @@
+import argparse
+import json
+import os
+
+SCHEMAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "schemas")
+
+
+class FileSchemaRegistry:
+    """
+        Local stand-in for a schema registry: each subject is a directory
+        under config/schemas holding v1.avsc, v2.avsc, ...
+    """
+
+    def __init__(self, root=SCHEMAS_DIR):
+        self.root = root
+
+    def versions(self, subject):
+        subject_dir = os.path.join(self.root, subject)
+        if not os.path.isdir(subject_dir):
+            return []
+        return sorted(
+            int(name[1:-len(".avsc")]) for name in os.listdir(subject_dir)
+            if name.startswith("v") and name.endswith(".avsc")
+        )
+
+    def get(self, subject, version):
+        with open(os.path.join(self.root, subject, f"v{version}.avsc")) as schema_file:
+            return json.load(schema_file)
+
+    def latest(self, subject):
+        versions = self.versions(subject)
+        if not versions:
+            raise KeyError(f"No schema registered for subject {subject!r}")
+        return versions[-1], self.get(subject, versions[-1])
+
+    def register(self, subject, schema):
+        """
+            Returns the version of schema, adding a new one only if it differs
+            from the latest registered version.
+        """
+        versions = self.versions(subject)
+        if versions and self.get(subject, versions[-1]) == schema:
+            return versions[-1]
+
+        version = versions[-1] + 1 if versions else 1
+        os.makedirs(os.path.join(self.root, subject), exist_ok=True)
+        with open(os.path.join(self.root, subject, f"v{version}.avsc"), "w") as schema_file:
+            json.dump(schema, schema_file, indent=2)
+            schema_file.write("\n")
+        return version
+
+
+def realtime_table_config(table_config, schema, topic):
+    """
+        Rewrites a JSON-decoded realtime table config to read schemaless Avro
+        with the given schema from topic.
+    """
+    stream_configs = table_config["tableIndexConfig"]["streamConfigs"]
+    stream_configs["stream.kafka.topic.name"] = topic
+    stream_configs["stream.kafka.decoder.class.name"] = \
+        "org.apache.pinot.plugin.inputformat.avro.SimpleAvroMessageDecoder"
+    stream_configs["stream.kafka.decoder.prop.schema"] = json.dumps(schema)
+    return table_config
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="File-based schema registry")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    register = commands.add_parser("register", help="Register a schema file under a subject")
+    register.add_argument("subject")
+    register.add_argument("schema_file")
+
+    latest = commands.add_parser("latest", help="Print the latest schema for a subject")
+    latest.add_argument("subject")
+
+    table = commands.add_parser("table-config", help="Write the Avro variant of a realtime table config")
+    table.add_argument("subject")
+    table.add_argument("--source", default="config/trades_table.json")
+    table.add_argument("--output", default="config/trades_table_avro.json")
+    table.add_argument("--topic", default="trades-avro")
+
+    args = parser.parse_args()
+    registry = FileSchemaRegistry()
+
+    if args.command == "register":
+        with open(args.schema_file) as schema_file:
+            print(registry.register(args.subject, json.load(schema_file)))
+    elif args.command == "latest":
+        version, schema = registry.latest(args.subject)
+        print(f"v{version}")
+        print(json.dumps(schema, indent=2))
+    elif args.command == "table-config":
+        with open(args.source) as source:
+            table_config = json.load(source)
+        _, schema = registry.latest(args.subject)
+        with open(args.output, "w") as output:
+            json.dump(realtime_table_config(table_config, schema, args.topic), output, indent=2)
@@ -0,0 +1,119 @@
+import argparse
+import time
+
+import pandas as pd
+import requests
+
+pinot_url = "http://localhost:9000"
+broker_url = "http://localhost:8099"
+
+# Task -> the table it runs on. RealtimeToOfflineSegmentsTask moves one
+# bucketTimePeriod of completed realtime segments into offline segments per
+# run; MergeRollupTask then merges the offline segments of each day.
+TASKS = [("RealtimeToOfflineSegmentsTask", "REALTIME"), ("MergeRollupTask", "OFFLINE")]
+
+DONE_STATES = {"COMPLETED", "FAILED", "STOPPED", "ABORTED", "TIMED_OUT"}
+
+
+def segment_sizes(table_name):
+    """
+        Reported size in bytes of every segment of the hybrid table, keyed by
+        table type
+    """
+    response = requests.get(f"{pinot_url}/tables/{table_name}/size").json()
+    sizes = {}
+    for table_type, key in [("REALTIME", "realtimeSegments"), ("OFFLINE", "offlineSegments")]:
+        segments = (response.get(key) or {}).get("segments", {})
+        sizes[table_type] = {name: segment.get("reportedSizeInBytes", 0) for name, segment in segments.items()}
+    return sizes
+
+
+def time_boundary(table_name):
+    """
+        tsMs at which the broker switches from the offline to the realtime
+        table, or None while there are no offline segments
+    """
+    response = requests.get(f"{broker_url}/debug/timeBoundary/{table_name}")
+    if response.status_code != 200:
+        return None
+    return response.json().get("timeValue")
+
+
+def report(table_name):
+    rows = []
+    for table_type, sizes in segment_sizes(table_name).items():
+        values = list(sizes.values())
+        rows.append({
+            "table": f"{table_name}_{table_type}",
+            "segments": len(values),
+            "totalMB": round(sum(values) / 1024 / 1024, 2),
+            "medianMB": round(pd.Series(values, dtype=float).median() / 1024 / 1024, 2) if values else None,
+            "smallestMB": round(min(values) / 1024 / 1024, 2) if values else None,
+        })
+    return pd.DataFrame(rows)
+
+
+def schedule(task_type, table_name_with_type):
+    """
+        Asks the controller to generate tasks of task_type for the table now,
+        instead of waiting for its periodic scheduler. Returns the names of
+        the tasks created, if any.
+    """
+    response = requests.post(f"{pinot_url}/tasks/schedule",
+                             params={"taskType": task_type, "tableName": table_name_with_type})
+    response.raise_for_status()
+    names = (response.json() or {}).get(task_type)
+    return names.split(",") if names else []
+
+
+def wait_for(task_names, timeout_s, poll_s=5):
+    deadline = time.time() + timeout_s
+    states = {}
+    while True:
+        for name in task_names:
+            states[name] = requests.get(f"{pinot_url}/tasks/task/{name}/state").json()
+        if all(state in DONE_STATES for state in states.values()) or time.time() > deadline:
+            return states
+        time.sleep(poll_s)
+
+
+def run_lifecycle(table_name, max_runs=24, timeout_s=600):
+    """
+        Runs each task until it has nothing left to do (or max_runs), one run
+        at a time since the controller won't start a new one for a table
+        while the last is still running
+    """
+    for task_type, table_type in TASKS:
+        for _ in range(max_runs):
+            task_names = schedule(task_type, f"{table_name}_{table_type}")
+            if not task_names:
+                break
+            states = wait_for(task_names, timeout_s)
+            print(f"{task_type}: {states}")
+            if any(state != "COMPLETED" for state in states.values()):
+                break
+
+
+def main(table_name, max_runs, timeout_s):
+    before, boundary_before = report(table_name), time_boundary(table_name)
+    run_lifecycle(table_name, max_runs, timeout_s)
+    after, boundary_after = report(table_name), time_boundary(table_name)
+
+    comparison = before.merge(after, on="table", suffixes=("Before", "After"))
+    print(comparison.to_string(index=False))
+    print(f"Time boundary: {boundary_before} -> {boundary_after}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Move realtime trades into the offline table and merge small segments")
+    parser.add_argument("--table", default="trades")
+    parser.add_argument("--max-runs", type=int, default=24, help="Task runs per task type (one hour bucket each)")
+    parser.add_argument("--timeout", type=int, default=600, help="Seconds to wait for one task run")
+    parser.add_argument("--every", type=int, help="Repeat every this many seconds instead of running once")
+    args = parser.parse_args()
+
+    while True:
+        main(args.table, args.max_runs, args.timeout)
+        if not args.every:
+            break
+        time.sleep(args.every)
@@ -1,69 +1,134 @@
 import cryptowatch as cw
-import json
-import datetime
 import os
+import signal
+import sys
+import time
 
-from google.protobuf.json_format import MessageToJson
 from confluent_kafka import Producer
 
-def acked(err, msg):
-    if err is not None:
-        print("Failed to deliver message: {0}: {1}"
-              .format(msg.value(), err.str()))
-
-def json_serializer(obj):
-    if isinstance(obj, (datetime.datetime, datetime.date)):
-        return obj.isoformat()
-    raise "Type %s not serializable" % type(obj)
-
-producer = Producer({'bootstrap.servers': 'localhost:9092'})
-
-# Set your API Key
-cw.api_key = os.environ.get("KEY")
+import partitioning
+import rollup
+import trade_capture
+import trade_encoder
+from producer_pipeline import ProducerPipeline, producer_config_from_env
+
+ALL_TRADES = ["markets:*:trades"]
+# per step of stop_pipeline() on SIGTERM, well within the supervisor's grace period
+SHUTDOWN_TIMEOUT = 5.0
+
+pipeline = None
+encode_trades = None
+rollups = None
+capture = None
+trades_processed = 0
+
+
+def start_pipeline(bootstrap_servers='localhost:9092', producer=None, make_rollup_producer=None):
+    global pipeline, encode_trades, rollups
+
+    strategy = os.environ.get("TRADES_KEY_STRATEGY", "pair")
+    wire_format = os.environ.get("TRADES_WIRE_FORMAT", "json")
+    partitioning.check_key_strategy(strategy, wire_format, os.environ.get("TRADES_TABLE_CONFIG"))
+    key_for = partitioning.key_strategy(strategy, fanout=int(os.environ.get("TRADES_KEY_FANOUT", 4)))
+    topic, encode_trades, stamp_produced = trade_encoder.wire_format(wire_format, key_for)
+    if producer is None:
+        producer = Producer(producer_config_from_env(bootstrap_servers))
+    pipeline = ProducerPipeline(
+        producer, topic,
+        max_queue_size=int(os.environ.get("PRODUCER_QUEUE_SIZE", 100000)),
+        on_full=os.environ.get("PRODUCER_ON_FULL", "block"),
+        stamp=stamp_produced,
+    ).start()
+
+    # OHLCV bars for the trades_ohlcv_* tables are built and produced by a
+    # child process fed with the encoded trades, off the websocket callback
+    names = list(filter(None, os.environ.get("TRADES_ROLLUPS", "1s,1m,1h").split(",")))
+    if names:
+        rollups = rollup.RollupProcess(
+            names, producer_config_from_env(bootstrap_servers),
+            make_producer=make_rollup_producer, wire_format=wire_format,
+        ).start()
+    return pipeline
+
+
+def stop_pipeline(timeout=30.0):
+    """
+        Emits the OHLCV bars still open, then delivers everything queued
+    """
+    if rollups is not None:
+        rollups.stop(timeout)
+    pipeline.close(timeout)
 
-# Subscribe to resources (https://docs.cryptowat.ch/websocket-api/data-subscriptions#resources)
-cw.stream.subscriptions = ["markets:*:trades"]
-# cw.stream.subscriptions = ["instruments:232:trades"]
 
 # What to do on each trade update
-replace_keys = {
-    "timestamp": "ts", "priceStr": "price", "amountStr": "amount",
-    "timestampNano": "tsNano"
-}
-
-
 def handle_trades_update(trade_update):
     """
         trade_update follows Cryptowatch protocol buffer format:
         https://github.com/cryptowatch/proto/blob/master/public/markets/market.proto
     """
-    global events_processed
-
-    message = MessageToJson(trade_update)
-    market_update = json.loads(message)["marketUpdate"]
-
-    trades = market_update["tradesUpdate"]["trades"]
-    market = market_update["market"]
-    
-    for trade in trades:
-        message = {**trade, **market}
-        for old, new in replace_keys.items():
-          message[new] = message.pop(old)
-        # print(message)
-        payload = json.dumps(message, default=json_serializer, ensure_ascii=False).encode('utf-8')
-        producer.produce(topic='trades', key=str(message["currencyPairId"]), value=payload, callback=acked)
+    global trades_processed
 
-        events_processed += 1
-        if events_processed % 1000 == 0:
-            print(f"{str(datetime.datetime.now())} Flushing after {events_processed} events")
-            producer.flush()
+    received_ms = time.time_ns() // 1000000
+    payloads = []
+    for key, payload in encode_trades(trade_update, received_ms):
+        pipeline.submit(key, payload)
+        payloads.append(payload)
+    trades_processed += len(payloads)
+    if rollups is not None:
+        rollups.submit(payloads)
 
-events_processed = 0
-cw.stream.on_trades_update = handle_trades_update
 
+def is_connected():
+    ws = cw.stream._ws
+    return ws is not None and ws.sock is not None and ws.sock.connected
 
-# Start receiving
-cw.stream.connect()
 
-# Call disconnect to close the stream connection
-# cw.stream.disconnect()
+def shutdown(signum, frame):
+    """
+        Stops the websocket, flushes the open bars, queued trades and capture
+        file, and exits right away: the websocket thread is not a daemon, and
+        atexit handlers never run in the supervisor's worker processes
+    """
+    # a Ctrl-C reaches the supervisor's workers before its SIGTERM does
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        cw.stream.disconnect()
+    except Exception as e:
+        print(f"Failed to disconnect: {e}")
+    stop_pipeline(SHUTDOWN_TIMEOUT)
+    if capture is not None:
+        capture.close()
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def run(subscriptions=ALL_TRADES):
+    global capture
+
+    start_pipeline()
+    # the supervisor stops workers with SIGTERM
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    # Set your API Key
+    cw.api_key = os.environ.get("KEY")
+
+    # Subscribe to resources (https://docs.cryptowat.ch/websocket-api/data-subscriptions#resources)
+    cw.stream.subscriptions = subscriptions
+    # cw.stream.subscriptions = ["instruments:232:trades"]
+    cw.stream.on_trades_update = handle_trades_update
+    if os.environ.get("TRADES_CAPTURE"):
+        # also append every update to a capture file for trade_capture.py replay
+        cw.stream.on_trades_update = trade_capture.recording(handle_trades_update, os.environ["TRADES_CAPTURE"])
+        capture = cw.stream.on_trades_update.writer
+
+    # Start receiving
+    cw.stream.connect()
+
+    # Call disconnect to close the stream connection
+    # cw.stream.disconnect()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,181 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+
+SHARD_KEYS = ("exchange", "market")
+
+
+def load_markets(path="input/markets.json"):
+    with open(path) as markets_file:
+        return [json.loads(line) for line in markets_file if line.strip()]
+
+
+def shard_of(market, shards, shard_by):
+    if shard_by == "exchange":
+        # crc32 rather than hash() so every process agrees on the assignment
+        return zlib.crc32(market["exchange"].encode('utf-8')) % shards
+    return market["id"] % shards
+
+
+def shard_subscriptions(markets, shards, shard_by="exchange"):
+    """
+        Splits the active markets into `shards` lists of markets:<id>:trades
+        subscriptions
+    """
+    if shard_by not in SHARD_KEYS:
+        raise ValueError(f"shard_by must be one of {SHARD_KEYS}, got {shard_by!r}")
+
+    subscriptions = [[] for _ in range(shards)]
+    for market in markets:
+        if market.get("active", True):
+            subscriptions[shard_of(market, shards, shard_by)].append(f"markets:{market['id']}:trades")
+    return subscriptions
+
+
+def worker(shard, subscriptions, heartbeats, trade_counts, heartbeat_interval):
+    import stream
+
+    stream.run(subscriptions)
+
+    # Only heartbeat while the websocket is up, so a dropped connection
+    # looks the same to the supervisor as a dead process.
+    while True:
+        if stream.is_connected():
+            heartbeats[shard] = time.time()
+        trade_counts[shard] = stream.trades_processed
+        time.sleep(heartbeat_interval)
+
+
+class Supervisor:
+    """
+        Runs one stream.py worker per shard, restarting workers that exit or
+        stop heartbeating, and reports per-shard throughput so skew between
+        shards is visible.
+    """
+
+    def __init__(self, subscriptions, heartbeat_interval=1.0, stall_timeout=60.0, report_interval=10.0,
+                 stop_timeout=30.0):
+        self.subscriptions = subscriptions
+        self.heartbeat_interval = heartbeat_interval
+        self.stall_timeout = stall_timeout
+        self.report_interval = report_interval
+        self.stop_timeout = stop_timeout
+
+        shards = len(subscriptions)
+        self.heartbeats = multiprocessing.Array('d', shards)
+        self.trade_counts = multiprocessing.Array('q', shards)
+        self.processes = [None] * shards
+        self.started_at = [0.0] * shards
+        self.restarts = [0] * shards
+        self.totals = [0] * shards
+        self._last_counts = [0] * shards
+        self._stopping = threading.Event()
+
+    def start_worker(self, shard):
+        self.totals[shard] += self._last_counts[shard]
+        self._last_counts[shard] = 0
+        self.trade_counts[shard] = 0
+        self.heartbeats[shard] = 0.0
+
+        process = multiprocessing.Process(
+            target=worker, name=f"stream-shard-{shard}",
+            args=(shard, self.subscriptions[shard], self.heartbeats, self.trade_counts, self.heartbeat_interval),
+            # not a daemon: workers start a child of their own for the rollups
+            daemon=False,
+        )
+        process.start()
+        self.processes[shard] = process
+        self.started_at[shard] = time.time()
+
+    def stop_worker(self, process):
+        """
+            SIGTERM lets the worker flush its open bars; a worker still alive
+            after stop_timeout is killed, so it never runs next to its replacement
+        """
+        process.terminate()
+        self._reap(process)
+
+    def _reap(self, process):
+        process.join(self.stop_timeout)
+        if process.is_alive():
+            print(f"{str(datetime.datetime.now())} {process.name} ignored SIGTERM, killing it")
+            process.kill()
+            process.join()
+
+    def check_health(self):
+        now = time.time()
+        for shard, process in enumerate(self.processes):
+            last_seen = self.heartbeats[shard] or self.started_at[shard]
+            if not process.is_alive():
+                reason = f"exited with code {process.exitcode}"
+            elif now - last_seen > self.stall_timeout:
+                reason = f"no heartbeat for {now - last_seen:.0f}s"
+                self.stop_worker(process)
+            else:
+                continue
+            print(f"{str(datetime.datetime.now())} Shard {shard} {reason}, restarting")
+            self.restarts[shard] += 1
+            self.start_worker(shard)
+
+    def report(self, elapsed):
+        rates = []
+        for shard in range(len(self.processes)):
+            count = self.trade_counts[shard]
+            rates.append(max(count - self._last_counts[shard], 0) / elapsed)
+            self._last_counts[shard] = count
+
+        mean = sum(rates) / len(rates)
+        skew = max(rates) / mean if mean else 0.0
+        shards = ", ".join(
+            f"{shard}: {rate:,.1f}/s ({self.totals[shard] + self._last_counts[shard]:,} total, {self.restarts[shard]} restarts)"
+            for shard, rate in enumerate(rates)
+        )
+        print(f"{str(datetime.datetime.now())} Shard throughput [{shards}] skew (max/mean): {skew:.2f}")
+
+    def run(self):
+        for shard in range(len(self.subscriptions)):
+            self.start_worker(shard)
+
+        last_report = time.time()
+        while not self._stopping.wait(self.heartbeat_interval):
+            self.check_health()
+            now = time.time()
+            if now - last_report >= self.report_interval:
+                self.report(now - last_report)
+                last_report = now
+
+    def stop(self):
+        self._stopping.set()
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                self._reap(process)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run stream.py sharded across worker processes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--shard-by", choices=SHARD_KEYS, default="exchange")
+    parser.add_argument("--markets", default="input/markets.json")
+    parser.add_argument("--stall-timeout", type=float, default=60.0)
+    parser.add_argument("--report-interval", type=float, default=10.0)
+    parser.add_argument("--stop-timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    subscriptions = shard_subscriptions(load_markets(args.markets), args.workers, args.shard_by)
+    for shard, shard_subs in enumerate(subscriptions):
+        print(f"Shard {shard}: {len(shard_subs)} markets")
+
+    supervisor = Supervisor(subscriptions, stall_timeout=args.stall_timeout, report_interval=args.report_interval,
+                            stop_timeout=args.stop_timeout)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        supervisor.stop()
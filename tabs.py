@@ -1,14 +1,42 @@
 from dash import Dash, dcc, html
+import dash_utils
 
-def overview(all_quotes):
-    return html.Div([
-        html.Div([
+PAIRS_COLUMNS = ["base", "quote", "transactions", "biggestTrade", "averageTrade", "amountTraded"]
+ASSETS_COLUMNS = ["baseName", "minPrice", "avgPrice", "maxPrice", "count", "amountTraded"]
+# shown with three decimals and thousands separators
+PAIRS_FORMATTED = ["transactions", "biggestTrade", "averageTrade", "amountTraded"]
+ASSETS_FORMATTED = ["minPrice", "avgPrice", "maxPrice", "count", "amountTraded"]
+# half widths of the confidence intervals of approximate results, and how they are shown
+ERROR_COLUMNS = {"avgPriceError": "± avgPrice", "countError": "± count", "amountTradedError": "± amountTraded"}
+LATEST_TRADES_COLUMNS = ["tsMs", "baseName", "quoteName", "market", "exchange", "amount", "price", "orderSide"]
+BASE_TRADES_COLUMNS = ["tsMs", "quoteName", "market", "exchange", "amount", "price", "orderSide"]
+FRESHNESS_COLUMNS = ["exchange", "trades", "receivedP50", "receivedP99", "producedP50", "producedP99",
+                     "ingestMs", "lagP50", "lagP99", "idleMs"]
+QUERY_METRICS_COLUMNS = ["function", "callback", "interval", "queries", "errors", "wallMsP50", "wallMsP99",
+                         "brokerMs", "numDocsScanned", "numEntriesScannedPostFilter", "rows", "bytes"]
+
+def overview(all_quotes, push=False):
+    if push:
+        # fixed components whose props assets/push.js updates in place
+        panels = [
+            html.Div(id='push-status', style={"display": "none"}),
+            html.Div(id='aggregate-trades', children=[dcc.Graph(id='aggregate-trades-graph')]),
+            html.H2('Pairs'),
+            html.Div(id='pairs', children=dash_utils.empty_datatable('pairs-table', PAIRS_COLUMNS, PAIRS_FORMATTED)),
+            html.H2('Assets'),
+            html.Div(id='overview-assets', children=dash_utils.empty_datatable('overview-assets-table', ASSETS_COLUMNS, ASSETS_FORMATTED)),
+        ]
+    else:
+        panels = [
             html.Div(id='aggregate-trades'),
             html.H2('Pairs'),
             html.Div(id='pairs'),
             html.H2('Assets'),
             html.Div(id='overview-assets'),
-        ]),
+        ]
+
+    return html.Div([
+        html.Div(panels),
         html.Div([
             html.H2('Most Traded Assets'),
             html.Div(id="quote-currency", children=[
@@ -53,7 +81,8 @@ def assets(all_bases):
             html.Div(id="asset-charts"),        
             html.Div([
                 html.H4('Latest Trades'),
-                html.Div(id='latest-trades-bases')
+                dcc.Store(id='latest-trades-bases-tail'),
+                html.Div(id='latest-trades-bases', children=dash_utils.empty_datatable('latest-trades-bases-table', BASE_TRADES_COLUMNS))
             ])
         ])
 
@@ -61,6 +90,26 @@ def latest_trades():
     return html.Div([
         html.Div([
             html.H2('Latest Trades'),
-            html.Div(id='latest-trades'),
+            dcc.Store(id='latest-trades-tail'),
+            html.Div(id='latest-trades', children=dash_utils.empty_datatable('latest-trades-table', LATEST_TRADES_COLUMNS)),
         ])     
-    ])    
+    ])
+
+def freshness():
+    return html.Div([
+        html.Div([
+            html.H2('Freshness'),
+            html.P('Milliseconds from trade time on the exchange to received by stream.py, to produced to Kafka, '
+                   'and to queryable in Pinot (lag), per exchange, most lagging first.'),
+            html.Div(id='freshness', children=dash_utils.empty_datatable('freshness-table', FRESHNESS_COLUMNS)),
+        ])
+    ])
+
+def query_metrics():
+    return html.Div([
+        html.Div([
+            html.H2('Query Metrics'),
+            html.P('Per query function, callback and recency, slowest first. Also served at /metrics.'),
+            html.Div(id='query-metrics', children=dash_utils.empty_datatable('query-metrics-table', QUERY_METRICS_COLUMNS)),
+        ])
+    ])
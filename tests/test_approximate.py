@@ -0,0 +1,115 @@
+import math
+
+import numpy as np
+import pytest
+
+import querydb
+from querydb import _sample_slices, _stratified_ratio, _stratified_total
+
+NOW = 1_700_000_000_000 + 12_345
+
+
+def sample(population, per_stratum, rng):
+    """
+        (strata, per_stratum) values drawn without replacement from each
+        row of population, and the stratum sizes
+    """
+    picks = np.array([rng.choice(len(row), per_stratum, replace=False) for row in population])
+    return np.take_along_axis(population, picks, axis=1), np.full(len(population), population.shape[1])
+
+
+def test_constant_slices_give_the_exact_total_with_no_variance():
+    values = np.full((1, 3, 4), 5.0)
+    total, variance = _stratified_total(values, np.array([10, 20, 30]))
+    assert total.tolist() == [5.0 * 60]
+    assert variance.tolist() == [0.0]
+
+
+def test_the_exactly_known_part_is_added_on():
+    total, _ = _stratified_total(np.full((2, 1, 2), 1.0), np.array([4]), exact=np.array([3.0, 7.0]))
+    assert total.tolist() == [7.0, 11.0]
+
+
+def test_a_full_sample_has_no_sampling_error():
+    rng = np.random.default_rng(1)
+    population = rng.poisson(20, (5, 8)).astype(float)
+    total, variance = _stratified_total(population[None], np.full(5, 8))
+    assert total[0] == pytest.approx(population.sum())
+    assert variance[0] == pytest.approx(0.0)
+
+
+def test_variance_matches_the_textbook_formula():
+    values = np.array([[[1.0, 3.0], [2.0, 6.0]]])
+    sizes = np.array([10, 4])
+    _, variance = _stratified_total(values, sizes)
+    # sum over strata of N^2 (1 - n/N) s^2 / n, with s^2 the sample variance
+    expected = 10 ** 2 * (1 - 2 / 10) * 2.0 / 2 + 4 ** 2 * (1 - 2 / 4) * 8.0 / 2
+    assert variance[0] == pytest.approx(expected)
+
+
+def test_totals_are_unbiased_and_the_95_percent_interval_covers():
+    rng = np.random.default_rng(42)
+    # 30 strata of 60 one-second slices with a trend and bursts, like a busy half hour
+    population = rng.poisson(np.linspace(5, 50, 30)[:, None] * rng.gamma(2, 0.5, (30, 60))).astype(float)
+    truth = population.sum()
+    estimates, covered = [], 0
+    for _ in range(2000):
+        values, sizes = sample(population, 4, rng)
+        total, variance = _stratified_total(values[None], sizes)
+        estimates.append(total[0])
+        covered += abs(total[0] - truth) <= querydb.Z_95 * math.sqrt(variance[0])
+    assert np.mean(estimates) == pytest.approx(truth, rel=0.01)
+    assert 0.92 <= covered / 2000 <= 0.98
+
+
+def test_a_fixed_ratio_is_estimated_exactly():
+    rng = np.random.default_rng(3)
+    counts = rng.poisson(10, (2, 5, 4)).astype(float) + 1
+    prices = counts * np.array([100.0, 250.0])[:, None, None]
+    ratio, variance = _stratified_ratio(prices, counts, np.full(5, 60))
+    assert ratio.tolist() == pytest.approx([100.0, 250.0])
+    assert variance.tolist() == pytest.approx([0.0, 0.0], abs=1e-9)
+
+
+def test_a_ratio_without_any_denominator_is_zero():
+    ratio, variance = _stratified_ratio(np.zeros((1, 2, 2)), np.zeros((1, 2, 2)), np.array([5, 5]))
+    assert ratio.tolist() == [0.0]
+    assert variance.tolist() == [0.0]
+
+
+def test_slices_are_repeatable_with_a_seeded_rng():
+    window = (NOW - 30 * 60 * 1000, NOW, NOW)
+    first = _sample_slices(window, rng=np.random.default_rng(9))
+    second = _sample_slices(window, rng=np.random.default_rng(9))
+    assert np.array_equal(first[0], second[0])
+
+
+def test_slices_are_distinct_whole_seconds_inside_their_stratum():
+    start_ms, end_ms = NOW - 30 * 60 * 1000, NOW
+    slices, sizes, edges = _sample_slices((start_ms, end_ms, end_ms), rng=np.random.default_rng(5))
+    assert slices.shape == (querydb.APPROXIMATE_STRATA, querydb.APPROXIMATE_SLICES_PER_STRATUM)
+    assert sizes.sum() == (end_ms // 1000) - (-(-start_ms // 1000))
+    bounds = -(-start_ms // 1000) * 1000 + np.r_[0, np.cumsum(sizes)] * 1000
+    for row, low, high in zip(slices, bounds[:-1], bounds[1:]):
+        assert len(set(row.tolist())) == len(row)
+        assert all(low <= start < high and start % 1000 == 0 for start in row.tolist())
+    # the partial seconds at either end are read whole
+    assert edges == [(start_ms, start_ms - start_ms % 1000 + 1000), (end_ms - end_ms % 1000, end_ms)]
+
+
+@pytest.fixture
+def coverage(monkeypatch):
+    def pin(since):
+        monkeypatch.setattr(querydb, "use_rollups", True)
+        monkeypatch.setattr(querydb, "rollup_since", since)
+        monkeypatch.setattr(querydb, "_rollup_checked_at", math.inf)
+    return pin
+
+
+def test_sampling_is_skipped_where_rollups_make_the_exact_query_cheaper(coverage):
+    window = (NOW - 30 * 60 * 1000, NOW, NOW)
+    slices, _, edges = _sample_slices(window, rng=np.random.default_rng(1))
+    coverage({table: 0 for table, _ in querydb.ROLLUPS})
+    assert not querydb._sampling_pays(None, window, slices, edges)
+    coverage({})
+    assert querydb._sampling_pays(None, window, slices, edges)
@@ -0,0 +1,132 @@
+import math
+
+import pytest
+from cryptowatch.stream.proto.public.stream import stream_pb2
+
+import trade_columns
+from avro_codec import RecordCodec, encode_long
+from schema_registry import FileSchemaRegistry
+from trade_encoder import ORDER_SIDES, AvroTradeEncoder
+
+SHIPPED = FileSchemaRegistry()
+V1 = SHIPPED.get("trades", 1)
+V2 = SHIPPED.get("trades", 2)
+
+TRADE = {
+    "externalId": "t-é-1",
+    "orderSide": "BUYSIDE",
+    "exchangeId": 27,
+    "currencyPairId": 232,
+    "marketId": 579,
+    "ts": 1666000000,
+    "price": 19234.56,
+    "amount": 0.0025,
+    "tsNano": 1666000000123456789,
+    "receivedMs": 1666000000200,
+    "producedMs": 1666000000250,
+}
+
+
+@pytest.mark.parametrize("n, encoded", [(0, b"\x00"), (-1, b"\x01"), (1, b"\x02"), (-64, b"\x7f"), (64, b"\x80\x01")])
+def test_longs_are_zigzag_varints(n, encoded):
+    assert encode_long(n) == encoded
+
+
+def test_round_trip():
+    codec = RecordCodec(V2)
+    assert codec.decode(codec.encode(TRADE)) == TRADE
+
+
+@pytest.mark.parametrize("value", [-(2 ** 63), -1, 0, 2 ** 63 - 1])
+def test_long_extremes_round_trip(value):
+    codec = RecordCodec(V2)
+    assert codec.decode(codec.encode(dict(TRADE, tsNano=value)))["tsNano"] == value
+
+
+def test_null_union_branch_round_trips():
+    codec = RecordCodec(V2)
+    assert codec.decode(codec.encode(dict(TRADE, orderSide=None)))["orderSide"] is None
+
+
+def test_doubles_round_trip_exactly():
+    codec = RecordCodec(V2)
+    for price in [0.1, 1e-12, 1e300, math.pi]:
+        assert codec.decode(codec.encode(dict(TRADE, price=price)))["price"] == price
+
+
+def test_non_record_schemas_are_rejected():
+    with pytest.raises(ValueError):
+        RecordCodec({"type": "array", "items": "long"})
+
+
+def test_v2_only_appends_fields_with_defaults():
+    v1_fields = V1["fields"]
+    assert V2["fields"][:len(v1_fields)] == v1_fields
+    assert all("default" in field for field in V2["fields"][len(v1_fields):])
+
+
+def test_v1_readers_decode_v2_payloads():
+    payload = RecordCodec(V2).encode(TRADE)
+    decoded = RecordCodec(V1).decode(payload)
+    assert decoded == {field["name"]: TRADE[field["name"]] for field in V1["fields"]}
+
+
+def test_v1_payloads_are_a_prefix_of_v2_payloads():
+    assert RecordCodec(V2).encode(TRADE).startswith(RecordCodec(V1).encode(TRADE))
+
+
+class PinnedRegistry:
+    def __init__(self, version):
+        self.version = version
+
+    def latest(self, subject):
+        return self.version, SHIPPED.get(subject, self.version)
+
+
+def trade_update():
+    message = stream_pb2.StreamMessage()
+    market_update = message.marketUpdate
+    market_update.market.exchangeId = TRADE["exchangeId"]
+    market_update.market.currencyPairId = TRADE["currencyPairId"]
+    market_update.market.marketId = TRADE["marketId"]
+    trade = market_update.tradesUpdate.trades.add()
+    trade.externalId = TRADE["externalId"]
+    trade.orderSide = {name: number for number, name in ORDER_SIDES.items()}["BUYSIDE"]
+    trade.timestamp = TRADE["ts"]
+    trade.timestampNano = TRADE["tsNano"]
+    trade.priceStr = repr(TRADE["price"])
+    trade.amountStr = repr(TRADE["amount"])
+    return message
+
+
+def test_v2_encoder_stamps_produced_ms_in_place():
+    encoder = AvroTradeEncoder(registry=PinnedRegistry(2))
+    [(key, payload)] = list(encoder.encode_trades(trade_update(), received_ms=TRADE["receivedMs"]))
+    assert key == str(TRADE["currencyPairId"])
+    assert RecordCodec(V2).decode(payload)["producedMs"] == 0
+    stamped = encoder.stamp_produced(payload, TRADE["producedMs"])
+    assert RecordCodec(V2).decode(stamped) == TRADE
+
+
+def test_v1_encoder_leaves_payloads_alone():
+    encoder = AvroTradeEncoder(registry=PinnedRegistry(1))
+    [(_, payload)] = list(encoder.encode_trades(trade_update(), received_ms=TRADE["receivedMs"]))
+    assert encoder.stamp_produced(payload, TRADE["producedMs"]) == payload
+    assert RecordCodec(V1).decode(payload)["tsNano"] == TRADE["tsNano"]
+
+
+def test_columns_decoded_from_avro():
+    codec = RecordCodec(V2)
+    columns = trade_columns.avro_columns(codec)([codec.encode(TRADE), codec.encode(dict(TRADE, orderSide=None))])
+    assert columns["tsMs"].tolist() == [TRADE["ts"] * 1000] * 2
+    assert columns["pairId"].tolist() == [TRADE["currencyPairId"]] * 2
+    assert columns["side"].tolist() == [trade_columns.SIDE_CODES["BUYSIDE"], 0]
+
+
+def test_registry_only_adds_a_version_when_the_schema_changes(tmp_path):
+    registry = FileSchemaRegistry(str(tmp_path))
+    assert registry.register("trades", V1) == 1
+    assert registry.register("trades", V1) == 1
+    assert registry.register("trades", V2) == 2
+    assert registry.latest("trades") == (2, V2)
+    assert registry.versions("trades") == [1, 2]
@@ -0,0 +1,42 @@
+import glob
+import json
+import os
+
+import pyarrow.parquet as pq
+
+from backfill import split_archive
+
+DAY = 86400
+
+
+def trade(ts):
+    return {"externalId": "1", "orderSide": "BUYSIDE", "exchangeId": "96", "currencyPairId": "176217",
+            "marketId": "62788", "ts": str(ts), "price": "47.7", "amount": "0.1", "tsNano": str(ts * 10**9)}
+
+
+def write_archive(path, lines):
+    with open(path, "w") as archive:
+        archive.write("\n".join(line if isinstance(line, str) else json.dumps(line) for line in lines))
+
+
+def chunk_rows(staging_dir, day):
+    return [pq.read_metadata(path).num_rows for path in sorted(glob.glob(os.path.join(staging_dir, day, "*.parquet")))]
+
+
+def test_lines_without_a_ts_are_skipped_and_counted(tmp_path):
+    archive = str(tmp_path / "trades.jsonlines")
+    write_archive(archive, [trade(0), {"price": "1"}, dict(trade(0), ts=""), "not json", "[]", trade(1)])
+    counts, skipped = split_archive(archive, str(tmp_path / "staging"))
+    assert counts == {"1970-01-01": 2}
+    assert skipped == 4
+
+
+def test_the_largest_day_is_written_out_when_too_many_trades_are_held(tmp_path):
+    archive, staging_dir = str(tmp_path / "trades.jsonlines"), str(tmp_path / "staging")
+    write_archive(archive, [trade(0), trade(0), trade(DAY), trade(0), trade(DAY), trade(2 * DAY)])
+    counts, _ = split_archive(archive, staging_dir, chunk_rows=100, max_buffered_rows=3)
+    assert counts == {"1970-01-01": 3, "1970-01-02": 2, "1970-01-03": 1}
+    # each time a fourth trade is held, the largest day is written out
+    assert chunk_rows(staging_dir, "1970-01-01") == [3]
+    assert chunk_rows(staging_dir, "1970-01-02") == [2]
+    assert chunk_rows(staging_dir, "1970-01-03") == [1]
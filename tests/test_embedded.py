@@ -0,0 +1,73 @@
+import json
+import threading
+import time
+
+import confluent_kafka
+
+import trade_columns
+from embedded import ColumnarRingBuffer, TradeConsumer
+
+TRADE = {"ts": 1700000000, "price": 10.5, "amount": 2.0, "currencyPairId": 232, "exchangeId": 27,
+         "orderSide": "SELLSIDE"}
+
+
+class Message:
+    def __init__(self, trade):
+        self._value = trade if isinstance(trade, bytes) else json.dumps(trade).encode()
+
+    def value(self):
+        return self._value
+
+    def error(self):
+        return None
+
+
+def test_malformed_json_trades_are_skipped():
+    payloads = [Message(trade).value() for trade in [
+        TRADE, dict(TRADE, price=None), {k: v for k, v in TRADE.items() if k != "ts"}, [1, 2], dict(TRADE, ts=1700000001),
+    ]]
+    columns = trade_columns.json_columns(payloads)
+    assert columns["tsMs"].tolist() == [1700000000000, 1700000001000]
+    assert columns["side"].tolist() == [2, 2]
+    assert trade_columns.json_columns(payloads[:1] + [b"not json"])["tsMs"].tolist() == [1700000000000]
+
+
+def test_consumer_counts_skipped_trades_and_appends_nothing_for_an_all_bad_batch():
+    buffer = ColumnarRingBuffer(60_000, 5_000)
+    consumer = TradeConsumer(60_000, [buffer])
+    consumer.handle([Message(TRADE), Message(dict(TRADE, exchangeId=None))])
+    consumer.handle([Message(b"{}")])
+    assert (consumer.consumed, consumer.skipped) == (1, 2)
+    assert buffer.newest == TRADE["ts"] * 1000 // 5_000
+
+
+class FailingConsumer:
+    batches = []
+
+    def __init__(self, config):
+        pass
+
+    def subscribe(self, topics, on_assign):
+        self.on_assign = on_assign
+
+    def consume(self, num_messages, timeout):
+        time.sleep(0.01)
+        if not self.batches:
+            raise RuntimeError("broker went away")
+        return self.batches.pop(0)
+
+    def close(self):
+        pass
+
+
+def test_a_failing_batch_restarts_coverage_and_a_dead_thread_is_never_caught_up(monkeypatch):
+    monkeypatch.setattr(confluent_kafka, "Consumer", FailingConsumer)
+    consumer = TradeConsumer(60_000)
+    consumer.covered_from_ms = 0
+    consumer.sinks.append(type("BrokenSink", (), {"append": lambda self, columns: 1 / 0})())
+    FailingConsumer.batches = [[], [Message(TRADE)]]
+    thread = threading.Thread(target=consumer._run)
+    thread.start()
+    thread.join(5)
+    assert consumer.covered_from_ms > 0
+    assert not consumer.caught_up and not consumer.covers(0)
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+import partitioning
+from partitioning import murmur2, partition_for
+
+# org.apache.kafka.common.utils.UtilsTest#testMurmur2: key -> signed 32-bit hash
+KAFKA_MURMUR2 = {
+    b"21": -973932308,
+    b"foobar": -790332482,
+    b"a-little-bit-long-string": -985981536,
+    b"a-little-bit-longer-string": -1486304829,
+    b"lkjh234lh9fiuh90y23oiuhsafujhadof229phr9h19h89h8": -58897971,
+    b"abc": 479470107,
+}
+
+
+@pytest.mark.parametrize("key, expected", KAFKA_MURMUR2.items())
+def test_murmur2_matches_kafka(key, expected):
+    assert murmur2(key) == expected & 0xFFFFFFFF
+
+
+@pytest.mark.parametrize("key, expected", KAFKA_MURMUR2.items())
+def test_partition_for_matches_kafkas_default_partitioner(key, expected):
+    # Utils.toPositive(Utils.murmur2(key)) % numPartitions
+    assert partition_for(key.decode(), 10) == (expected & 0x7fffffff) % 10
+
+
+def test_pair_round_robin_cycles_each_pair_over_its_fanout():
+    key_for = partitioning.key_strategy("pair-round-robin", fanout=3)
+    keys = [key_for({"currencyPairId": pair}) for pair in [7, 7, 9, 7, 7]]
+    assert keys == ["7:0", "7:1", "9:0", "7:2", "7:0"]
+
+
+def test_unknown_strategy_is_rejected():
+    with pytest.raises(ValueError):
+        partitioning.key_strategy("random")
+
+
+def write_table_config(tmp_path, partitioned):
+    index_config = {"loadMode": "MMAP"}
+    if partitioned:
+        index_config["segmentPartitionConfig"] = {
+            "columnPartitionMap": {"currencyPairId": {"functionName": "Murmur", "numPartitions": 10}}}
+    path = tmp_path / "trades_table.json"
+    path.write_text(json.dumps({"tableIndexConfig": index_config}))
+    return str(path)
+
+
+@pytest.mark.parametrize("strategy", ["market", "exchange", "composite", "pair-round-robin"])
+def test_strategies_that_scatter_pairs_are_refused_on_a_partitioned_table(tmp_path, strategy):
+    with pytest.raises(ValueError, match="currencyPairId"):
+        partitioning.check_key_strategy(strategy, table_config_path=write_table_config(tmp_path, True))
+
+
+def test_any_strategy_is_allowed_on_an_unpartitioned_table(tmp_path):
+    partitioning.check_key_strategy("market", table_config_path=write_table_config(tmp_path, False))
+
+
+def test_pair_strategy_is_allowed_with_the_shipped_configs():
+    for wire_format in partitioning.TABLE_CONFIGS:
+        partitioning.check_key_strategy("pair", wire_format)
+        with pytest.raises(ValueError):
+            partitioning.check_key_strategy("composite", wire_format)
@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+
+import querydb
+from querydb import bucket_ms, price_buckets
+
+MINUTE, HOUR = 60 * 1000, 60 * 60 * 1000
+
+
+@pytest.mark.parametrize("span_ms, buckets, expected", [
+    (MINUTE, 500, 1000),          # finer than a second: one-second buckets
+    (30 * MINUTE, 500, 4000),     # 3.6s rounds up to whole seconds
+    (30 * MINUTE, 700, 3000),
+    (24 * HOUR, 500, 3 * MINUTE),  # 172.8s rounds up to whole minutes
+    (30 * 24 * HOUR, 500, 2 * HOUR),
+])
+def test_bucket_ms(span_ms, buckets, expected):
+    assert bucket_ms(span_ms, buckets) == expected
+
+
+@pytest.mark.parametrize("span_ms", [MINUTE, 7 * MINUTE, 30 * MINUTE, 5 * HOUR, 24 * HOUR, 90 * 24 * HOUR])
+def test_buckets_are_whole_rollup_buckets_and_no_more_than_asked(span_ms):
+    size = bucket_ms(span_ms, 500)
+    resolution = max(resolution for _, resolution in querydb.ROLLUPS if size >= resolution)
+    assert size % resolution == 0
+    assert -(-span_ms // size) <= 500
+
+
+def partial(bucket, first_ms, first_price, last_ms, last_price, low, high, count, sum_price):
+    return {"bucket": bucket, "firstMs": first_ms, "firstPrice": first_price, "lastMs": last_ms,
+            "lastPrice": last_price, "minPrice": low, "maxPrice": high, "count": count, "sumPrice": sum_price}
+
+
+def test_partials_of_different_tables_are_merged_per_bucket():
+    df = pd.DataFrame([
+        # bucket 0 from a rollup, then the raw trades after its last closed bar
+        partial(0, 100, 10.0, 2_000, 11.0, 9.0, 12.0, 4, 42.0),
+        partial(0, 2_500, 13.0, 2_900, 8.0, 8.0, 13.0, 2, 21.0),
+        # bucket 3000 only from raw trades
+        partial(3_000, 3_100, 20.0, 3_200, 21.0, 20.0, 21.0, 2, 41.0),
+    ])
+    result = price_buckets(df)
+    assert result["tsMs"].tolist() == [3_000, 0]
+    newest, oldest = result.iloc[0], result.iloc[1]
+    assert (oldest["firstPrice"], oldest["lastPrice"]) == (10.0, 8.0)
+    assert (oldest["minPrice"], oldest["maxPrice"]) == (8.0, 13.0)
+    assert oldest["count"] == 6
+    assert oldest["price"] == pytest.approx(63.0 / 6)
+    assert (newest["firstPrice"], newest["lastPrice"], newest["count"]) == (20.0, 21.0, 2)
+
+
+def test_first_and_last_follow_time_not_row_order():
+    df = pd.DataFrame([
+        partial(0, 500, 2.0, 900, 3.0, 2.0, 3.0, 1, 2.0),
+        partial(0, 100, 1.0, 400, 4.0, 1.0, 4.0, 1, 1.0),
+    ])
+    row = price_buckets(df).iloc[0]
+    assert (row["firstPrice"], row["lastPrice"]) == (1.0, 3.0)
+
+
+def test_no_trades_give_an_empty_frame_with_the_chart_columns():
+    result = price_buckets(pd.DataFrame())
+    assert result.shape[0] == 0
+    assert list(result.columns) == ["tsMs", "price", "firstPrice", "minPrice", "maxPrice", "lastPrice", "count"]
@@ -0,0 +1,32 @@
+from producer_pipeline import ProducerPipeline
+
+
+class RecordingProducer:
+    def __init__(self):
+        self.values = []
+
+    def produce(self, topic, key=None, value=None, callback=None):
+        self.values.append(value)
+
+    def poll(self, timeout=None):
+        return 0
+
+    def flush(self, timeout=None):
+        return 0
+
+    def __len__(self):
+        return 0
+
+
+def test_spill_keeps_messages_in_submit_order(tmp_path):
+    producer = RecordingProducer()
+    pipeline = ProducerPipeline(producer, "trades", max_queue_size=1, on_full="spill",
+                                spill_path=str(tmp_path / "trades.spill"), stats_interval=0)
+    pipeline.submit("232", b"1")
+    pipeline.submit("232", b"2")
+    # the delivery thread takes the first message, making room in the queue
+    pipeline._produce(*pipeline._queue.get_nowait())
+    pipeline.submit("232", b"3")
+    pipeline.start().close()
+    assert producer.values == [b"1", b"2", b"3"]
+    assert pipeline.spilled == 2
@@ -0,0 +1,170 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import query_cache
+from query_cache import QueryCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(query_cache.time, "time", lambda: now[0])
+    return now
+
+
+def counting(result=None):
+    calls = []
+
+    def fn(cursor, *args):
+        calls.append(args)
+        return result if result is not None else len(calls)
+
+    return fn, calls
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_equal_args_share_an_entry(clock):
+    cache = QueryCache()
+    fn, calls = counting()
+    first = cache.call(fn, None, [1, 2], {"b": 1, "a": (2, 3)})
+    second = cache.call(fn, None, (1, 2), {"a": [2, 3], "b": 1})
+    assert first == second == 1
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_numpy_scalars_match_python_values(clock):
+    cache = QueryCache()
+    fn, calls = counting()
+    cache.call(fn, None, "Bitcoin", 30)
+    cache.call(fn, None, np.str_("Bitcoin"), np.int64(30))
+    assert len(calls) == 1
+
+
+def test_cursor_is_not_part_of_the_key(clock):
+    cache = QueryCache()
+    fn, calls = counting()
+    cache.call(fn, object(), 1)
+    cache.call(fn, object(), 1)
+    assert len(calls) == 1
+
+
+def get_pairs(cursor, interval):
+    return "pairs"
+
+
+def get_assets(cursor, interval):
+    return "assets"
+
+
+def test_different_args_and_functions_miss(clock):
+    cache = QueryCache()
+    assert cache.call(get_pairs, None, 1) == "pairs"
+    assert cache.call(get_assets, None, 1) == "assets"
+    cache.call(get_pairs, None, 2)
+    assert cache.stats()["misses"] == 3
+
+
+def test_entries_expire_with_their_bucket(clock):
+    cache = QueryCache()
+    fn, calls = counting()
+    clock[0] = 1000.2
+    assert cache.call(fn, None, ttl=1.0) == 1
+    clock[0] = 1000.9
+    assert cache.call(fn, None, ttl=1.0) == 1
+    clock[0] = 1001.0
+    assert cache.call(fn, None, ttl=1.0) == 2
+
+
+def test_zero_ttl_is_not_cached(clock):
+    cache = QueryCache()
+    fn, calls = counting()
+    cache.call(fn, None, ttl=0)
+    cache.call(fn, None, ttl=0)
+    assert len(calls) == 2
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    cache = QueryCache(max_entries=2)
+    fn, calls = counting()
+    cache.call(fn, None, 1)
+    cache.call(fn, None, 2)
+    cache.call(fn, None, 1)
+    cache.call(fn, None, 3)
+    cache.call(fn, None, 1)
+    cache.call(fn, None, 2)
+    assert calls == [(1,), (2,), (3,), (2,)]
+    assert cache.stats()["evictions"] == 2
+
+
+def test_concurrent_misses_run_the_query_once(clock):
+    cache = QueryCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow(cursor, interval):
+        calls.append(interval)
+        started.set()
+        release.wait(5)
+        return {"rows": interval}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.call(slow, None, 5)))
+    leader.start()
+    assert started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(cache.call(slow, None, 5))) for _ in range(4)]
+    for follower in followers:
+        follower.start()
+    wait_for(lambda: cache.stats()["coalesced"] == 4)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert calls == [5]
+    assert len(results) == 5
+    assert all(result is results[0] for result in results)
+    assert cache.stats()["misses"] == 1
+
+
+def test_a_failed_query_is_raised_to_every_waiter_and_not_cached(clock):
+    cache = QueryCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def failing(cursor):
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        raise RuntimeError("broker down")
+
+    errors = []
+
+    def call():
+        try:
+            cache.call(failing, None)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    wait_for(lambda: cache.stats()["coalesced"] == 1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(errors) == 2
+    assert calls == [1]
+    assert cache.stats()["entries"] == 0
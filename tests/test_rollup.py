@@ -0,0 +1,135 @@
+import json
+
+import numpy as np
+
+import trade_columns
+from rollup import OhlcvRollup, RollupSet
+
+PAIR, EXCHANGE = 232, 27
+
+
+def add(rollup, ts_ms, price, amount=1.0, side="BUYSIDE"):
+    rollup.add(ts_ms, PAIR, EXCHANGE, side, price, amount)
+
+
+def test_a_bar_closes_once_the_watermark_passes_its_end_plus_grace():
+    rollup = OhlcvRollup(1000, grace_ms=500)
+    add(rollup, 10_100, 1.0)
+    add(rollup, 11_499, 2.0)
+    assert rollup.closed() == []
+    add(rollup, 11_500, 3.0)
+    [bar] = rollup.closed()
+    assert bar["bucketMs"] == 10_000
+    assert list(rollup.bars) == [(11_000, PAIR, EXCHANGE, "BUYSIDE")]
+
+
+def test_bar_values():
+    rollup = OhlcvRollup(60_000)
+    for ts_ms, price, amount in [(60_500, 10.0, 1.0), (60_100, 12.0, 2.0), (61_000, 8.0, 0.5), (61_000, 9.0, 3.0)]:
+        add(rollup, ts_ms, price, amount)
+    [bar] = rollup.flush()
+    assert bar["open"] == 12.0 and bar["openMs"] == 60_100
+    # a later trade with the same timestamp becomes the close
+    assert bar["close"] == 9.0 and bar["closeMs"] == 61_000
+    assert (bar["high"], bar["low"]) == (12.0, 8.0)
+    assert bar["tradeCount"] == 4
+    assert bar["volume"] == 6.5
+    assert bar["quoteVolume"] == 10.0 + 24.0 + 4.0 + 27.0
+    assert bar["sumPrice"] == 39.0
+    assert bar["maxAmount"] == 3.0
+
+
+def test_sides_and_exchanges_get_their_own_bars():
+    rollup = OhlcvRollup(1000)
+    add(rollup, 1_000, 1.0, side="BUYSIDE")
+    add(rollup, 1_000, 1.0, side="SELLSIDE")
+    rollup.add(1_000, PAIR, EXCHANGE + 1, "BUYSIDE", 1.0, 1.0)
+    assert len(rollup.flush()) == 3
+
+
+def test_a_late_trade_opens_a_partial_bar_that_closes_straight_away():
+    rollup = OhlcvRollup(1000, grace_ms=500)
+    add(rollup, 10_200, 1.0)
+    add(rollup, 12_000, 2.0)
+    [first] = rollup.closed()
+    add(rollup, 10_900, 5.0, amount=2.0)
+    [partial] = rollup.closed()
+    assert partial["bucketMs"] == first["bucketMs"] == 10_000
+    assert (partial["tradeCount"], partial["volume"], partial["open"]) == (1, 2.0, 5.0)
+    # the watermark did not move back
+    assert rollup.watermark == 12_000
+
+
+def test_add_bar_merges_finer_bars_into_the_coarser_bucket():
+    fine, coarse = OhlcvRollup(1000, grace_ms=0), OhlcvRollup(60_000, grace_ms=0)
+    for ts_ms, price in [(120_500, 3.0), (121_200, 7.0), (125_000, 1.0)]:
+        add(fine, ts_ms, price)
+    for bar in fine.flush():
+        coarse.add_bar(bar)
+    [bar] = coarse.flush()
+    assert bar["bucketMs"] == 120_000
+    assert (bar["open"], bar["close"], bar["high"], bar["low"]) == (3.0, 1.0, 7.0, 1.0)
+    assert (bar["openMs"], bar["closeMs"], bar["tradeCount"]) == (120_500, 125_000, 3)
+
+
+def test_add_bar_leaves_the_watermark_to_advance():
+    coarse = OhlcvRollup(60_000, grace_ms=0)
+    coarse.add_bar({"bucketMs": 0, "currencyPairId": PAIR, "exchangeId": EXCHANGE, "orderSide": "BUYSIDE",
+                    "open": 1.0, "high": 1.0, "low": 1.0, "close": 1.0, "openMs": 10, "closeMs": 10,
+                    "tradeCount": 1, "volume": 1.0, "quoteVolume": 1.0, "sumPrice": 1.0, "maxAmount": 1.0})
+    assert coarse.closed() == []
+    coarse.advance(60_000)
+    assert len(coarse.closed()) == 1
+
+
+def columns(trades):
+    ts, price, amount, side = zip(*trades)
+    return {
+        "tsMs": np.array(ts, dtype=np.int64),
+        "price": np.array(price, dtype=np.float64),
+        "amount": np.array(amount, dtype=np.float64),
+        "pairId": np.full(len(ts), PAIR, dtype=np.int64),
+        "exchangeId": np.full(len(ts), EXCHANGE, dtype=np.int64),
+        "side": np.array([trade_columns.SIDE_CODES[s] for s in side], dtype=np.int8),
+    }
+
+
+def collecting_rollups(grace_ms=1000):
+    emitted = {name: [] for name in ["1s", "1m"]}
+    sinks = {name: (lambda key, payload, name=name: emitted[name].append((key, json.loads(payload))))
+             for name in emitted}
+    return RollupSet(sinks, grace_ms=grace_ms), emitted
+
+
+def test_rollup_set_matches_rolling_up_each_trade():
+    rng = np.random.default_rng(7)
+    trades = [(int(ts), float(price), float(amount), side) for ts, price, amount, side in zip(
+        np.sort(rng.integers(0, 180_000, 500)), rng.uniform(1, 2, 500), rng.uniform(0, 1, 500),
+        rng.choice(["BUYSIDE", "SELLSIDE"], 500))]
+    rollups, emitted = collecting_rollups()
+    for start in range(0, len(trades), 50):
+        rollups.add_columns(columns(trades[start:start + 50]))
+    rollups.flush()
+
+    for name, resolution in [("1s", 1000), ("1m", 60_000)]:
+        expected = OhlcvRollup(resolution)
+        for ts_ms, price, amount, side in trades:
+            add(expected, ts_ms, price, amount, side)
+        key = lambda bar: (bar["bucketMs"], bar["orderSide"])
+        bars = sorted((bar for _, bar in emitted[name]), key=key)
+        want = sorted(expected.flush(), key=key)
+        assert [key(bar) for bar in bars] == [key(bar) for bar in want]
+        for bar, other in zip(bars, want):
+            assert bar["tradeCount"] == other["tradeCount"]
+            assert (bar["open"], bar["close"]) == (other["open"], other["close"])
+            assert np.isclose(bar["volume"], other["volume"])
+
+
+def test_coarser_bars_close_with_the_finest_watermark():
+    rollups, emitted = collecting_rollups(grace_ms=1000)
+    rollups.add_columns(columns([(59_500, 1.0, 1.0, "BUYSIDE")]))
+    rollups.add_columns(columns([(60_999, 1.0, 1.0, "BUYSIDE")]))
+    assert emitted["1m"] == []
+    rollups.add_columns(columns([(61_000, 1.0, 1.0, "BUYSIDE")]))
+    assert [bar["bucketMs"] for _, bar in emitted["1m"]] == [0]
+    assert [key for key, _ in emitted["1m"]] == [str(PAIR)]
@@ -0,0 +1,34 @@
+import time
+
+import rollup
+from producer_pipeline import producer_config
+
+
+def test_the_default_kafka_producer_factory_survives_spawn():
+    # nothing listens on port 1: the child only has to build its producer and report back
+    process = rollup.RollupProcess(["1s", "1m"], producer_config("localhost:1")).start()
+    process.stop(timeout=20)
+    assert process.produced == {rollup.topic_for("1s"): 0, rollup.topic_for("1m"): 0}
+    assert not process._process.is_alive()
+
+
+def slow_mock_producer(config):
+    import time
+
+    from trade_capture import MockProducer
+
+    time.sleep(3)
+    return MockProducer()
+
+
+def test_a_lagging_child_drops_batches_instead_of_blocking_submit():
+    process = rollup.RollupProcess(["1s"], {}, make_producer=slow_mock_producer, batch_size=1,
+                                   max_batches=2).start()
+    started = time.monotonic()
+    for _ in range(5):
+        process.submit([b"{}"])
+    assert time.monotonic() - started < 1
+    # the child sleeps before reading, so only max_batches batches fit
+    assert process.dropped == 3
+    process.stop(timeout=20)
+    assert process.produced == {rollup.topic_for("1s"): 0}
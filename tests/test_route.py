@@ -0,0 +1,76 @@
+import pytest
+
+import querydb
+from querydb import ROLLUP_LAG_MS, route
+
+NOW = 1_700_000_000_000 + 12_345
+ALL_ROLLUPS = {table: 0 for table, _ in querydb.ROLLUPS}
+RESOLUTION = dict(querydb.ROLLUPS)
+
+
+def assert_tiles(parts, start_ms, end_ms):
+    parts = sorted(parts, key=lambda part: part[1])
+    assert parts[0][1] == start_ms and parts[-1][2] == end_ms
+    for (_, _, end), (_, start, _) in zip(parts, parts[1:]):
+        assert end == start
+    for table, start, end in parts:
+        assert start < end
+        if table != "trades":
+            assert start % RESOLUTION[table] == 0 and end % RESOLUTION[table] == 0
+
+
+@pytest.mark.parametrize("minutes", [1, 5, 30, 24 * 60])
+def test_parts_tile_the_window(minutes):
+    start_ms = NOW - minutes * 60 * 1000
+    assert_tiles(route(start_ms, NOW, NOW, coverage=ALL_ROLLUPS), start_ms, NOW)
+
+
+def test_thirty_minutes_use_minute_bars_then_second_bars_then_raw_trades():
+    start_ms = NOW - 30 * 60 * 1000
+    assert sorted(route(start_ms, NOW, NOW, coverage=ALL_ROLLUPS), key=lambda part: part[1]) == [
+        ("trades", start_ms, 1_699_998_213_000),
+        ("trades_ohlcv_1s", 1_699_998_213_000, 1_699_998_240_000),
+        ("trades_ohlcv_1m", 1_699_998_240_000, 1_699_999_980_000),
+        ("trades_ohlcv_1s", 1_699_999_980_000, 1_700_000_002_000),
+        ("trades", 1_700_000_002_000, NOW),
+    ]
+
+
+def test_buckets_still_open_are_read_from_raw_trades():
+    for table, start, end in route(NOW - 30 * 60 * 1000, NOW, NOW, coverage=ALL_ROLLUPS):
+        if table != "trades":
+            assert end <= NOW - ROLLUP_LAG_MS
+
+
+def test_without_rollups_everything_is_raw():
+    assert route(NOW - 30 * 60 * 1000, NOW, NOW, coverage={}) == [("trades", NOW - 30 * 60 * 1000, NOW)]
+
+
+def test_short_windows_are_raw():
+    assert route(NOW - 5 * 1000, NOW, NOW, coverage=ALL_ROLLUPS) == [("trades", NOW - 5 * 1000, NOW)]
+
+
+def test_a_day_reaches_the_hour_rollup():
+    tables = {table for table, _, _ in route(NOW - 24 * 60 * 60 * 1000, NOW, NOW, coverage=ALL_ROLLUPS)}
+    assert "trades_ohlcv_1h" in tables
+
+
+def test_bucketed_results_skip_rollups_that_do_not_divide_the_bucket():
+    parts = route(NOW - 30 * 60 * 1000, NOW, NOW, granularity_ms=5000, coverage=ALL_ROLLUPS)
+    assert {table for table, _, _ in parts} == {"trades_ohlcv_1s", "trades"}
+
+
+def test_windows_before_a_rollup_starts_fall_through():
+    since = NOW - 10 * 60 * 1000
+    start_ms = NOW - 30 * 60 * 1000
+    parts = route(start_ms, NOW, NOW, coverage={"trades_ohlcv_1m": since})
+    assert_tiles(parts, start_ms, NOW)
+    assert all(start >= since for table, start, _ in parts if table == "trades_ohlcv_1m")
+    assert ("trades", start_ms, 1_699_999_440_000) in parts
+
+
+def test_past_windows_are_served_entirely_from_rollups():
+    end_ms = NOW - 60 * 60 * 1000
+    end_ms -= end_ms % 60_000
+    parts = route(end_ms - 30 * 60 * 1000, end_ms, NOW, coverage=ALL_ROLLUPS)
+    assert parts == [("trades_ohlcv_1m", end_ms - 30 * 60 * 1000, end_ms)]
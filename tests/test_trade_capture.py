@@ -0,0 +1,16 @@
+import time
+
+from cryptowatch.stream.proto.public.stream import stream_pb2
+
+from trade_capture import CaptureWriter, read_frames
+
+
+def test_frames_reach_the_file_while_the_feed_is_quiet(tmp_path):
+    path = str(tmp_path / "trades.cwcap")
+    writer = CaptureWriter(path, flush_seconds=0.05)
+    writer.write(stream_pb2.StreamMessage(), received_ns=1)
+    time.sleep(0.3)
+    try:
+        assert [received_ns for received_ns, _ in read_frames(path)] == [1]
+    finally:
+        writer.close()
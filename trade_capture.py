@@ -0,0 +1,262 @@
+import argparse
+import atexit
+import itertools
+import json
+import os
+import random
+import struct
+import threading
+import time
+import tracemalloc
+
+from cryptowatch.stream.proto.public.stream import stream_pb2
+
+# A capture file is MAGIC followed by frames of: receive time (ns since the
+# epoch), length, then the StreamMessage exactly as it came off the websocket
+MAGIC = b"CWTRADES1\n"
+_frame_header = struct.Struct("<qI")
+
+
+class CaptureWriter:
+    """
+        Appends trade updates to a capture file. Safe to call from the
+        websocket thread. Frames are buffered, and a background thread flushes
+        them to the OS every flush_seconds even when the feed goes quiet, so a
+        crash loses at most the last flush_seconds of updates; a frame cut
+        short is skipped by read_frames.
+    """
+
+    def __init__(self, path, flush_seconds=1.0):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "ab")
+        self._lock = threading.Lock()
+        if new:
+            self._file.write(MAGIC)
+        self.flush_seconds = flush_seconds
+        self.frames = 0
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name="capture-flush", daemon=True)
+        self._flusher.start()
+
+    def write(self, stream_message, received_ns=None):
+        data = stream_message.SerializeToString()
+        with self._lock:
+            self._file.write(_frame_header.pack(received_ns or time.time_ns(), len(data)))
+            self._file.write(data)
+            self.frames += 1
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_seconds):
+            with self._lock:
+                if not self._file.closed:
+                    self._file.flush()
+
+
+def recording(handler, path, flush_seconds=1.0):
+    """
+        Wraps an on_trades_update handler so every update is captured to path
+        before being handled. The file is flushed and closed at exit, or by
+        closing record_and_handle.writer where atexit handlers don't run.
+    """
+    writer = CaptureWriter(path, flush_seconds)
+    atexit.register(writer.close)
+
+    def record_and_handle(trade_update):
+        writer.write(trade_update)
+        handler(trade_update)
+
+    record_and_handle.writer = writer
+    return record_and_handle
+
+
+def read_frames(path):
+    """
+        (received_ns, StreamMessage) for every complete frame in the file
+    """
+    with open(path, "rb") as capture_file:
+        if capture_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trade capture file")
+        while True:
+            header = capture_file.read(_frame_header.size)
+            if len(header) < _frame_header.size:
+                return
+            received_ns, length = _frame_header.unpack(header)
+            data = capture_file.read(length)
+            if len(data) < length:
+                return
+            stream_message = stream_pb2.StreamMessage()
+            stream_message.ParseFromString(data)
+            yield received_ns, stream_message
+
+
+def generate(path, updates, rate, trades_per_update=5, pairs=2000, seed=42, start_ns=1648223402 * 10 ** 9):
+    """
+        Writes a synthetic capture of `updates` trade updates arriving at
+        `rate` per second, for when no live capture is at hand. Pairs are
+        drawn with a skew so a few markets dominate, as on the live feed.
+    """
+    rng = random.Random(seed)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(pairs)))
+    markets = [(rng.randint(1, 200), rng.randint(1, 200000), rng.randint(1, 100000)) for _ in range(pairs)]
+    writer = CaptureWriter(path)
+    received_ns = start_ns
+    for _ in range(updates):
+        received_ns += int(rng.expovariate(rate) * 10 ** 9)
+        stream_message = stream_pb2.StreamMessage()
+        market = stream_message.marketUpdate.market
+        market.exchangeId, market.currencyPairId, market.marketId = rng.choices(markets, cum_weights=cum_weights)[0]
+        for i in range(rng.randint(1, 2 * trades_per_update - 1)):
+            trade = stream_message.marketUpdate.tradesUpdate.trades.add()
+            trade.externalId = str(rng.randint(1, 10 ** 10))
+            trade.timestamp = received_ns // 10 ** 9
+            trade.timestampNano = received_ns + i
+            trade.priceStr = f"{rng.uniform(0.01, 50000):.3f}"
+            trade.amountStr = f"{rng.uniform(0.0001, 100):.4f}"
+            trade.orderSide = rng.choice([0, 1, 2])
+        writer.write(stream_message, received_ns)
+    writer.close()
+
+
+def replay(frames, handler, speed=None):
+    """
+        Calls handler with every captured update. speed=1 keeps the recorded
+        gaps between updates, speed=N plays N times faster and speed=None
+        runs flat out. Returns per-update handler latencies in ms and the
+        number of trades handled.
+    """
+    latencies = []
+    trades = 0
+    first_received = started = None
+    for received_ns, stream_message in frames:
+        if speed:
+            if first_received is None:
+                first_received, started = received_ns, time.perf_counter()
+            delay = started + (received_ns - first_received) / 10 ** 9 / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        start = time.perf_counter_ns()
+        handler(stream_message)
+        latencies.append((time.perf_counter_ns() - start) / 10 ** 6)
+        trades += len(stream_message.marketUpdate.tradesUpdate.trades)
+    return latencies, trades
+
+
+class MockProducer:
+    """
+        Stands in for confluent_kafka.Producer: keeps message counts and
+        bytes per topic, and acks every message on the next poll() or flush()
+    """
+
+    def __init__(self, config=None):
+        self._pending = []
+        self.messages = {}
+        self.bytes = {}
+
+    def produce(self, topic, key=None, value=None, callback=None):
+        self.messages[topic] = self.messages.get(topic, 0) + 1
+        self.bytes[topic] = self.bytes.get(topic, 0) + len(value) + len(key or "")
+        if callback is not None:
+            self._pending.append(callback)
+
+    def poll(self, timeout=0):
+        pending, self._pending = self._pending, []
+        for callback in pending:
+            callback(None, None)
+        return len(pending)
+
+    def flush(self, timeout=None):
+        self.poll()
+        return 0
+
+    def __len__(self):
+        return len(self._pending)
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return round(sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))], 3)
+
+
+def benchmark(path, speed=None, trace_allocations=False, top=10):
+    """
+        Replays a capture through stream.handle_trades_update into a
+        MockProducer and reports handler throughput, latency and allocations
+    """
+    import stream
+
+    frames = list(read_frames(path))
+    producer = MockProducer()
+    stream.start_pipeline(producer=producer, make_rollup_producer=MockProducer)
+
+    if trace_allocations:
+        tracemalloc.start(25)
+        baseline = tracemalloc.take_snapshot()
+    started = time.perf_counter()
+    latencies, trades = replay(frames, stream.handle_trades_update, speed)
+    elapsed = time.perf_counter() - started
+    if trace_allocations:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    stream.stop_pipeline()
+
+    latencies.sort()
+    report = {
+        "updates": len(frames),
+        "trades": trades,
+        "seconds": round(elapsed, 3),
+        "tradesPerSec": round(trades / elapsed),
+        "handlerMsP50": _percentile(latencies, 0.50),
+        "handlerMsP99": _percentile(latencies, 0.99),
+        "handlerMsMax": round(latencies[-1], 3) if latencies else None,
+        "pipeline": stream.pipeline.stats(),
+        "messages": {**producer.messages, **((stream.rollups and stream.rollups.produced) or {})},
+        "bytes": producer.bytes,
+        "rollupTradesDropped": stream.rollups.dropped if stream.rollups else 0,
+    }
+    if trace_allocations:
+        report["tracemallocPeakBytes"] = peak
+        report["topAllocations"] = [str(stat) for stat in snapshot.compare_to(baseline, "lineno")[:top]]
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Record, generate and replay cryptowatch trade updates")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="Capture the live trades stream (needs KEY)")
+    record_parser.add_argument("path")
+    record_parser.add_argument("--subscription", action="append", default=None)
+
+    generate_parser = commands.add_parser("generate", help="Write a synthetic capture")
+    generate_parser.add_argument("path")
+    generate_parser.add_argument("--updates", type=int, default=100000)
+    generate_parser.add_argument("--rate", type=float, default=500, help="Updates per second")
+    generate_parser.add_argument("--trades-per-update", type=int, default=5)
+    generate_parser.add_argument("--seed", type=int, default=42)
+
+    replay_parser = commands.add_parser("replay", help="Benchmark stream.py on a capture")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("--speed", type=float, default=0,
+                               help="1 for the recorded rate, N for N times faster, 0 for flat out")
+    replay_parser.add_argument("--tracemalloc", action="store_true", help="Report allocations (slower)")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        import cryptowatch as cw
+        cw.api_key = os.environ.get("KEY")
+        cw.stream.subscriptions = args.subscription or ["markets:*:trades"]
+        cw.stream.on_trades_update = recording(lambda trade_update: None, args.path)
+        cw.stream.connect()
+    elif args.command == "generate":
+        generate(args.path, args.updates, args.rate, args.trades_per_update, seed=args.seed)
+    else:
+        print(json.dumps(benchmark(args.path, args.speed or None, args.tracemalloc), indent=2))
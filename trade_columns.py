@@ -0,0 +1,73 @@
+import json
+
+import numpy as np
+
+from avro_codec import RecordCodec
+from schema_registry import FileSchemaRegistry
+
+# orderSide code in a column batch -> the value Pinot stores (absent is "null")
+ORDER_SIDES = np.array(["null", "BUYSIDE", "SELLSIDE"], dtype=object)
+SIDE_CODES = {"BUYSIDE": 1, "SELLSIDE": 2}
+
+
+# a trade without one of these can't be placed in a window or a bar
+REQUIRED_FIELDS = ("ts", "price", "amount", "currencyPairId", "exchangeId")
+
+
+def json_columns(payloads):
+    """
+        Columns from JSON trades as stream.py publishes them. The batch is
+        parsed as one JSON array, which is much cheaper than a loads() each;
+        only a batch holding a payload that isn't JSON is parsed one by one.
+    """
+    try:
+        trades = json.loads(b"[" + b",".join(payloads) + b"]")
+    except ValueError:
+        trades = [_loads_or_none(payload) for payload in payloads]
+    return _columns(trades)
+
+
+def avro_columns(codec):
+    def columns(payloads):
+        trades = []
+        for payload in payloads:
+            try:
+                trades.append(codec.decode(payload))
+            except Exception:
+                trades.append(None)
+        return _columns(trades)
+    return columns
+
+
+def _loads_or_none(payload):
+    try:
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+def _columns(trades):
+    """
+        Skips trades that aren't objects or lack a REQUIRED_FIELDS value, so
+        one malformed record costs only itself
+    """
+    trades = [trade for trade in trades
+              if isinstance(trade, dict) and all(trade.get(field) is not None for field in REQUIRED_FIELDS)]
+    return {
+        "tsMs": np.array([int(trade["ts"]) * 1000 for trade in trades], dtype=np.int64),
+        "price": np.array([trade["price"] for trade in trades], dtype=np.float64),
+        "amount": np.array([trade["amount"] for trade in trades], dtype=np.float64),
+        "pairId": np.array([trade["currencyPairId"] for trade in trades], dtype=np.int64),
+        "exchangeId": np.array([trade["exchangeId"] for trade in trades], dtype=np.int64),
+        "side": np.array([SIDE_CODES.get(trade.get("orderSide"), 0) for trade in trades], dtype=np.int8),
+    }
+
+
+def decoder(wire_format):
+    """
+        Returns (topic, decode) for a wire format name: json or avro.
+        decode turns a list of payloads into a dict of NumPy columns.
+    """
+    if wire_format == "avro":
+        return "trades-avro", avro_columns(RecordCodec(FileSchemaRegistry().latest("trades")[1]))
+    return "trades", json_columns
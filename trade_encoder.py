@@ -0,0 +1,145 @@
+import functools
+import json
+
+from cryptowatch.stream.proto.public.markets import market_pb2
+
+from avro_codec import RecordCodec, encode_long
+from partitioning import pair_key
+from schema_registry import FileSchemaRegistry
+
+# Same payload layout the MessageToJson -> json.loads -> replace_keys path
+# produced: proto3 JSON drops default values and renders 64-bit ints as strings.
+ORDER_SIDES = {
+    value.number: value.name
+    for value in market_pb2.Trade.DESCRIPTOR.fields_by_name["orderSide"].enum_type.values
+    if value.number != 0
+}
+
+_encoder = json.JSONEncoder(ensure_ascii=False)
+
+
+def market_fields(market):
+    fields = {}
+    if market.exchangeId:
+        fields["exchangeId"] = str(market.exchangeId)
+    if market.currencyPairId:
+        fields["currencyPairId"] = str(market.currencyPairId)
+    if market.marketId:
+        fields["marketId"] = str(market.marketId)
+    if market.exchange:
+        fields["exchange"] = market.exchange
+    if market.currencyPair:
+        fields["currencyPair"] = market.currencyPair
+    return fields
+
+
+def trade_messages(trade_update, received_ms=None):
+    """
+        Reads trades straight off a Cryptowatch StreamMessage and yields one
+        dict per trade, keyed the way the `trades` topic expects.
+        received_ms is when stream.py got the update off the websocket.
+    """
+    market_update = trade_update.marketUpdate
+    market = market_fields(market_update.market)
+
+    for trade in market_update.tradesUpdate.trades:
+        message = {}
+        if trade.externalId:
+            message["externalId"] = trade.externalId
+        if trade.orderSide:
+            message["orderSide"] = ORDER_SIDES[trade.orderSide]
+        message.update(market)
+        message["ts"] = str(trade.timestamp)
+        message["price"] = trade.priceStr
+        message["amount"] = trade.amountStr
+        message["tsNano"] = str(trade.timestampNano)
+        if received_ms is not None:
+            message["receivedMs"] = str(received_ms)
+        yield message
+
+
+def encode(message):
+    return _encoder.encode(message).encode('utf-8')
+
+
+def encode_trades(trade_update, received_ms=None, key_for=pair_key):
+    """
+        Yields (key, payload) pairs ready to hand to producer.produce
+    """
+    for message in trade_messages(trade_update, received_ms):
+        yield key_for(message), encode(message)
+
+
+def stamp_produced(payload, produced_ms):
+    """
+        Adds producedMs to an encoded JSON trade without decoding it, as the
+        producer thread hands it to Kafka
+    """
+    return b'%s,"producedMs":"%d"}' % (payload[:-1], produced_ms)
+
+
+def typed_trade_records(trade_update, received_ms=None):
+    """
+        Like trade_messages, but with numeric fields as numbers, for the
+        binary wire format
+    """
+    market_update = trade_update.marketUpdate
+    market = market_update.market
+    exchange_id, currency_pair_id, market_id = market.exchangeId, market.currencyPairId, market.marketId
+
+    for trade in market_update.tradesUpdate.trades:
+        yield {
+            "externalId": trade.externalId,
+            "orderSide": ORDER_SIDES.get(trade.orderSide),
+            "exchangeId": exchange_id,
+            "currencyPairId": currency_pair_id,
+            "marketId": market_id,
+            "ts": trade.timestamp,
+            "price": float(trade.priceStr),
+            "amount": float(trade.amountStr),
+            "tsNano": trade.timestampNano,
+            "receivedMs": received_ms or 0,
+            # placeholder, see AvroTradeEncoder.stamp_produced
+            "producedMs": 0,
+        }
+
+
+class AvroTradeEncoder:
+    """
+        Encodes trades as schemaless Avro using the latest schema registered
+        for subject
+    """
+
+    def __init__(self, registry=None, subject="trades", key_for=pair_key):
+        registry = registry or FileSchemaRegistry()
+        self.version, schema = registry.latest(subject)
+        self.codec = RecordCodec(schema)
+        self.key_for = key_for
+
+    def encode_trades(self, trade_update, received_ms=None):
+        encode, key_for = self.codec.encode, self.key_for
+        for record in typed_trade_records(trade_update, received_ms):
+            yield key_for(record), encode(record)
+
+    def stamp_produced(self, payload, produced_ms):
+        """
+            producedMs is the schema's last field and encoded as 0, a single
+            zero byte, so it can be swapped for the real value in place.
+            Schemas before v2 don't have it.
+        """
+        if self.codec.field_names[-1] != "producedMs":
+            return payload
+        return payload[:-1] + encode_long(produced_ms)
+
+
+def wire_format(name, key_for=pair_key):
+    """
+        Returns (topic, encode_trades, stamp_produced) for a wire format name:
+        json or avro
+    """
+    if name == "json":
+        return "trades", functools.partial(encode_trades, key_for=key_for), stamp_produced
+    if name == "avro":
+        encoder = AvroTradeEncoder(key_for=key_for)
+        return "trades-avro", encoder.encode_trades, encoder.stamp_produced
+    raise ValueError(f"Unknown wire format {name!r}, expected json or avro")